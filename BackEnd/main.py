@@ -6,10 +6,14 @@ import time
 
 import pandas as pd
 from pipelines import calculate_LTV_and_Plot, readCSV, load_model
+from src.DataBase.ModelArtifacts import ArtifactError
 from src.DataTransformation.RFM import RFMTask
+from src.DataBase.TransactionIndex import TransactionIndex
 
 # Caminho para o arquivo de resultados persistentes
 RESULTS_FILE = './output/results.json'
+# Pasta do índice das transações por cliente (usado para buscar as compras de um cliente)
+TRANSACTION_INDEX_DIR = './output/transaction_index'
 
 # Função para salvar os resultados no arquivo JSON
 def save_results(csv_file_path, dfLTV_path, dfOriginal_path, weeksAhead, columns=None):
@@ -59,6 +63,7 @@ columns = None
 weeksAhead = None
 dfLTV = None
 dfOriginal = None
+transactionIndex = None
 
 # Variável global para mensagens de progresso
 app.config['PROGRESS_MESSAGES'] = []
@@ -152,6 +157,7 @@ def submit_form():
     global dfLTV
     global dfOriginal
     global columns
+    global transactionIndex
 
     try:
         if csv_file_path is None:
@@ -162,9 +168,19 @@ def submit_form():
         data['weeksAhead'] = int(data['weeksAhead'])
 
         # Calcular os DataFrames
-        dfLTV = calculate_LTV_and_Plot(
-            data, csv_file_path, data['idColumn'], data['dateColumn'], data['amountColumn'], data["weeksAhead"]
-        )
+        # Reaproveita os modelos já ajustados para essa base e essas propriedades, se existirem (com BG/NBD ou Pareto
+        # o horizonte weeksAhead não muda o ajuste). Sem artefato, ou com um artefato que não pode ser carregado,
+        # ajusta de novo
+        try:
+            dfLTV = calculate_LTV_and_Plot(
+                data, csv_file_path, data['idColumn'], data['dateColumn'], data['amountColumn'], isScoreOnly=True
+            )
+        except ArtifactError as error:
+            print(f"Ajustando os modelos: {error}")
+            dfLTV = calculate_LTV_and_Plot(
+                data, csv_file_path, data['idColumn'], data['dateColumn'], data['amountColumn']
+            )
+        # O CSV já foi processado pelo pipeline acima, então aqui ele é lido do cache
         dfOriginal = readCSV(
             csv_file_path, data['idColumn'], data['dateColumn'], data['amountColumn']
         )
@@ -183,6 +199,10 @@ def submit_form():
         dfOriginal_path = './output/dfOriginal.csv'
         dfLTV.to_csv(dfLTV_path, index=True)
         dfOriginal.to_csv(dfOriginal_path, index=True)
+
+        # Índice das transações por cliente, para que /cliente/<id> não precise varrer o dfOriginal
+        transactionIndex = TransactionIndex.from_frame(dfOriginal)
+        transactionIndex.save(TRANSACTION_INDEX_DIR)
         
         # Salvar os caminhos e weeksAhead no arquivo results.json
         save_results(csv_file_path, dfLTV_path,
@@ -214,20 +234,19 @@ def get_clientes():
 @app.route('/cliente/<int:id>', methods=['GET'])
 def get_cliente(id):
     global dfLTV
-    global dfOriginal
+    global transactionIndex
 
-    if dfLTV is None or dfOriginal is None:
+    if dfLTV is None or transactionIndex is None:
         results = load_results()
-        if results and os.path.exists(results['dfLTV_path']) and os.path.exists(results['dfOriginal_path']):
+        if results and os.path.exists(results['dfLTV_path']) and os.path.exists(TRANSACTION_INDEX_DIR):
             dfLTV = pd.read_csv(results['dfLTV_path'])
-            dfOriginal = pd.read_csv(results['dfOriginal_path'])
+            transactionIndex = TransactionIndex.load(TRANSACTION_INDEX_DIR)
         else:
             return jsonify({"error": "O cálculo do LTV ainda não foi realizado.<br />Por favor, volte à tela 'Modelo' e envie as informações para continuar."}), 400
 
     cliente = dfLTV[dfLTV['id'] == id].to_dict(orient='records')
     if cliente:
-        compras_cliente = dfOriginal[dfOriginal['id'] == id]
-        compras_cliente = compras_cliente.reset_index(drop=True)
+        compras_cliente = transactionIndex.customer(id)
         compras_cliente['id_transaction'] = compras_cliente.index
         compras_cliente['date'] = pd.to_datetime(
             compras_cliente['date'], errors='coerce').dt.strftime('%d/%m/%Y')
@@ -4,21 +4,47 @@ import pandas as pd
 from src.workflows.pipeline import Pipeline
 
 from src.DataBase.CsvRead import CsvReadTask
+from src.DataBase.Cache import FrameCache, dataset_fingerprint
+from src.DataBase.ModelArtifacts import ArtifactError, ModelArtifactStore
 from src.DataTransformation.RFM import RFMTask
 from src.LTV.LtvModel import LTVTask
+from src.LTV.Bootstrap import BootstrapLTVTask
+from src.LTV.Simulation import SimulationLTVTask
+from src.TrasactionModels.TransactionModel import TransactionModelTask
+from src.GenericModels.PenalizerSweep import PenalizerSweepTask
 
 from src.DataVisualization.Plot import PlotTask
 
-
-def readCSV(file_path="output/data/transactions.csv", columnID="customer_id", columnDate="date", columnMonetary="amount"):
+# Pasta do cache dos CSVs já processados (evita ler o mesmo arquivo mais de uma vez)
+CACHE_DIR = "output/cache"
+# Parâmetros do último ajuste de cada modelo em cada base, usados como ponto inicial do próximo ajuste
+PARAMS_STORE = "output/params/models.json"
+# Modelos já ajustados, reaproveitados pelo modo só de predição (isScoreOnly)
+ARTIFACT_DIR = "output/models"
+# Candidatos de Machine Learning já treinados, reaproveitados quando só o que vem depois do treino muda
+CANDIDATE_CACHE = "output/ml_candidates"
+# Configuração padrão dos modelos (versionada, não é alterada pelas execuções)
+MODELS_FILE = os.path.join(os.path.dirname(__file__), "jsons", "Models.json")
+# Props dos modelos ajustadas em execução (Ex: o penalizer do tune_penalizer), com prioridade sobre as do Models.json
+MODEL_OVERRIDES = "output/params/model_overrides.json"
+# Períodos de cada janela de holdout do RFM de treino com os modelos de frequência do lifetimes (BG/NBD e Pareto). O
+# ajuste deles não depende do horizonte da predição (weeksAhead), então mudar o horizonte reaproveita os modelos já
+# ajustados. O modelo de frequência de Machine Learning treina com a janela do próprio horizonte
+TRAINING_PERIODS = 3
+# Propriedades que não mudam o ajuste do modelo, e por isso não entram na chave do artefato (numPeriods é o horizonte
+# da predição, a janela do treino entra na chave como trainingPeriods)
+SCORING_PROPS = {"name", "numPeriods", "isRating", "paramsStore", "datasetKey", "horizons", "nJobs", "candidateCache"}
+
+
+def readCSV(file_path="output/data/transactions.csv", columnID="customer_id", columnDate="date", columnMonetary="amount", cacheDir=CACHE_DIR):
     read_dt = CsvReadTask("read_dt", file_path, columnID,
-                          columnDate, columnMonetary)
+                          columnDate, columnMonetary, cacheDir=cacheDir)
     df = read_dt.run()
 
     return df
 
 
-def calculate_LTV_and_Plot(data, file_path="output/data/transactions.csv", columnID="customer_id", columnDate="date", columnMonetary="amount", numPeriods=3):
+def calculate_LTV_and_Plot(data, file_path="output/data/transactions.csv", columnID="customer_id", columnDate="date", columnMonetary="amount", trainingPeriods=TRAINING_PERIODS, cacheDir=CACHE_DIR, paramsStore=PARAMS_STORE, artifactDir=ARTIFACT_DIR, isScoreOnly=False, candidateCache=CANDIDATE_CACHE):
     """ Para adicionar um novo modelo, siga os seguintes passos:
          1. Criar a Classe do Modelo:
          - A classe deve ser criada no arquivo correspondente:
@@ -39,55 +65,136 @@ def calculate_LTV_and_Plot(data, file_path="output/data/transactions.csv", colum
              - Exemplo:
                  model = load_model("frequencyModels",
                                     "NovoModeloID", {"param": 20})
+
+         Os modelos ajustados são salvos em `artifactDir`, indexados pelo hash da base e pelas propriedades do modelo.
+         Com isScoreOnly=True os modelos são carregados desses artefatos e o pipeline só calcula o RFM da predição, as
+         predições e o LTV (sem o RFM de treino e sem ajustar os modelos). Se não há artefato (ou ele não pode ser
+         carregado) é lançado um ArtifactError.
+
+         O horizonte da predição é data["weeksAhead"], e trainingPeriods é o tamanho das janelas de holdout do RFM de
+         treino. Com BG/NBD ou Pareto os dois são independentes e mudar só o horizonte usa os mesmos artefatos. O
+         modelo de frequência de Machine Learning aprende as compras da janela de holdout, então treina com
+         weeksAhead no lugar de trainingPeriods (e um novo horizonte é um novo ajuste)
      """
+    assert not isScoreOnly or artifactDir, "isScoreOnly requires an artifactDir"
     daysAhead = data["weeksAhead"]
+    read_dt = CsvReadTask("read_dt", file_path,
+                          columnID, columnDate, columnMonetary, cacheDir=cacheDir)
+    # Hash do conteúdo da base: chave do warm start e dos artefatos (o mesmo caminho com outros dados não reaproveita
+    # nada, e os mesmos dados em outro caminho reaproveitam)
+    fingerprint = None
+    if paramsStore or artifactDir:
+        fingerprint = dataset_fingerprint(read_dt.list_files(), FrameCache(cacheDir) if cacheDir else None)
     # Criando modelos dinâmicos e passando numPeriods apenas quando necessário
     transactionModel = load_model(
         "frequencyModels",
         data["frequencyModel"],
         # Se o modelo aceitar essa prop, ela será usada
-        {"numPeriods": daysAhead},
+        {"numPeriods": daysAhead, "paramsStore": paramsStore, "datasetKey": fingerprint,
+         "horizons": data.get("horizons"), "candidateCache": candidateCache},
     )
+    if not isinstance(transactionModel, TransactionModelTask):
+        # O target do modelo de Machine Learning são as compras na janela de holdout, então a janela é o horizonte
+        trainingPeriods = daysAhead
 
     monetaryModel = load_model(
         "monetaryModels",
         data["monetaryModel"],
         # Se o modelo aceitar essa prop, ela será usada
-        {"numPeriods": daysAhead},
+        {"numPeriods": daysAhead, "paramsStore": paramsStore, "datasetKey": fingerprint,
+         "candidateCache": candidateCache},
     )
     
     with Pipeline() as pipeline:
-        read_dt = CsvReadTask("read_dt", file_path,
-                              columnID, columnDate, columnMonetary)
-        rfm_training = RFMTask("data_training", predictInterval=numPeriods, isTraining=True, isRating=False)
+        pipeline.add_task(read_dt)
         rfm_predict = RFMTask("data_predict", isRating=True, isTraining=False)
-        ltv = LTVTask("calculo_ltv", columnFrequency="ExpectedFrequency",
-                      columnMonetary="ExpectedMonetary")
+        # Com data["horizons"] (Ex: [4, 13, 26, 52]) o LTV também é calculado para cada horizonte na mesma execução.
+        # Com data["isDiscountedCashFlow"] o LTV soma as compras esperadas de cada período descontadas (BG/NBD e Pareto)
+        # O LTV desconta (e o fluxo de caixa descontado soma) os mesmos daysAhead períodos previstos pelos modelos, e o
+        # bootstrap e a simulação usam o numPeriods do LTVTask
+        ltv = LTVTask("calculo_ltv", columnFrequency="ExpectedFrequency", columnMonetary="ExpectedMonetary",
+                      numPeriods=daysAhead, horizons=getattr(transactionModel, "horizons", None),
+                      isDiscountedCashFlow=data.get("isDiscountedCashFlow", False), transactionModel=transactionModel)
 
         plot_data = PlotTask("plot", plot_all=True, save_outliers_plots=False)
 
         # Lembrando (>> só associa, executa apenas apos rodar pipeline.run())
-        read_dt >> rfm_training
         read_dt >> rfm_predict
-        rfm_training >> transactionModel
         rfm_predict >> transactionModel
-        rfm_training >> monetaryModel
         rfm_predict >> monetaryModel
-        transactionModel >> monetaryModel >> ltv >> plot_data
+        if not isScoreOnly:
+            rfm_training = RFMTask("data_training", predictInterval=trainingPeriods, isTraining=True, isRating=False)
+            read_dt >> rfm_training
+            rfm_training >> transactionModel
+            rfm_training >> monetaryModel
+        transactionModel >> monetaryModel >> ltv
+        if data.get("bootstrapReplicates"):
+            # Intervalos do LTV de cada cliente (colunas LTV_p5, LTV_p50 e LTV_p95), reajustando os modelos em cada réplica
+            bootstrap = BootstrapLTVTask("bootstrap_ltv", transactionModel, monetaryModel, ltv,
+                                         nReplicates=data["bootstrapReplicates"])
+            ltv >> bootstrap
+            last = bootstrap
+        else:
+            last = ltv
+        if data.get("simulations"):
+            # Distribuição do LTV simulado (colunas SimulatedFrequency, SimulatedLTV e SimulatedLTV_p5/_p50/_p95)
+            simulation = SimulationLTVTask("simulation_ltv", transactionModel, monetaryModel, ltv,
+                                           nSimulations=data["simulations"])
+            last >> simulation
+            last = simulation
+        last >> plot_data
+
+    if artifactDir:
+        artifacts = ModelArtifactStore(artifactDir)
+        models = [
+            (transactionModel, artifacts.key(fingerprint, trainingPeriods, "frequencyModels", data["frequencyModel"],
+                                             fit_props("frequencyModels", data["frequencyModel"]))),
+            (monetaryModel, artifacts.key(fingerprint, trainingPeriods, "monetaryModels", data["monetaryModel"],
+                                          fit_props("monetaryModels", data["monetaryModel"]))),
+        ]
+        if isScoreOnly:
+            for model, key in models:
+                try:
+                    model.load_artifact(artifacts.load(key))
+                except (KeyError, AttributeError, TypeError, ValueError) as error:
+                    # Artefato de uma versão antiga do modelo
+                    raise ArtifactError(f"Model artifact {key} cannot be used: {error!r}") from error
 
     # Retorna um Dicionario com o nome da Task e o DataFrame
     df = pipeline.run()['plot']
 
+    if artifactDir and not isScoreOnly:
+        for model, key in models:
+            version = artifacts.save(key, model.to_artifact(), {"model": type(model).__name__, "fingerprint": fingerprint})
+            print(f"Saved {type(model).__name__} artifact {key} (v{version})")
+
     return df
 
 
-def load_model(model_type, model_id, custom_props=None, data_predict=None):
-    """Carrega e inicializa um modelo baseado no JSON e adiciona parâmetros personalizados apenas se necessário
-        Se o parâmetro adicionado não for definido no modelo, ele será ignorado. """
+def tune_penalizer(data, model_type, file_path="output/data/transactions.csv", columnID="customer_id", columnDate="date", columnMonetary="amount", trainingPeriods=TRAINING_PERIODS, penalizers=(0.0, 0.001, 0.01, 0.1, 1.0), nJobs=None, cacheDir=CACHE_DIR, overridesFile=MODEL_OVERRIDES):
+    """ Busca o penalizer do modelo escolhido em data (data["frequencyModel"] para "frequencyModels" e
+        data["monetaryModel"] para "monetaryModels") pelo erro no holdout do RFM de treino, e grava o melhor valor em
+        overridesFile, cujas props o load_model usa no lugar das do Models.json (overridesFile=None não grava)
+     """
+    model_id = data["frequencyModel"] if model_type == "frequencyModels" else data["monetaryModel"]
+    model = load_model(model_type, model_id)
+
+    with Pipeline() as pipeline:
+        read_dt = CsvReadTask("read_dt", file_path,
+                              columnID, columnDate, columnMonetary, cacheDir=cacheDir)
+        rfm_training = RFMTask("data_training", predictInterval=trainingPeriods, isTraining=True, isRating=False)
+        sweep = PenalizerSweepTask("penalizer_sweep", model, penalizers, nJobs=nJobs,
+                                   overridesFile=overridesFile, modelType=model_type, modelId=model_id)
 
-    json_path = os.path.join(os.path.dirname(__file__), "jsons", "Models.json")
+        read_dt >> rfm_training >> sweep
 
-    with open(json_path, "r") as file:
+    return pipeline.run()["penalizer_sweep"]
+
+
+def load_model_config(model_type, model_id):
+    """Configuração de um modelo no Models.json, com as props de MODEL_OVERRIDES"""
+
+    with open(MODELS_FILE, "r") as file:
         models_data = json.load(file)
 
     # Encontrar a lista correta (frequencyModels ou monetaryModels)
@@ -99,6 +206,26 @@ def load_model(model_type, model_id, custom_props=None, data_predict=None):
     if not model_config:
         raise ValueError(f"Modelo '{model_id}' não encontrado no JSON!")
 
+    # Props ajustadas em execução (Ex: pelo tune_penalizer)
+    if os.path.exists(MODEL_OVERRIDES):
+        with open(MODEL_OVERRIDES, "r") as file:
+            model_config["props"].update(json.load(file).get(model_type, {}).get(model_id, {}))
+
+    return model_config
+
+
+def fit_props(model_type, model_id):
+    """Propriedades do modelo que mudam o ajuste (usadas na chave dos artefatos)"""
+    props = load_model_config(model_type, model_id)["props"]
+    return {key: value for key, value in props.items() if key not in SCORING_PROPS}
+
+
+def load_model(model_type, model_id, custom_props=None, data_predict=None):
+    """Carrega e inicializa um modelo baseado no JSON e adiciona parâmetros personalizados apenas se necessário
+        Se o parâmetro adicionado não for definido no modelo, ele será ignorado. """
+
+    model_config = load_model_config(model_type, model_id)
+
     # Executa o import dinâmico do chamador
     exec(model_config["importer"], globals())
 
@@ -133,7 +260,7 @@ def __use_calculate():
     
 
     df = calculate_LTV_and_Plot(data, csv_file_path,
-                                data['idColumn'], data['dateColumn'], data['amountColumn'], data['weeksAhead'])
+                                data['idColumn'], data['dateColumn'], data['amountColumn'])
 
     # Salvar esse df em um arquivo 
     output_file_path = "output/ltv_results.csv"
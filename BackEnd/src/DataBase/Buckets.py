@@ -0,0 +1,200 @@
+from pathlib import Path
+import json
+import math
+import shutil
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:  # sem pyarrow o modo fora da memória não está disponível
+    pa = None
+    feather = None
+
+
+# Estimativa de memória por transação durante o cálculo do RFM de um bucket (colunas, índice por cliente,
+# períodos e somas acumuladas), usada para escolher o número de buckets
+BYTES_PER_ROW = 160
+
+
+class TransactionBuckets:
+    """
+        Transações particionadas em disco pelo hash do identificador do cliente. Todas as transações de um cliente
+        ficam no mesmo bucket, então o RFM pode ser calculado bucket a bucket com memória limitada ao tamanho
+        de um bucket, independente do tamanho da base.
+
+        Cada bloco lido é dividido entre os buckets e gravado como uma parte Feather do bucket, sem reescrever o que
+        já foi gravado.
+    """
+
+    META = "buckets.json"
+
+    def __init__(self, directory: str | Path, nBuckets: int) -> None:
+        assert feather is not None, "Out-of-core mode requires pyarrow"
+        self.directory = Path(directory)
+        self.nBuckets = nBuckets
+        self.parts = 0
+        self.rows = 0
+        self.minDate = None
+        self.maxDate = None
+
+    @classmethod
+    def create(cls, directory: str | Path, nBuckets: int):
+        """
+            Cria buckets vazios (apagando os buckets que já existiam na pasta)
+        """
+        directory = Path(directory)
+        if (directory / cls.META).exists():
+            shutil.rmtree(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        return cls(directory, nBuckets)
+
+    @classmethod
+    def open(cls, directory: str | Path):
+        directory = Path(directory)
+        with open(directory / cls.META, "r") as file:
+            meta = json.load(file)
+        buckets = cls(directory, meta["nBuckets"])
+        buckets.parts = meta["parts"]
+        buckets.rows = meta["rows"]
+        buckets.minDate = pd.Timestamp(meta["minDate"]) if meta["minDate"] else None
+        buckets.maxDate = pd.Timestamp(meta["maxDate"]) if meta["maxDate"] else None
+        return buckets
+
+    @staticmethod
+    def buckets_for(estimatedRows: int, memoryLimit: float) -> int:
+        """
+            Número de buckets para que o RFM de um bucket caiba em memoryLimit (MB)
+        """
+        return max(1, math.ceil(estimatedRows * BYTES_PER_ROW / (memoryLimit * 2**20)))
+
+    def __len__(self) -> int:
+        return self.nBuckets
+
+    def bucket_of(self, ids: pd.Series) -> np.ndarray:
+        # Hash do valor (e não do código categórico), para o mesmo cliente cair sempre no mesmo bucket
+        return (pd.util.hash_array(np.asarray(ids)) % np.uint64(self.nBuckets)).astype(np.int64)
+
+    def append(self, df: pd.DataFrame) -> None:
+        """
+            Divide um bloco de transações normalizadas (id/date/monetary) entre os buckets
+        """
+        if df.empty:
+            return
+        buckets = self.bucket_of(df["id"])
+        order = np.argsort(buckets, kind="stable")
+        bounds = np.searchsorted(buckets[order], np.arange(self.nBuckets + 1))
+
+        for bucket in np.flatnonzero(np.diff(bounds)):
+            part = df.iloc[order[bounds[bucket]:bounds[bucket + 1]]]
+            path = self.directory / f"bucket_{bucket:05d}"
+            path.mkdir(exist_ok=True)
+            feather.write_feather(part.reset_index(drop=True), path / f"part_{self.parts:06d}.feather",
+                                  compression="uncompressed")
+
+        self.parts += 1
+        self.rows += len(df)
+        minDate, maxDate = df["date"].min(), df["date"].max()
+        self.minDate = minDate if self.minDate is None else min(self.minDate, minDate)
+        self.maxDate = maxDate if self.maxDate is None else max(self.maxDate, maxDate)
+
+    def finish(self) -> None:
+        with open(self.directory / self.META, "w") as file:
+            json.dump({
+                "nBuckets": self.nBuckets,
+                "parts": self.parts,
+                "rows": self.rows,
+                "minDate": str(self.minDate) if self.minDate is not None else None,
+                "maxDate": str(self.maxDate) if self.maxDate is not None else None,
+            }, file, indent=4)
+
+    def files(self, bucket: int) -> list[Path]:
+        return sorted((self.directory / f"bucket_{bucket:05d}").glob("part_*.feather"))
+
+    def bucket(self, bucket: int, columns: list[str] = None) -> pd.DataFrame:
+        """
+            Todas as transações de um bucket
+        """
+        files = self.files(bucket)
+        if not files:
+            return pd.DataFrame(columns=columns or ["id", "date", "monetary"])
+        table = pa.concat_tables([feather.read_table(f, columns=columns) for f in files]).unify_dictionaries()
+        return table.to_pandas(self_destruct=True, split_blocks=True)
+
+    def __iter__(self):
+        for bucket in range(self.nBuckets):
+            df = self.bucket(bucket)
+            if not df.empty:
+                yield df
+
+    def periods(self, frequency: str) -> pd.PeriodIndex:
+        """
+            Períodos (ordenados) com alguma transação, lendo apenas a coluna de data de cada bucket
+        """
+        periods = pd.PeriodIndex([], freq=frequency)
+        for bucket in range(self.nBuckets):
+            dates = self.bucket(bucket, columns=["date"])["date"]
+            periods = periods.append(pd.PeriodIndex(dates, freq=frequency).unique()).unique()
+        return periods.sort_values()
+
+
+class FrameParts:
+    """
+        DataFrame gravado em partes Feather e lido uma parte por vez. É a saída do RFM fora da memória (uma parte por
+        bucket), para que nem a saída precise caber inteira na memória.
+    """
+
+    META = "parts.json"
+
+    def __init__(self, directory: str | Path) -> None:
+        assert feather is not None, "Out-of-core mode requires pyarrow"
+        self.directory = Path(directory)
+        self.parts = 0
+        self.rows = 0
+
+    @classmethod
+    def create(cls, directory: str | Path):
+        """
+            Cria uma saída vazia (apagando as partes que já existiam na pasta)
+        """
+        directory = Path(directory)
+        if (directory / cls.META).exists():
+            shutil.rmtree(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        return cls(directory)
+
+    @classmethod
+    def open(cls, directory: str | Path):
+        directory = Path(directory)
+        with open(directory / cls.META, "r") as file:
+            meta = json.load(file)
+        parts = cls(directory)
+        parts.parts = meta["parts"]
+        parts.rows = meta["rows"]
+        return parts
+
+    def __len__(self) -> int:
+        return self.parts
+
+    def append(self, df: pd.DataFrame) -> None:
+        feather.write_feather(df.reset_index(drop=True), self.directory / f"part_{self.parts:06d}.feather",
+                              compression="uncompressed")
+        self.parts += 1
+        self.rows += len(df)
+
+    def finish(self) -> None:
+        with open(self.directory / self.META, "w") as file:
+            json.dump({"parts": self.parts, "rows": self.rows}, file, indent=4)
+
+    def __iter__(self):
+        for part in range(self.parts):
+            table = feather.read_table(self.directory / f"part_{part:06d}.feather", memory_map=True)
+            yield table.to_pandas(split_blocks=True)
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+            Todas as partes em um único DataFrame, para as tarefas que precisam da saída inteira
+        """
+        frames = list(self)
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+import pandas as pd
+
+try:
+    import pyarrow.feather as feather
+except ImportError:  # sem pyarrow o cache fica desativado
+    feather = None
+
+
+def file_fingerprint(fp: str | Path, blockSize: int = 1 << 20) -> str:
+    """
+        Hash do conteúdo do arquivo (lido em blocos para não carregar o arquivo inteiro na memória)
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(fp, "rb") as file:
+        while block := file.read(blockSize):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def dataset_fingerprint(files: list[str | Path], cache: "FrameCache" = None) -> str:
+    """
+        Hash de uma base com um ou mais arquivos (usando os hashes já conhecidos pelo cache, se houver)
+    """
+    hashes = [cache.fingerprint(fp) if cache is not None else file_fingerprint(fp) for fp in files]
+    return hashlib.blake2b(json.dumps(hashes).encode(), digest_size=16).hexdigest()
+
+
+class FrameCache:
+    """
+        Cache em disco (Feather sem compressão, para permitir memory map) de DataFrames já normalizados
+    """
+
+    def __init__(self, cacheDir: str | Path) -> None:
+        self.cacheDir = Path(cacheDir)
+        self.cacheDir.mkdir(parents=True, exist_ok=True)
+        self.fingerprintsPath = self.cacheDir / "fingerprints.json"
+
+    @property
+    def enabled(self) -> bool:
+        return feather is not None
+
+    def fingerprint(self, fp: str | Path) -> str:
+        """
+            Hash do conteúdo do arquivo, reaproveitado enquanto o tamanho e a data de modificação não mudarem
+        """
+        fp = Path(fp).resolve()
+        stat = fp.stat()
+        fingerprints = self.__load_json(self.fingerprintsPath)
+        known = fingerprints.get(str(fp))
+        if known and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime_ns:
+            return known["hash"]
+
+        fingerprints[str(fp)] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": file_fingerprint(fp)}
+        self.__write_json(self.fingerprintsPath, fingerprints)
+        return fingerprints[str(fp)]["hash"]
+
+    def key(self, *parts) -> str:
+        return hashlib.blake2b(json.dumps(parts, default=str).encode(), digest_size=16).hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.cacheDir / f"{key}.feather"
+
+    def load(self, key: str) -> pd.DataFrame | None:
+        path = self.path(key)
+        if not self.enabled or not path.exists():
+            return None
+        table = feather.read_table(path, memory_map=True)
+        return table.to_pandas(split_blocks=True)
+
+    def save(self, key: str, df: pd.DataFrame) -> None:
+        if not self.enabled:
+            return
+        # Escreve em um arquivo temporário e renomeia, para nunca deixar um cache pela metade
+        path = self.path(key)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        feather.write_feather(df.reset_index(drop=True), tmp, compression="uncompressed")
+        os.replace(tmp, path)
+
+    def delete(self, key: str) -> None:
+        self.path(key).unlink(missing_ok=True)
+
+    def load_state(self, key: str) -> dict | None:
+        """
+            Estado em JSON associado a uma chave (ex: posição já lida de um arquivo incremental)
+        """
+        path = self.cacheDir / f"{key}.json"
+        return self.__load_json(path) if path.exists() else None
+
+    def save_state(self, key: str, state: dict) -> None:
+        self.__write_json(self.cacheDir / f"{key}.json", state)
+
+    def __load_json(self, path: Path) -> dict:
+        if not path.exists():
+            return {}
+        with open(path, "r") as file:
+            return json.load(file)
+
+    def __write_json(self, path: Path, data: dict) -> None:
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "w") as file:
+            json.dump(data, file, indent=4)
+        os.replace(tmp, path)
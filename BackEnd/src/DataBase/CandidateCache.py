@@ -0,0 +1,87 @@
+from pathlib import Path
+import hashlib
+import json
+import os
+import joblib
+import numpy as np
+
+
+class CandidateCache:
+    """
+        Candidatos de Machine Learning já treinados (modelo, StandardScaler e MSE de validação), indexados pelo hash
+        dos dados de treino e teste, pela classe do modelo e pelos hiperparâmetros. Mudar só o que vem depois do
+        treino (ex: weeksAhead ou o modelo monetário) não treina os candidatos de novo.
+
+        Cada candidato é um arquivo .joblib. A data de modificação do arquivo marca o último uso, e quando a pasta
+        passa de maxBytes os candidatos usados há mais tempo são apagados (LRU)
+    """
+
+    def __init__(self, directory: str | Path, maxBytes: int = 1 << 30) -> None:
+        """
+        Args:
+            directory, # Pasta do cache
+            maxBytes = 1 << 30 # Tamanho máximo da pasta (1 GiB)
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.maxBytes = maxBytes
+
+    @staticmethod
+    def data_key(*arrays: np.ndarray) -> str:
+        """
+            Hash do conteúdo (e do formato) de um conjunto de arrays, Ex: X_train, Y_train, X_test, Y_test
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        for values in arrays:
+            values = np.ascontiguousarray(values, dtype=np.float64)
+            digest.update(str(values.shape).encode())
+            digest.update(values.data)
+        return digest.hexdigest()
+
+    def key(self, dataKey: str, model) -> str:
+        # Hiperparâmetros do modelo (sem os atributos de um modelo já treinado, que terminam com "_")
+        if hasattr(model, "get_params"):
+            params = model.get_params()
+        else:
+            params = {name: value for name, value in vars(model).items() if not name.endswith("_")}
+        return hashlib.blake2b(json.dumps([dataKey, type(model).__name__, params],
+                                          sort_keys=True, default=repr).encode(), digest_size=16).hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.directory / f"{key}.joblib"
+
+    def load(self, key: str) -> dict | None:
+        path = self.path(key)
+        try:
+            entry = joblib.load(path)
+        except (FileNotFoundError, EOFError):
+            return None
+        # Marca o uso para a ordem do LRU
+        os.utime(path)
+        return entry
+
+    def save(self, key: str, entry: dict) -> None:
+        # Escreve em um arquivo temporário e renomeia, para nunca deixar um candidato pela metade
+        path = self.path(key)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        joblib.dump(entry, tmp)
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self) -> None:
+        """
+            Apaga os candidatos usados há mais tempo até a pasta caber em maxBytes
+        """
+        files = []
+        for path in self.directory.glob("*.joblib"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime_ns, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.maxBytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
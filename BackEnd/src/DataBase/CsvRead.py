@@ -1,24 +1,183 @@
 from src.workflows.task import Task
+from src.DataBase.Cache import FrameCache
+from src.DataBase.Buckets import BYTES_PER_ROW, TransactionBuckets
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
+from pandas.api.types import is_integer_dtype, union_categoricals
+from pandas.tseries.api import guess_datetime_format
 from pathlib import Path
+import glob
+import hashlib
+import os
+import tracemalloc
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+except ImportError:  # pyarrow é opcional, sem ele usamos o leitor em C do pandas
+    pa = None
+    pacsv = None
+
+
+COLUMNS = ["id", "date", "monetary"]
+# O block_size do leitor do pyarrow é um int32
+MAX_BLOCK_SIZE = (1 << 31) - 1
+# Segmentos do modo incremental a partir dos quais eles são juntados em um só
+MAX_SEGMENTS = 8
+
+
+class CsvReader:
+    """
+        Lê e normaliza (id/date/monetary) um único arquivo CSV. Não é uma Task para poder ser enviado aos processos
+    """
 
-class CsvReadTask(Task):
     def __init__(
         self,
-        name: str,
-        fp: str,
         columnID: str = "id",
         columnDate: str = "date",
         columnMonetary: str = "monetary",
+        isChunked: bool = False,
+        chunkSize: int = 1_000_000,
+        dateFormat: str = None,
     ) -> None:
-        super().__init__(name)
-        self.fp = Path(fp)
         self.columnID = columnID
         self.columnDate = columnDate
         self.columnMonetary = columnMonetary
+        self.isChunked = isChunked
+        self.chunkSize = chunkSize
+        self.dateFormat = dateFormat
+        self.peakMemory = None
+
+    def cache_key(self, cache: FrameCache, fingerprint: str) -> str:
+        # isChunked muda o DataFrame lido (só as 3 colunas, com tipos declarados)
+        return cache.key(fingerprint, self.columnID, self.columnDate, self.columnMonetary, self.dateFormat,
+                         self.isChunked)
+
+    def read_cached(self, fp: Path, cache: FrameCache) -> tuple[str, pd.DataFrame]:
+        """
+            Retorna o hash do arquivo e o DataFrame normalizado, lendo do cache quando o arquivo não mudou. O cache
+            guarda o mesmo DataFrame do read (com todas as colunas do CSV fora do modo isChunked)
+        """
+        fingerprint = cache.fingerprint(fp)
+        key = self.cache_key(cache, fingerprint)
+
+        df = cache.load(key)
+        if df is not None:
+            print(f"Loaded {fp.name} from cache ({len(df)} rows)")
+            return fingerprint, df
+
+        df = self.read(fp)
+        cache.save(key, df)
+        return fingerprint, df
+
+    def read_incremental(self, fp: Path, cache: FrameCache) -> tuple[str, pd.DataFrame]:
+        """
+            Lê apenas as linhas adicionadas ao final do arquivo desde a última execução e junta com o histórico em cache.
+            Se o arquivo foi reescrito (e não apenas incrementado) faz a leitura completa novamente
+        """
+        stateKey = cache.key("incremental", str(fp.resolve()), self.columnID, self.columnDate, self.columnMonetary)
+        state = cache.load_state(stateKey)
+        size = fp.stat().st_size
+
+        frames = None
+        if state is not None and self.__is_append(fp, state, size):
+            frames = [cache.load(segment) for segment in state["segments"]]
+            # Um segmento apagado do cache obriga a ler o arquivo inteiro de novo
+            frames = None if any(frame is None for frame in frames) else frames
+
+        if frames is not None:
+            if size > state["offset"]:
+                # O último segmento tem as categorias de todos os anteriores
+                tail = self.__read_tail(fp, state, frames[-1])
+                if not tail.empty:
+                    if tail["date"].min() < pd.Timestamp(state["maxDate"]):
+                        print(f"Warning: {fp.name} has appended transactions older than {state['maxDate']}")
+                    segment = cache.key(stateKey, len(state["segments"]), state["offset"], size)
+                    cache.save(segment, tail)
+                    state["segments"].append(segment)
+                    state["rows"] += len(tail)
+                    state["maxDate"] = str(max(pd.Timestamp(state["maxDate"]), tail["date"].max()))
+                    frames.append(tail)
+                print(f"Read {len(tail)} new rows from {fp.name} ({state['rows']} rows in total)")
+            df = concat_frames(frames) if len(frames) > 1 else frames[0]
+            del frames
+
+            # Junta os segmentos quando passam de MAX_SEGMENTS, para o tempo de carga não crescer a cada execução
+            if len(state["segments"]) > MAX_SEGMENTS:
+                segment = cache.key(stateKey, "compacted", size)
+                cache.save(segment, df)
+                self.__delete_segments(cache, state["segments"], keep=segment)
+                state["segments"] = [segment]
+        else:
+            if state is not None:
+                print(f"{fp.name} was rewritten, reading the whole file again")
+            df = self.read(fp)[COLUMNS]
+            segment = cache.key(stateKey, 0, 0, size)
+            cache.save(segment, df)
+            if state is not None:
+                # Os segmentos da versão anterior do arquivo não servem mais
+                self.__delete_segments(cache, state["segments"], keep=segment)
+            state = {
+                "header": pd.read_csv(fp, nrows=0).columns.tolist(),
+                "segments": [segment],
+                "rows": len(df),
+                "maxDate": str(df["date"].max()),
+            }
+
+        # Assinaturas do início e do fim da parte já lida, usadas para detectar se o arquivo foi reescrito
+        state["offset"] = size
+        state["headHash"], state["tailHash"] = self.__signatures(fp, size)
+        cache.save_state(stateKey, state)
+        return cache.key(*state["segments"]), df
+
+    def __delete_segments(self, cache: FrameCache, segments: list[str], keep: str) -> None:
+        for segment in segments:
+            if segment != keep:
+                cache.delete(segment)
 
-    def on_run(self) -> pd.DataFrame:
-        df = pd.read_csv(self.fp)
+    def __signatures(self, fp: Path, offset: int, blockSize: int = 1 << 16) -> tuple[str, str]:
+        with open(fp, "rb") as file:
+            head = file.read(min(offset, blockSize))
+            file.seek(max(0, offset - blockSize))
+            tail = file.read(offset - max(0, offset - blockSize))
+        return hashlib.blake2b(head, digest_size=16).hexdigest(), hashlib.blake2b(tail, digest_size=16).hexdigest()
+
+    def __is_append(self, fp: Path, state: dict, size: int) -> bool:
+        offset = state["offset"]
+        if size < offset or offset == 0:
+            return False
+        with open(fp, "rb") as file:
+            file.seek(offset - 1)
+            # A última leitura precisa ter terminado em uma quebra de linha, senão a linha foi continuada
+            if file.read(1) != b"\n":
+                return False
+        return self.__signatures(fp, offset) == (state["headHash"], state["tailHash"])
+
+    def __read_tail(self, fp: Path, state: dict, history: pd.DataFrame) -> pd.DataFrame:
+        with open(fp, "rb") as file:
+            file.seek(state["offset"])
+            tail = pd.read_csv(file, header=None, names=state["header"],
+                               usecols=[self.columnID, self.columnDate, self.columnMonetary])
+
+        tail = tail[[self.columnID, self.columnDate, self.columnMonetary]]
+        tail.columns = COLUMNS
+        tail["date"] = pd.to_datetime(tail["date"], format=self.dateFormat).astype(history["date"].dtype)
+        tail["monetary"] = tail["monetary"].astype(history["monetary"].dtype)
+        if isinstance(history["id"].dtype, pd.CategoricalDtype):
+            # Categorias do histórico seguidas dos ids novos, para o id continuar categórico ao juntar com o histórico
+            ids = tail["id"].astype(str)
+            categories = history["id"].cat.categories
+            tail["id"] = pd.Categorical(ids, categories=categories.append(pd.Index(ids.unique()).difference(categories)))
+        else:
+            tail["id"] = tail["id"].astype(history["id"].dtype)
+        return tail
+
+    def read(self, fp: Path) -> pd.DataFrame:
+        if self.isChunked:
+            return self.__read_chunked(fp)
+
+        df = pd.read_csv(fp)
         df.rename(
             columns={self.columnID: "id",
                      self.columnDate: "date", self.columnMonetary: "monetary"},
@@ -31,5 +190,295 @@ class CsvReadTask(Task):
 
         if "date" in df.columns:
             df["date"] = pd.to_datetime(df["date"])
-            
+
+        return df
+
+    def __read_chunked(self, fp: Path) -> pd.DataFrame:
+        """
+            Lê somente as colunas mapeadas, com tipos declarados, em blocos, e reporta o pico de memória
+        """
+        sampleSize, idIsInt, dateFormat = self.__declared_types(fp)
+
+        tracemalloc.start()
+        try:
+            if pacsv is not None:
+                df, arrowPeak = self.__read_pyarrow(fp, sampleSize, idIsInt, dateFormat)
+            else:
+                df, arrowPeak = self.__read_pandas(fp, idIsInt, dateFormat), 0
+            _, pythonPeak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        df.columns = COLUMNS
+
+        self.peakMemory = (pythonPeak + arrowPeak) / 2**20
+        print(f"Peak memory ({fp.name}): {self.peakMemory:.1f} MB for {len(df)} rows")
         return df
+
+    def iter_chunks(self, fp: Path):
+        """
+            Gera o arquivo em blocos de aproximadamente chunkSize linhas já normalizados (id/date/monetary), sem nunca
+            ter o arquivo inteiro na memória
+        """
+        sampleSize, idIsInt, dateFormat = self.__declared_types(fp)
+        if pacsv is not None:
+            with self.__open_pyarrow(fp, sampleSize, idIsInt, dateFormat) as reader:
+                for batch in reader:
+                    df = batch.to_pandas(split_blocks=True)[[self.columnID, self.columnDate, self.columnMonetary]]
+                    df.columns = COLUMNS
+                    yield df
+        else:
+            for chunk in self.__pandas_chunks(fp, idIsInt, dateFormat):
+                chunk = chunk[[self.columnID, self.columnDate, self.columnMonetary]]
+                chunk.columns = COLUMNS
+                yield chunk
+
+    def __declared_types(self, fp: Path) -> tuple[int, bool, str | None]:
+        """
+            Tipos declarados a partir de uma amostra: id inteiro quando possível (senão categórico) e formato da data
+        """
+        columns = [self.columnID, self.columnDate, self.columnMonetary]
+        sample = pd.read_csv(fp, nrows=1000)
+        for column in columns:
+            assert column in sample.columns, f"Column '{column}' not found in DataFrame columns: {sample.columns}"
+
+        idIsInt = is_integer_dtype(sample[self.columnID])
+        dateFormat = self.dateFormat or self.__sniff_date_format(sample[self.columnDate])
+        return len(sample), idIsInt, dateFormat
+
+    def __sniff_date_format(self, dates: pd.Series) -> str | None:
+        first = dates.dropna()
+        if first.empty:
+            return None
+        return guess_datetime_format(str(first.iloc[0]))
+
+    def __open_pyarrow(self, fp: Path, sampleSize: int, idIsInt: bool, dateFormat: str | None):
+        columns = [self.columnID, self.columnDate, self.columnMonetary]
+        # Converte o tamanho do bloco de linhas para bytes usando o tamanho médio das linhas da amostra
+        with open(fp, "rb") as file:
+            file.readline()
+            lines = [line for _, line in zip(range(sampleSize), file)]
+        bytesPerRow = max(1, sum(map(len, lines)) // max(1, len(lines)))
+        readOptions = pacsv.ReadOptions(block_size=min(MAX_BLOCK_SIZE, max(1 << 20, self.chunkSize * bytesPerRow)))
+        convertOptions = pacsv.ConvertOptions(
+            include_columns=columns,
+            column_types={
+                self.columnID: pa.int64() if idIsInt else pa.dictionary(pa.int32(), pa.string()),
+                self.columnDate: pa.timestamp("ns"),
+                self.columnMonetary: pa.float32(),
+            },
+            timestamp_parsers=[dateFormat] if dateFormat else None,
+        )
+        return pacsv.open_csv(fp, read_options=readOptions, convert_options=convertOptions)
+
+    def __read_pyarrow(self, fp: Path, sampleSize: int, idIsInt: bool, dateFormat: str | None) -> tuple[pd.DataFrame, int]:
+        columns = [self.columnID, self.columnDate, self.columnMonetary]
+        arrowPeak = 0
+        frames = []
+        with self.__open_pyarrow(fp, sampleSize, idIsInt, dateFormat) as reader:
+            for batch in reader:
+                arrowPeak = max(arrowPeak, pa.total_allocated_bytes())
+                # Cada bloco vira um DataFrame já com os tipos reduzidos e o bloco do Arrow é descartado em seguida,
+                # então nunca há uma Table com o arquivo inteiro
+                df = batch.to_pandas(split_blocks=True)[columns]
+                del batch
+                df.columns = COLUMNS
+                frames.append(df)
+
+        if not frames:
+            return pd.DataFrame(columns=COLUMNS), arrowPeak
+        df = concat_frames(frames) if len(frames) > 1 else frames[0]
+        arrowPeak = max(arrowPeak, pa.total_allocated_bytes())
+        return df, arrowPeak
+
+    def __pandas_chunks(self, fp: Path, idIsInt: bool, dateFormat: str | None):
+        chunks = pd.read_csv(
+            fp,
+            usecols=[self.columnID, self.columnDate, self.columnMonetary],
+            dtype={self.columnID: "int64" if idIsInt else "category", self.columnMonetary: "float32"},
+            chunksize=self.chunkSize,
+        )
+        for chunk in chunks:
+            chunk[self.columnDate] = pd.to_datetime(chunk[self.columnDate], format=dateFormat)
+            yield chunk
+
+    def __read_pandas(self, fp: Path, idIsInt: bool, dateFormat: str | None) -> pd.DataFrame:
+        frames = list(self.__pandas_chunks(fp, idIsInt, dateFormat))
+
+        if not frames:
+            return pd.DataFrame(columns=[self.columnID, self.columnDate, self.columnMonetary])
+
+        # Cada bloco tem suas próprias categorias, unificamos antes de concatenar para manter o tipo categórico
+        if not idIsInt and len(frames) > 1:
+            categories = union_categoricals([f[self.columnID] for f in frames]).categories
+            for frame in frames:
+                frame[self.columnID] = frame[self.columnID].cat.set_categories(categories)
+
+        df = pd.concat(frames, ignore_index=True)
+        return df[[self.columnID, self.columnDate, self.columnMonetary]]
+
+
+def _read_shard(reader: CsvReader, fp: Path, cacheDir: str | None) -> tuple[str | None, pd.DataFrame | None]:
+    """
+        Executado em um processo separado. Com cache, o DataFrame fica em disco e apenas o hash volta ao processo principal
+    """
+    if cacheDir is None:
+        return None, reader.read(fp)[COLUMNS]
+    fingerprint, _ = reader.read_cached(fp, FrameCache(cacheDir))
+    return fingerprint, None
+
+
+def concat_frames(frames: list[pd.DataFrame]) -> pd.DataFrame:
+    """
+        Concatena os DataFrames normalizados alocando cada coluna de saída uma única vez
+    """
+    total = sum(len(df) for df in frames)
+    data = {}
+    for column in COLUMNS:
+        series = [df[column] for df in frames]
+        dtypes = {s.dtype for s in series}
+        if all(isinstance(s.dtype, pd.CategoricalDtype) for s in series):
+            # Cada bloco (e cada arquivo) tem as suas próprias categorias: junta as categorias em vez de converter
+            # o id para texto
+            data[column] = union_categoricals(series)
+        elif len(dtypes) == 1 and not isinstance(series[0].dtype, np.dtype):
+            # Tipos do pandas sem equivalente no numpy (ex: StringDtype dos ids de texto)
+            data[column] = pd.concat(series, ignore_index=True)
+        elif len(dtypes) == 1:
+            out = np.empty(total, dtype=series[0].dtype)
+            offset = 0
+            for s in series:
+                out[offset:offset + len(s)] = s.to_numpy()
+                offset += len(s)
+            data[column] = out
+        else:
+            # Tipos diferentes entre os arquivos (ex: id inteiro em um e texto em outro)
+            data[column] = pd.concat(series, ignore_index=True).to_numpy()
+    return pd.DataFrame(data, copy=False)
+
+
+class CsvReadTask(Task):
+    def __init__(
+        self,
+        name: str,
+        fp: str,
+        columnID: str = "id",
+        columnDate: str = "date",
+        columnMonetary: str = "monetary",
+        isChunked: bool = False,
+        chunkSize: int = 1_000_000,
+        dateFormat: str = None,
+        cacheDir: str = None,
+        nJobs: int = None,
+        isIncremental: bool = False,
+        bucketDir: str = None,
+        memoryLimit: float = 512,
+    ) -> None:
+        """
+        Args:
+            name, # Nome da tarefa
+            fp, # Caminho do arquivo CSV, de uma pasta com vários CSVs ou um glob (ex: "dados/transactions_2026-*.csv")
+            columnID, columnDate, columnMonetary # Nome das colunas de identificador, data e valor monetário
+            isChunked = False # Lê apenas as 3 colunas mapeadas, com tipos declarados e em blocos de tamanho limitado
+            chunkSize = 1_000_000 # Quantidade (aproximada) de linhas lidas por bloco no modo isChunked
+            dateFormat = None # Formato da data (ex: "%Y-%m-%d"), se None é inferido a partir de uma amostra
+            cacheDir = None # Pasta do cache colunar (id/date/monetary), indexado pelo hash do arquivo e pelo mapeamento das colunas
+            nJobs = None # Número de processos usados para ler vários arquivos (None usa todos os núcleos)
+            isIncremental = False # Lê apenas as linhas adicionadas ao arquivo desde a última execução (precisa do cacheDir)
+            bucketDir = None # Modo fora da memória: as transações são particionadas por cliente em buckets nessa pasta e a
+                             # saída é um TransactionBuckets em vez de um DataFrame
+            memoryLimit = 512 # Memória (MB) disponível por bloco lido e por bucket no modo fora da memória
+        """
+        super().__init__(name)
+        self.fp = Path(fp)
+        self.columnID = columnID
+        self.columnDate = columnDate
+        self.columnMonetary = columnMonetary
+        self.isChunked = isChunked
+        self.chunkSize = chunkSize
+        self.dateFormat = dateFormat
+        self.cacheDir = cacheDir
+        self.nJobs = nJobs
+        self.isIncremental = isIncremental
+        self.bucketDir = bucketDir
+        self.memoryLimit = memoryLimit
+        self.peakMemory = None
+        self.fingerprint = None
+
+    def on_run(self) -> pd.DataFrame | TransactionBuckets:
+        reader = CsvReader(self.columnID, self.columnDate, self.columnMonetary,
+                           self.isChunked, self.chunkSize, self.dateFormat)
+        files = self.list_files()
+        assert files, f"No CSV file found for '{self.fp}'"
+
+        if self.bucketDir is not None:
+            return self.__read_buckets(files)
+
+        assert not self.isIncremental or self.cacheDir is not None, "isIncremental requires a cacheDir"
+        assert not self.isIncremental or files == [self.fp], "isIncremental requires a single CSV file"
+
+        if len(files) > 1:
+            return self.__read_many(reader, files)
+
+        if self.cacheDir is None:
+            df = reader.read(files[0])
+        elif self.isIncremental:
+            self.fingerprint, df = reader.read_incremental(files[0], FrameCache(self.cacheDir))
+        else:
+            self.fingerprint, df = reader.read_cached(files[0], FrameCache(self.cacheDir))
+        self.peakMemory = reader.peakMemory
+        return df
+
+    def list_files(self) -> list[Path]:
+        """
+            Arquivos que compõem a base: o próprio arquivo, os CSVs de uma pasta ou os arquivos de um glob
+        """
+        if self.fp.is_dir():
+            return sorted(self.fp.glob("*.csv"))
+        if glob.has_magic(str(self.fp)):
+            return [Path(f) for f in sorted(glob.glob(str(self.fp)))]
+        return [self.fp]
+
+    def __read_many(self, reader: CsvReader, files: list[Path]) -> pd.DataFrame:
+        """
+            Lê os arquivos em paralelo (um processo por arquivo) e concatena em um único DataFrame
+        """
+        nJobs = min(len(files), self.nJobs or os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=nJobs) as executor:
+            results = list(executor.map(_read_shard, [reader] * len(files), files, [self.cacheDir] * len(files)))
+
+        if self.cacheDir is None:
+            frames = [df for _, df in results]
+        else:
+            # Os arquivos já estão no cache, aqui eles são apenas mapeados na memória
+            cache = FrameCache(self.cacheDir)
+            fingerprints = [fingerprint for fingerprint, _ in results]
+            frames = [cache.load(reader.cache_key(cache, fingerprint)) for fingerprint in fingerprints]
+            self.fingerprint = cache.key(*fingerprints)
+
+        print(f"Read {len(files)} files with {nJobs} processes")
+        return concat_frames(frames)
+
+    def __read_buckets(self, files: list[Path]) -> TransactionBuckets:
+        """
+            Lê os arquivos em blocos e particiona as transações por cliente em buckets no disco. O tamanho dos blocos
+            e o número de buckets vêm de memoryLimit, e não do tamanho da base
+        """
+        chunkSize = max(1, min(self.chunkSize, int(self.memoryLimit * 2**20 // BYTES_PER_ROW)))
+        reader = CsvReader(self.columnID, self.columnDate, self.columnMonetary, True, chunkSize, self.dateFormat)
+
+        # Número de linhas estimado pelo tamanho dos arquivos e pelo tamanho médio das linhas do primeiro
+        with open(files[0], "rb") as file:
+            file.readline()
+            lines = [line for _, line in zip(range(1000), file)]
+        bytesPerRow = max(1, sum(map(len, lines)) // max(1, len(lines)))
+        estimatedRows = sum(f.stat().st_size for f in files) // bytesPerRow
+
+        buckets = TransactionBuckets.create(self.bucketDir, TransactionBuckets.buckets_for(estimatedRows, self.memoryLimit))
+        for fp in files:
+            for chunk in reader.iter_chunks(fp):
+                buckets.append(chunk)
+        buckets.finish()
+
+        print(f"Partitioned {buckets.rows} rows into {len(buckets)} buckets ({buckets.parts} blocks of up to {chunkSize} rows)")
+        return buckets
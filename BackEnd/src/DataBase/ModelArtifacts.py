@@ -0,0 +1,85 @@
+from datetime import datetime
+from pathlib import Path
+import hashlib
+import json
+import os
+import joblib
+
+
+class ArtifactError(FileNotFoundError):
+    """
+        Artefato que não existe ou não pode ser carregado (manifest ou arquivo corrompido, versão antiga do modelo).
+        Quem usa os artefatos trata esse erro ajustando os modelos de novo
+    """
+
+
+class ModelArtifactStore:
+    """
+        Modelos já ajustados salvos em disco, indexados pelo hash da base e pelas propriedades do modelo, para que uma
+        nova predição (ex: outro weeksAhead) não precise ajustar os modelos de novo.
+
+        Cada chave tem uma pasta com as versões (v0001.joblib, v0002.joblib, ...) e um manifest.json com os metadados
+        de cada versão. Um novo ajuste com a mesma chave gera uma nova versão, e load retorna a mais recente
+    """
+
+    MANIFEST = "manifest.json"
+
+    def __init__(self, directory: str | Path) -> None:
+        """
+        Args:
+            directory, # Pasta dos artefatos
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def key(self, *parts) -> str:
+        return hashlib.blake2b(json.dumps(parts, sort_keys=True, default=str).encode(), digest_size=16).hexdigest()
+
+    def versions(self, key: str) -> list[dict]:
+        path = self.directory / key / self.MANIFEST
+        if not path.exists():
+            return []
+        try:
+            with open(path, "r") as file:
+                return json.load(file)["versions"]
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            raise ArtifactError(f"Corrupt manifest for model artifact '{key}': {error!r}") from error
+
+    def save(self, key: str, artifact: dict, meta: dict = None) -> int:
+        """
+            Salva uma nova versão do artefato e retorna o número da versão
+        """
+        folder = self.directory / key
+        folder.mkdir(exist_ok=True)
+        versions = self.versions(key)
+        version = versions[-1]["version"] + 1 if versions else 1
+        fileName = f"v{version:04d}.joblib"
+
+        # Escreve em arquivos temporários e renomeia, para nunca deixar uma versão pela metade
+        tmp = folder / f"{fileName}.{os.getpid()}.tmp"
+        joblib.dump(artifact, tmp)
+        os.replace(tmp, folder / fileName)
+
+        versions.append({"version": version, "file": fileName, "created": datetime.now().isoformat(), **(meta or {})})
+        tmp = folder / f"{self.MANIFEST}.{os.getpid()}.tmp"
+        with open(tmp, "w") as file:
+            json.dump({"versions": versions}, file, indent=4, default=str)
+        os.replace(tmp, folder / self.MANIFEST)
+        return version
+
+    def load(self, key: str, version: int = None) -> dict:
+        """
+            Artefato de uma versão (por padrão a mais recente)
+        """
+        versions = self.versions(key)
+        if version is not None:
+            versions = [v for v in versions if v["version"] == version]
+        if not versions:
+            raise ArtifactError(f"No model artifact for key '{key}'" +
+                                    (f" version {version}" if version is not None else "") +
+                                    ", run the pipeline with fitting first")
+        try:
+            return joblib.load(self.directory / key / versions[-1]["file"])
+        except Exception as error:
+            # Arquivo apagado, truncado ou salvo por outra versão das bibliotecas
+            raise ArtifactError(f"Cannot load model artifact '{key}': {error!r}") from error
@@ -0,0 +1,143 @@
+from pathlib import Path
+from typing import Callable
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+from lifetimes.utils import ConvergenceError
+
+
+class ModelParamsStore:
+    """
+        Parâmetros ajustados de cada modelo em cada base (um arquivo JSON), usados como ponto inicial do próximo
+        ajuste. Em bases que mudam pouco entre execuções o ótimo quase não se move, então o otimizador parte de perto
+        dele e precisa de poucas iterações
+    """
+
+    def __init__(self, fp: str | Path) -> None:
+        """
+        Args:
+            fp, # Caminho do arquivo JSON (criado no primeiro save)
+        """
+        self.fp = Path(fp)
+        self.fp.parent.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(datasetKey: str | None, modelName: str) -> str:
+        return f"{datasetKey or 'default'}::{modelName}"
+
+    def load(self, key: str) -> dict | None:
+        return self.__load().get(key)
+
+    def save(self, key: str, entry: dict) -> None:
+        entries = self.__load()
+        entries[key] = entry
+        # Escreve em um arquivo temporário e renomeia, para nunca deixar o arquivo pela metade
+        tmp = self.fp.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "w") as file:
+            json.dump(entries, file, indent=4)
+        os.replace(tmp, self.fp)
+
+    def __load(self) -> dict:
+        if not self.fp.exists():
+            return {}
+        with open(self.fp, "r") as file:
+            return json.load(file)
+
+
+class MemoryParamsStore(ModelParamsStore):
+    """
+        ModelParamsStore só em memória, para encadear warm starts entre ajustes de uma mesma execução (ex: valores
+        vizinhos de penalizer)
+    """
+
+    def __init__(self) -> None:
+        self.entries = {}
+
+    def load(self, key: str) -> dict | None:
+        return self.entries.get(key)
+
+    def save(self, key: str, entry: dict) -> None:
+        self.entries[key] = entry
+
+
+class _EvaluationCounter:
+    """
+        Conta as avaliações da função objetivo de um fitter do lifetimes, que não expõe o resultado do minimize
+    """
+
+    def __init__(self, model) -> None:
+        self.model = model
+        self.count = 0
+
+    def __enter__(self):
+        function = self.model._negative_log_likelihood
+
+        def counted(*args, **kwargs):
+            self.count += 1
+            return function(*args, **kwargs)
+
+        self.model._negative_log_likelihood = counted
+        return self
+
+    def __exit__(self, *args) -> None:
+        del self.model._negative_log_likelihood
+
+
+def warm_fit(
+    model,
+    fit: Callable,
+    store: ModelParamsStore | None,
+    key: str,
+    initialParams: Callable[[pd.Series], np.ndarray],
+) -> dict:
+    """
+        Ajusta o modelo partindo dos parâmetros salvos do último ajuste (se existirem), salva os novos parâmetros e
+        retorna um relatório do ajuste. Se o ajuste a partir dos parâmetros salvos não convergir, ajusta de novo a
+        partir do ponto inicial padrão
+
+    Args:
+        model, # Fitter (lifetimes ou NativeFitters), com params_ e _negative_log_likelihood_ depois do fit
+        fit, # Função que recebe initial_params (ou None) e ajusta o modelo
+        store, # Onde os parâmetros são salvos, None desativa o warm start
+        key, # Chave da base e do modelo no store
+        initialParams # Converte os parâmetros salvos para o ponto inicial do otimizador
+    """
+    previous = store.load(key) if store is not None else None
+    initial = initialParams(pd.Series(previous["params"])) if previous is not None else None
+
+    start = time.perf_counter()
+    evaluations = 0
+    warmStart = initial is not None
+    while True:
+        # Os fitters de NativeFitters guardam o resultado do minimize, os do lifetimes não
+        counter = None if hasattr(model, "result_") else _EvaluationCounter(model)
+        try:
+            if counter is None:
+                fit(initial)
+            else:
+                with counter:
+                    fit(initial)
+            break
+        except ConvergenceError:
+            if initial is None:
+                raise
+            initial, warmStart = None, False
+        finally:
+            evaluations += model.result_.nfev if counter is None and model.result_ is not None else \
+                getattr(counter, "count", 0)
+
+    params = model.params_.astype(float)
+    report = {
+        "warmStart": warmStart,
+        "seconds": time.perf_counter() - start,
+        "evaluations": int(evaluations),
+        "negativeLogLikelihood": float(model._negative_log_likelihood_),
+        # Maior variação relativa dos parâmetros em relação ao último ajuste
+        "maxRelativeChange": None if previous is None else float(
+            (params / pd.Series(previous["params"])[params.index] - 1).abs().max()),
+    }
+    if store is not None:
+        store.save(key, {"params": params.to_dict(), **report})
+    return report
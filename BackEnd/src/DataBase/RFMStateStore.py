@@ -0,0 +1,232 @@
+from pathlib import Path
+import hashlib
+import sqlite3
+import numpy as np
+import pandas as pd
+
+
+class RFMStateStore:
+    """
+        Estado RFM de cada cliente em um arquivo SQLite, atualizado a cada lote de transações novas.
+
+        Para cada cliente são guardados o primeiro e o último período com compra, o número de períodos com compra,
+        o valor total e o valor do primeiro período, que é tudo o que summary_data_from_transaction_data precisa.
+        Cada lote é agregado por (cliente, período) e aplicado com upserts pela chave primária, então o custo de uma
+        atualização depende só do tamanho do lote e não do histórico. A soma de cada (cliente, período) também é
+        guardada, o que permite aceitar transações fora de ordem e calcular o resumo em datas passadas.
+
+        Lotes de transações novas entram pelo update. Quando a entrada é o histórico inteiro (ex: a saída do
+        CsvReadTask, que cresce a cada execução) o sync aplica só as linhas depois das que já foram aplicadas.
+    """
+
+    def __init__(self, fp: str | Path, frequency: str = "W") -> None:
+        """
+        Args:
+            fp, # Caminho do arquivo SQLite (criado se não existir)
+            frequency = 'W' # Frequência dos períodos, deve ser sempre a mesma para o mesmo arquivo
+        """
+        self.fp = Path(fp)
+        self.fp.parent.mkdir(parents=True, exist_ok=True)
+        self.frequency = frequency
+        self.connection = sqlite3.connect(self.fp)
+        self.connection.executescript("""
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS batches (key TEXT PRIMARY KEY, rows INTEGER);
+            CREATE TABLE IF NOT EXISTS customers (
+                customer PRIMARY KEY,
+                first_period INTEGER,
+                last_period INTEGER,
+                n_periods INTEGER,
+                total_monetary REAL,
+                first_monetary REAL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS periods (
+                customer,
+                period INTEGER,
+                monetary REAL,
+                PRIMARY KEY (customer, period)
+            ) WITHOUT ROWID;
+        """)
+
+        with self.connection:
+            self.connection.execute("INSERT OR IGNORE INTO meta VALUES ('frequency', ?)", (frequency,))
+        stored = self.connection.execute("SELECT value FROM meta WHERE key = 'frequency'").fetchone()[0]
+        assert stored == frequency, f"{self.fp} was built with frequency '{stored}', not '{frequency}'"
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM customers").fetchone()[0]
+
+    def to_periods(self, dates) -> np.ndarray:
+        return pd.PeriodIndex(pd.to_datetime(dates), freq=self.frequency).asi8
+
+    def batch_key(self, df: pd.DataFrame) -> str:
+        return hashlib.blake2b(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes(),
+                               digest_size=16).hexdigest()
+
+    def history_signature(self, df: pd.DataFrame, rows: int, blockSize: int = 1000) -> str:
+        """
+            Hash das primeiras e das últimas linhas de df[:rows], usado para saber se o histórico só cresceu
+        """
+        head, tail = df.iloc[:min(rows, blockSize)], df.iloc[max(0, rows - blockSize):rows]
+        return self.batch_key(pd.concat([head, tail], ignore_index=True))
+
+    def sync(
+        self,
+        df: pd.DataFrame,
+        columnID: str = "id",
+        columnDate: str = "date",
+        columnMonetary: str = "monetary",
+    ) -> int:
+        """
+            Aplica um histórico inteiro de transações: se ele começa com as linhas já aplicadas (o arquivo só
+            recebeu linhas no final), só as linhas novas são aplicadas. Senão o estado é refeito do zero. Retorna o
+            número de linhas aplicadas
+
+        Args:
+            df, # Todas as transações, na mesma ordem da última execução e com as novas no final
+            columnID, columnDate, columnMonetary # Nome das colunas de identificador, data e valor monetário
+        """
+        df = df[[columnID, columnDate, columnMonetary]]
+        meta = dict(self.connection.execute(
+            "SELECT key, value FROM meta WHERE key IN ('history_rows', 'history_signature')").fetchall())
+        applied = int(meta.get("history_rows", 0))
+
+        if applied > len(df) or (applied and self.history_signature(df, applied) != meta["history_signature"]):
+            print(f"{self.fp.name}: the transaction history was rewritten, rebuilding the RFM state")
+            with self.connection:
+                for table in ["customers", "periods", "batches"]:
+                    self.connection.execute(f"DELETE FROM {table}")
+            applied = 0
+
+        new = df.iloc[applied:]
+        # A chave do lote é a posição no histórico, então lotes iguais em posições diferentes também são aplicados
+        self.update(new, columnID, columnDate, columnMonetary, batchKey=f"history:{applied}:{len(df)}")
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", [
+                ("history_rows", str(len(df))), ("history_signature", self.history_signature(df, len(df)))])
+        return len(new)
+
+    def update(
+        self,
+        df: pd.DataFrame,
+        columnID: str = "id",
+        columnDate: str = "date",
+        columnMonetary: str = "monetary",
+        batchKey: str = None,
+    ) -> bool:
+        """
+            Aplica um lote de transações novas. Um lote com a mesma chave (por padrão o hash do conteúdo) só é aplicado
+            uma vez, então reprocessar o mesmo lote não duplica as compras. Retorna False se o lote já tinha sido aplicado
+
+        Args:
+            df, # Transações novas (apenas as que ainda não foram aplicadas, e não o histórico inteiro)
+            columnID, columnDate, columnMonetary # Nome das colunas de identificador, data e valor monetário
+            batchKey = None # Identificador do lote
+        """
+        if df.empty:
+            return False
+        batchKey = batchKey or self.batch_key(df[[columnID, columnDate, columnMonetary]])
+        if self.connection.execute("SELECT 1 FROM batches WHERE key = ?", (batchKey,)).fetchone():
+            return False
+
+        # Ordenado pela chave primária, o que deixa as inserções nas árvores do SQLite sequenciais
+        batch = pd.DataFrame({
+            "customer": df[columnID].to_numpy(),
+            "period": self.to_periods(df[columnDate]),
+            "monetary": df[columnMonetary].to_numpy(dtype=np.float64),
+        }).groupby(["customer", "period"], as_index=False)["monetary"].sum()
+
+        with self.connection:
+            self.connection.execute("DROP TABLE IF EXISTS temp.batch")
+            self.connection.execute(
+                "CREATE TEMP TABLE batch (customer, period INTEGER, monetary REAL, PRIMARY KEY (customer, period))")
+            self.connection.executemany("INSERT INTO temp.batch VALUES (?, ?, ?)", zip(
+                batch["customer"].tolist(), batch["period"].tolist(), batch["monetary"].tolist()))
+
+            # Clientes antes dos períodos, pois os períodos novos são os que ainda não estão na tabela periods
+            self.connection.execute("""
+                INSERT INTO customers
+                SELECT
+                    b.customer,
+                    MIN(b.period),
+                    MAX(b.period),
+                    SUM(p.period IS NULL),
+                    SUM(b.monetary),
+                    (SELECT f.monetary FROM temp.batch f WHERE f.customer = b.customer ORDER BY f.period LIMIT 1)
+                FROM temp.batch b
+                LEFT JOIN periods p ON p.customer = b.customer AND p.period = b.period
+                WHERE true
+                GROUP BY b.customer
+                ON CONFLICT (customer) DO UPDATE SET
+                    first_monetary = CASE
+                        WHEN excluded.first_period < first_period THEN excluded.first_monetary
+                        WHEN excluded.first_period = first_period THEN first_monetary + excluded.first_monetary
+                        ELSE first_monetary
+                    END,
+                    first_period = MIN(first_period, excluded.first_period),
+                    last_period = MAX(last_period, excluded.last_period),
+                    n_periods = n_periods + excluded.n_periods,
+                    total_monetary = total_monetary + excluded.total_monetary
+            """)
+            self.connection.execute("""
+                INSERT INTO periods SELECT customer, period, monetary FROM temp.batch WHERE true
+                ON CONFLICT (customer, period) DO UPDATE SET monetary = monetary + excluded.monetary
+            """)
+            self.connection.execute("INSERT INTO batches VALUES (?, ?)", (batchKey, len(df)))
+            self.connection.execute("DROP TABLE temp.batch")
+        return True
+
+    def summary(self, observationEnd=None, columnID: str = "id") -> pd.DataFrame:
+        """
+            Equivalente a summary_data_from_transaction_data (com monetary_value) sobre todas as transações aplicadas
+        """
+        lastPeriod = self.connection.execute("SELECT MAX(last_period) FROM customers").fetchone()[0]
+        if lastPeriod is None:
+            return pd.DataFrame(columns=["frequency", "recency", "T", "monetary_value"],
+                                index=pd.Index([], name=columnID), dtype=float)
+        if observationEnd is None:
+            observationPeriod = lastPeriod
+        else:
+            observationPeriod = pd.Timestamp(observationEnd).to_period(self.frequency).ordinal
+
+        if observationPeriod >= lastPeriod:
+            # Caso comum: o estado de cada cliente já é o resumo, sem olhar os períodos
+            state = pd.read_sql_query("""
+                SELECT customer, first_period, last_period, n_periods, total_monetary, first_monetary
+                FROM customers ORDER BY customer
+            """, self.connection)
+        else:
+            # Observação no passado: refaz o estado só com os períodos até a observação
+            state = pd.read_sql_query("""
+                SELECT
+                    p.customer,
+                    MIN(p.period) AS first_period,
+                    MAX(p.period) AS last_period,
+                    COUNT(*) AS n_periods,
+                    SUM(p.monetary) AS total_monetary,
+                    (SELECT f.monetary FROM periods f WHERE f.customer = p.customer ORDER BY f.period LIMIT 1)
+                        AS first_monetary
+                FROM periods p
+                WHERE p.period <= ?
+                GROUP BY p.customer
+                ORDER BY p.customer
+            """, self.connection, params=(observationPeriod,))
+
+        frequency = (state["n_periods"].to_numpy() - 1).astype(float)
+        repeatMonetary = state["total_monetary"].to_numpy() - state["first_monetary"].to_numpy()
+        return pd.DataFrame({
+            "frequency": frequency,
+            "recency": (state["last_period"] - state["first_period"]).to_numpy(dtype=float),
+            "T": (observationPeriod - state["first_period"]).to_numpy(dtype=float),
+            "monetary_value": np.divide(repeatMonetary, frequency, out=np.zeros_like(frequency), where=frequency > 0),
+        }, index=pd.Index(state["customer"], name=columnID))
@@ -0,0 +1,169 @@
+from pathlib import Path
+import weakref
+import numpy as np
+import pandas as pd
+
+
+class TransactionIndex:
+    """
+        Índice das transações por cliente (formato CSR): as transações ficam ordenadas por cliente e data em vetores
+        contíguos e offsets[c]:offsets[c + 1] são as transações do cliente c. Consultar um cliente ou um corte vira
+        um fatiamento dos vetores em vez de uma varredura do DataFrame inteiro
+    """
+
+    FILES = ["ids", "offsets", "rows", "dates", "monetary", "missing"]
+
+    # Índices já construídos, por DataFrame (as tarefas que recebem o mesmo DataFrame compartilham o índice)
+    __built: dict[int, tuple] = {}
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        offsets: np.ndarray,
+        rows: np.ndarray,
+        dates: np.ndarray,
+        monetary: np.ndarray,
+        missing: np.ndarray = None,
+    ) -> None:
+        """
+        Args:
+            ids, # Identificador de cada cliente, em ordem crescente
+            offsets, # Início das transações de cada cliente (tamanho len(ids) + 1)
+            rows, # Linha de cada transação no DataFrame original
+            dates, # Data de cada transação, em ns (int64)
+            monetary, # Valor de cada transação
+            missing = None # Linhas do DataFrame original sem identificador (NaN), que não entram no índice
+        """
+        self.ids = ids
+        self.offsets = offsets
+        self.rows = rows
+        self.dates = dates
+        self.monetary = monetary
+        self.missing = np.empty(0, dtype=np.int64) if missing is None else missing
+        self.__codes = None
+        self.__positions = None
+
+    @classmethod
+    def from_frame(
+        cls,
+        df: pd.DataFrame,
+        columnID: str = "id",
+        columnDate: str = "date",
+        columnMonetary: str = "monetary",
+    ):
+        codes, ids = pd.factorize(df[columnID], sort=True)
+        dates = pd.to_datetime(df[columnDate]).to_numpy(dtype="datetime64[ns]").view(np.int64)
+
+        rows = np.flatnonzero(codes >= 0)
+        missing = np.flatnonzero(codes < 0)
+        rows = rows[np.lexsort((dates[rows], codes[rows]))]
+        codes = codes[rows]
+
+        index = cls(
+            np.asarray(ids),
+            np.searchsorted(codes, np.arange(len(ids) + 1)),
+            rows,
+            dates[rows],
+            df[columnMonetary].to_numpy(dtype=np.float64)[rows],
+            missing,
+        )
+        index.__codes = codes
+        return index
+
+    @classmethod
+    def for_frame(
+        cls,
+        df: pd.DataFrame,
+        columnID: str = "id",
+        columnDate: str = "date",
+        columnMonetary: str = "monetary",
+    ):
+        """
+            Igual a from_frame, mas constrói o índice apenas uma vez para cada DataFrame e mapeamento de colunas
+        """
+        key = (id(df), columnID, columnDate, columnMonetary)
+        if key in cls.__built:
+            ref, index = cls.__built[key]
+            if ref() is df:
+                return index
+
+        index = cls.from_frame(df, columnID, columnDate, columnMonetary)
+        cls.__built[key] = (weakref.ref(df, lambda _: cls.__built.pop(key, None)), index)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def codes(self) -> np.ndarray:
+        """
+            Código do cliente de cada transação
+        """
+        if self.__codes is None:
+            self.__codes = np.repeat(np.arange(len(self.ids)), np.diff(self.offsets))
+        return self.__codes
+
+    def position(self, customerID) -> int | None:
+        """
+            Código (posição em ids) do cliente, ou None se o cliente não existe
+        """
+        # Identificadores em texto (ex: gravados pelo save) são comparados como texto
+        if self.ids.dtype.kind == "U":
+            customerID = str(customerID)
+        if self.__positions is None:
+            self.__positions = {customerID: code for code, customerID in enumerate(self.ids.tolist())}
+        return self.__positions.get(customerID)
+
+    def slice(self, customerID) -> slice:
+        code = self.position(customerID)
+        if code is None:
+            return slice(0, 0)
+        return slice(self.offsets[code], self.offsets[code + 1])
+
+    def customer(self, customerID) -> pd.DataFrame:
+        """
+            Transações do cliente, em ordem de data
+        """
+        s = self.slice(customerID)
+        return pd.DataFrame({
+            "id": np.repeat(customerID, s.stop - s.start),
+            "date": self.dates[s].view("datetime64[ns]"),
+            "monetary": self.monetary[s],
+        })
+
+    def rows_of(self, customerIDs, exclude: bool = False) -> np.ndarray:
+        """
+            Linhas (do DataFrame original, em ordem crescente) das transações dos clientes passados,
+            ou de todos os outros clientes se exclude=True. Mesmo resultado de df[columnID].isin(customerIDs)
+            (ou ~isin com exclude=True), inclusive para as linhas sem identificador
+        """
+        customerIDs = list(customerIDs)
+        selected = np.zeros(len(self.ids), dtype=bool)
+        codes = [self.position(customerID) for customerID in customerIDs]
+        selected[[code for code in codes if code is not None]] = True
+        # Como no isin, um NaN entre os clientes passados seleciona as linhas sem identificador
+        withMissing = any(pd.isna(customerID) for customerID in customerIDs)
+        if exclude:
+            selected, withMissing = ~selected, not withMissing
+        rows = self.rows[np.repeat(selected, np.diff(self.offsets))]
+        if withMissing:
+            rows = np.concatenate([rows, self.missing])
+        return np.sort(rows)
+
+    def save(self, directory: str | Path) -> None:
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        for name in self.FILES:
+            values = getattr(self, name)
+            # Identificadores em objeto são gravados com tipo fixo para poderem ser abertos com memory map: inteiros
+            # continuam inteiros e o resto vira texto
+            if values.dtype == object:
+                values = values.astype(np.int64 if pd.api.types.infer_dtype(values) == "integer" else str)
+            np.save(directory / f"{name}.npy", values)
+
+    @classmethod
+    def load(cls, directory: str | Path, mmap: bool = True):
+        directory = Path(directory)
+        # Índices gravados antes de existir o missing.npy não têm linhas sem identificador
+        files = [name for name in cls.FILES if (directory / f"{name}.npy").exists()]
+        return cls(*(np.load(directory / f"{name}.npy", mmap_mode="r" if mmap else None) for name in files))
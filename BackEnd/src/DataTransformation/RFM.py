@@ -1,9 +1,22 @@
 from src.workflows.task import Task
+from src.DataBase.Buckets import FrameParts, TransactionBuckets
+from src.DataBase.RFMStateStore import RFMStateStore
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import os
+import tempfile
 import pandas as pd
 from lifetimes.utils import (  # noqa: E402
     calibration_and_holdout_data,
     summary_data_from_transaction_data,
 )
+from src.DataTransformation.RFMEngine import (
+    EncodedTransactions,
+    calibration_and_holdout,
+    calibration_and_holdout_windows,
+    summary_data,
+)
+from src.DataTransformation.Segmentation import describe, quantile_scores, segment
 import numpy as np
 
 
@@ -48,6 +61,38 @@ dictClassificacao = {
 }
 
 
+# Transações compartilhadas com os processos que calculam as janelas de treino (uma cópia por processo)
+_windowTransactions = None
+
+
+def _init_window_worker(directory: str, ids, frequency: str) -> None:
+    """
+        Executado uma vez em cada processo: abre as colunas gravadas em disco com memory map
+    """
+    global _windowTransactions
+    directory = Path(directory)
+    codes = np.load(directory / "id.npy", mmap_mode="r")
+    _windowTransactions = (pd.DataFrame({
+        "id": codes if ids is None else ids.take(codes),
+        "date": np.load(directory / "date.npy", mmap_mode="r").view("datetime64[ns]"),
+        "monetary": np.load(directory / "monetary.npy", mmap_mode="r"),
+    }, copy=False), frequency)
+
+
+def _lifetimes_window(cutoff: tuple) -> pd.DataFrame:
+    df, frequency = _windowTransactions
+    calibrationEnd, observationEnd = cutoff
+    return calibration_and_holdout_data(
+        transactions=df,
+        customer_id_col="id",
+        datetime_col="date",
+        monetary_value_col="monetary",
+        freq=frequency,
+        calibration_period_end=calibrationEnd,
+        observation_period_end=observationEnd,
+    )
+
+
 class RFMTask(Task):
     def __init__(
         self,
@@ -64,6 +109,12 @@ class RFMTask(Task):
         split: float = 0.8,
         isTraining: bool = False,
         isRating: bool = False,
+        engine: str = "lifetimes",
+        nJobs: int = 1,
+        ratingPercent: float = 0.75,
+        scoreBins: int = None,
+        stateStore: str = None,
+        outputDir: str = None,
     ) -> None:
         """
         Args:
@@ -78,6 +129,15 @@ class RFMTask(Task):
                 maxTraining: int, # Qual será o último período que será usado para o treino
                 predictInterval: int = 4, # Define quantos períodos serão os intervalos de predição (Quantos periodos queremos prever)
                 isTraining # Fazer a divisão do dataFrame em calibration e holdout (se for Test isso ficara como true)
+                engine = "lifetimes" # "lifetimes" usa as funções do lifetimes, "numpy" usa a implementação vetorizada de RFMEngine
+                nJobs = 1 # Número de processos usados para calcular as janelas de treino com o lifetimes (None usa todos os núcleos)
+                ratingPercent = 0.75 # Percentil acima do qual o cliente entra no grupo alto de cada métrica (isRating)
+                scoreBins = None # Se definido, o rating também gera notas de 1 a scoreBins por quantil, Ex: 5 - quintis
+                stateStore = None # Arquivo SQLite com o estado RFM dos clientes. Se definido (e isTraining=False), só as linhas
+                                  # do df de entrada (o histórico inteiro, Ex: saída do CsvReadTask) depois das já aplicadas
+                                  # entram no estado, e a saída vem do estado
+                outputDir = None # Com a entrada fora da memória (TransactionBuckets), grava a saída bucket a bucket em partes
+                                 # Feather nessa pasta e retorna um FrameParts em vez de um DataFrame
         """
         super().__init__(name)
         self.columnID = columnID
@@ -92,16 +152,18 @@ class RFMTask(Task):
         self.maxTraining = maxTraining
         self.predictInterval = predictInterval
         self.isRating = isRating
-        
-        
+        assert engine in ("lifetimes", "numpy"), f"Unknown RFM engine '{engine}'"
+        self.engine = engine
+        self.nJobs = nJobs
+        self.ratingPercent = ratingPercent
+        self.scoreBins = scoreBins
+        self.stateStore = stateStore
+        self.outputDir = outputDir
+        self.transactions = None
 
-    def __getPeriodosList(self, df: pd.DataFrame):
-        def __to_period(df: pd.DataFrame):
-            return df.to_period(self.frequency)
 
-        df["period"] = df[self.columnDate].map(__to_period)
-        df = df.sort_values(by='period')
-        return df.period.unique()
+    def __getPeriodosList(self, df: pd.DataFrame):
+        return pd.PeriodIndex(df[self.columnDate], freq=self.frequency).unique().sort_values()
 
     def __getPeriodos(
         self, df: pd.DataFrame
@@ -124,11 +186,22 @@ class RFMTask(Task):
             Args:
                 df, #Dataframe do Pandas
             """
+            if self.stateStore is not None and not self.isTraining:
+                with RFMStateStore(self.stateStore, self.frequency) as store:
+                    store.sync(df, self.columnID, self.columnDate, self.columnMonetary)
+                    return store.summary(self.observationEnd, self.columnID)
+
             if self.calibrationEnd is None:
                 self.calibrationEnd, self.observationEnd = self.__getPeriodos(
                     df
                 )
-            
+
+            if self.engine == "numpy":
+                transactions = self.__encode(df)
+                if self.isTraining:
+                    return calibration_and_holdout(transactions, self.calibrationEnd, self.observationEnd)
+                return summary_data(transactions)
+
             if self.isTraining:
                 return calibration_and_holdout_data(
                     transactions=df,
@@ -148,52 +221,178 @@ class RFMTask(Task):
                     freq=self.frequency,
                 )
         
-    def __split_by_percentage(self, df: pd.DataFrame, column: str, percent=0.75):
-        limiar = df[column].sort_values().iloc[int(df.shape[0] * percent)]
-        return np.where(df[column] > limiar, 1, 0)
-    
+    def __encode(self, df: pd.DataFrame) -> EncodedTransactions:
+        # As transações são codificadas uma única vez e reaproveitadas em todos os cortes
+        if self.transactions is None:
+            self.transactions = EncodedTransactions(
+                df, self.columnID, self.columnDate, self.columnMonetary, self.frequency)
+        return self.transactions
+
+    def __parallel_windows(self, df: pd.DataFrame, cutoffs: list[tuple]) -> list[pd.DataFrame]:
+        """
+            Calcula cada janela de treino em um processo. As colunas são gravadas uma única vez em arquivos .npy que
+            os processos abrem com memory map, em vez de enviar o DataFrame inteiro para cada janela
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            ids = df[self.columnID]
+            if pd.api.types.is_integer_dtype(ids):
+                codes, uniques = ids.to_numpy(), None
+            else:
+                codes, uniques = pd.factorize(ids)
+            np.save(Path(directory) / "id.npy", codes)
+            np.save(Path(directory) / "date.npy",
+                    pd.to_datetime(df[self.columnDate]).to_numpy(dtype="datetime64[ns]").view(np.int64))
+            np.save(Path(directory) / "monetary.npy", df[self.columnMonetary].to_numpy(dtype=np.float64))
+
+            nJobs = min(len(cutoffs), self.nJobs or os.cpu_count() or 1)
+            with ProcessPoolExecutor(max_workers=nJobs, initializer=_init_window_worker,
+                                     initargs=(directory, uniques, self.frequency)) as executor:
+                # map devolve os resultados na ordem dos cortes, então a saída é determinística
+                windows = list(executor.map(_lifetimes_window, cutoffs))
+
+        for window in windows:
+            window.index.name = self.columnID
+        return windows
+
     def rating(self, df: pd.DataFrame) -> pd.DataFrame:
-        if self.isTraining:
-            df['groupFrequency'] = self.__split_by_percentage(df, 'frequency_cal')
-            df['groupRecency'] = self.__split_by_percentage(df, 'recency_cal')
-            df['groupMonetary'] = self.__split_by_percentage(df, 'monetary_value_cal')
-        else:
-            df['groupFrequency'] = self.__split_by_percentage(df, 'frequency')
-            df['groupRecency'] = self.__split_by_percentage(df, 'recency')
-            df['groupMonetary'] = self.__split_by_percentage(df, 'monetary_value')
+        suffix = "_cal" if self.isTraining else ""
+        frequency = df[f"frequency{suffix}"].to_numpy()
+        recency = df[f"recency{suffix}"].to_numpy()
+        monetary = df[f"monetary_value{suffix}"].to_numpy()
+
+        for column, values in segment(frequency, recency, monetary, self.ratingPercent).items():
+            df[column] = values
+
+        df['type'], df['description'], df['howToManage'] = describe(df['rankingClients'].to_numpy(), dictClassificacao)
+
+        if self.scoreBins is not None:
+            df['scoreFrequency'] = quantile_scores(frequency, self.scoreBins)
+            df['scoreRecency'] = quantile_scores(recency, self.scoreBins)
+            df['scoreMonetary'] = quantile_scores(monetary, self.scoreBins)
 
-        cols = ['groupFrequency', 'groupRecency', 'groupMonetary']
-        df['rankingClients'] = df[cols].apply(lambda row: int(''.join(row.values.astype(str)), 2), axis=1)
-        
-        df['type'] = df['rankingClients'].map(lambda x: dictClassificacao.get(x, ("Unknown", "", ""))[0])
-        df['description'] = df['rankingClients'].map(lambda x: dictClassificacao.get(x, ("Unknown", "", ""))[1])
-        df['howToManage'] = df['rankingClients'].map(lambda x: dictClassificacao.get(x, ("Unknown", "", ""))[2])
-        
         return df
 
 
+    def __cutoffs(self, periods: pd.PeriodIndex) -> list[tuple]:
+        if self.maxTraining == -1:
+            self.maxTraining = len(periods) - (self.predictInterval + 1)
+        if self.minTrainin == -1:
+            self.minTrainin = self.predictInterval * 2
+
+        return [
+            (periods[period].to_timestamp(), periods[period + self.predictInterval].to_timestamp())
+            for period in range(self.minTrainin, self.maxTraining, self.predictInterval)
+        ]
+
+    def __bucket_rfm(self, buckets: TransactionBuckets):
+        """
+            RFM calculado bucket a bucket (sempre com o motor NumPy): gera, para cada bucket, a lista com o RFM de cada
+            janela (uma só sem isTraining). Só as transações e o RFM de um bucket ficam na memória por vez, e cada
+            cliente está inteiro em um único bucket
+        """
+        if not self.isTraining:
+            observationEnd = self.observationEnd if self.observationEnd is not None else buckets.maxDate
+            for df in buckets:
+                yield [summary_data(EncodedTransactions(df, frequency=self.frequency), observationEnd)]
+            return
+
+        cutoffs = self.__cutoffs(buckets.periods(self.frequency))
+        hasHoldout = np.zeros(len(cutoffs), dtype=bool)
+        for df in buckets:
+            transactions = EncodedTransactions(df, frequency=self.frequency)
+            frames = []
+            for i, (calibrationEnd, observationEnd) in enumerate(cutoffs):
+                customers, columns = transactions.window(calibrationEnd, observationEnd, check=False)
+                hasHoldout[i] |= bool((columns["frequency_holdout"] > 0).any())
+                frames.append(transactions.to_frame(customers, columns))
+            del transactions, df
+            yield frames
+
+        if not hasHoldout.all():
+            raise ValueError(
+                "There is no data available. Check the `observation_period_end` and  `calibration_period_end` and confirm that values in `transactions` occur prior to those dates."
+            )
+        if cutoffs:
+            self.calibrationEnd, self.observationEnd = cutoffs[-1]
+
+    def __out_of_core(self, buckets: TransactionBuckets) -> pd.DataFrame:
+        """
+            RFM fora da memória juntado em um único DataFrame, na mesma ordem do cálculo em memória (a saída, uma linha
+            por cliente e janela, precisa caber na memória)
+        """
+        bucketFrames = list(self.__bucket_rfm(buckets))
+        if not self.isTraining:
+            frames = [windows[0] for windows in bucketFrames]
+            dfReturn = pd.concat(frames).sort_index(kind="stable") if frames else pd.DataFrame()
+            dfReturn.index.name = self.columnID
+            return dfReturn
+
+        windows = list(zip(*bucketFrames))
+        if not windows:
+            return pd.DataFrame()
+        dfReturn = pd.concat([pd.concat(frames).sort_index(kind="stable") for frames in windows])
+        intHoldout = bool((dfReturn["frequency_holdout"] > 0).all())
+        dfReturn["frequency_holdout"] = dfReturn["frequency_holdout"].astype(np.int64 if intHoldout else float)
+        dfReturn.index.name = self.columnID
+        return dfReturn
+
+    def __out_of_core_parts(self, buckets: TransactionBuckets) -> FrameParts:
+        """
+            RFM fora da memória gravado em outputDir, uma parte por bucket (as janelas do bucket em sequência): a
+            memória não depende do tamanho da base nem da saída
+        """
+        parts = FrameParts.create(self.outputDir)
+        for frames in self.__bucket_rfm(buckets):
+            df = pd.concat(frames)
+            if self.isTraining:
+                # O tipo não pode depender das outras partes (no cálculo em memória é int64 só se todos têm compras)
+                df["frequency_holdout"] = df["frequency_holdout"].astype(float)
+            df.index.name = self.columnID
+            parts.append(df.reset_index())
+        parts.finish()
+        print(f"Wrote the RFM of {parts.rows} rows in {len(parts)} parts to {self.outputDir}")
+        return parts
+
     def on_run(self, df: pd.DataFrame) -> pd.DataFrame:
+        # df também pode ser um TransactionBuckets (CsvReadTask com bucketDir). A anotação continua pd.DataFrame porque
+        # Task.get_dependencies trata qualquer tipo genérico (inclusive uniões) como uma lista de dependências
+        if isinstance(df, TransactionBuckets):
+            if self.outputDir is not None:
+                # O rating usa percentis de todos os clientes, então precisa da saída inteira
+                assert not self.isRating, "isRating requires the whole RFM in memory (outputDir=None)"
+                return self.__out_of_core_parts(df)
+            dfReturn = self.__out_of_core(df)
+            if self.isRating:
+                dfReturn = self.rating(dfReturn)
+            return dfReturn.reset_index()
+
         assert self.columnID in df.columns, f"ID column '{self.columnID}' not found in DataFrame columns: {df.columns}"
         assert self.columnMonetary in df.columns, f"Monetary column '{self.columnMonetary}' not found in DataFrame columns: {df.columns}"
         assert self.columnDate in df.columns, f"Date column '{self.columnDate}' not found in DataFrame columns: {df.columns}"
         
         dfReturn = pd.DataFrame()
         if self.isTraining:
-            periods = self.__getPeriodosList(df)
-            
-            if self.maxTraining == -1:
-                self.maxTraining = len(periods) - (self.predictInterval + 1)
-            if self.minTrainin == -1:
-                self.minTrainin = self.predictInterval * 2
-            
-            for period in range(self.minTrainin, self.maxTraining, self.predictInterval):
-                self.calibrationEnd = periods[period].to_timestamp()
-                self.observationEnd = periods[period + self.predictInterval].to_timestamp()
-                dfReturn = pd.concat([dfReturn, self.__generate_rfm_summary(df)])
+            cutoffs = self.__cutoffs(self.__getPeriodosList(df))
+
+            if self.engine == "numpy":
+                # Todas as janelas em uma passada sobre as transações já ordenadas
+                dfReturn = calibration_and_holdout_windows(self.__encode(df), cutoffs)
+                if cutoffs:
+                    self.calibrationEnd, self.observationEnd = cutoffs[-1]
+            else:
+                if self.nJobs != 1 and len(cutoffs) > 1:
+                    windows = self.__parallel_windows(df, cutoffs)
+                    self.calibrationEnd, self.observationEnd = cutoffs[-1]
+                else:
+                    windows = []
+                    for self.calibrationEnd, self.observationEnd in cutoffs:
+                        windows.append(self.__generate_rfm_summary(df))
+                if windows:
+                    dfReturn = pd.concat(windows)
         else:
             dfReturn = self.__generate_rfm_summary(df)
         
         if self.isRating:
             dfReturn = self.rating(dfReturn)
         
-        return dfReturn.reset_index()
\ No newline at end of file
+        return dfReturn.reset_index()
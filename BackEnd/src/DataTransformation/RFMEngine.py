@@ -0,0 +1,202 @@
+"""
+    Implementação vetorizada (NumPy) de summary_data_from_transaction_data e calibration_and_holdout_data do lifetimes.
+
+    As transações são codificadas uma única vez (TransactionIndex): clientes viram códigos inteiros, datas viram
+    inteiros (ns) e períodos viram ordinais do pandas. Com as transações ordenadas por (cliente, data), qualquer corte
+    temporal vira um prefixo de cada cliente, então as estatísticas saem de somas acumuladas em vez de groupbys.
+"""
+from src.DataBase.TransactionIndex import TransactionIndex
+import numpy as np
+import pandas as pd
+
+
+class EncodedTransactions:
+    def __init__(
+        self,
+        df: pd.DataFrame,
+        columnID: str = "id",
+        columnDate: str = "date",
+        columnMonetary: str = "monetary",
+        frequency: str = "W",
+        index: TransactionIndex = None,
+    ) -> None:
+        """
+        Args:
+            df, # Transações (uma linha por compra)
+            columnID, columnDate, columnMonetary # Nome das colunas de identificador, data e valor monetário
+            frequency = 'W' # Frequência dos períodos, Ex: "W" - Weeks
+            index = None # Índice por cliente já construído (ex: TransactionIndex.load), nesse caso df não é usado
+        """
+        self.frequency = frequency
+        self.columnID = columnID
+
+        # O índice por cliente é compartilhado com as outras tarefas que recebem o mesmo DataFrame
+        if index is None:
+            index = TransactionIndex.for_frame(df, columnID, columnDate, columnMonetary)
+        self.ids = index.ids
+        self.offsets = index.offsets
+        self.codes = index.codes
+        self.dates = index.dates
+        self.monetary = index.monetary
+        self.periods = self.to_periods(self.dates)
+
+        # Chave ordenada (cliente, posto da data) para achar o corte de todos os clientes com uma busca binária
+        self.uniqueDates, dateRank = np.unique(self.dates, return_inverse=True)
+        self.keySpan = len(self.uniqueDates) + 1
+        self.keys = self.codes.astype(np.int64) * self.keySpan + dateRank
+
+        # Marca a primeira transação de cada período de cada cliente
+        self.newPeriod = np.ones(len(self.codes), dtype=bool)
+        self.newPeriod[1:] = (self.codes[1:] != self.codes[:-1]) | (self.periods[1:] != self.periods[:-1])
+
+        firstPeriod = np.repeat(self.periods[self.offsets[:-1]], np.diff(self.offsets))
+        self.firstPeriod = self.periods[self.offsets[:-1]]
+
+        # Somas acumuladas (com um zero inicial) usadas para obter qualquer prefixo em O(1)
+        self.cumNewPeriod = _cumsum(self.newPeriod)
+        self.cumMonetary = _cumsum(self.monetary)
+        self.cumRepeatMonetary = _cumsum(np.where(self.periods != firstPeriod, self.monetary, 0.0))
+
+    def to_periods(self, dates: np.ndarray) -> np.ndarray:
+        return pd.PeriodIndex(pd.DatetimeIndex(dates.view("datetime64[ns]")), freq=self.frequency).asi8
+
+    def to_period(self, date) -> int:
+        return pd.Timestamp(date).to_period(self.frequency).ordinal
+
+    def prefix_end(self, cut: int) -> np.ndarray:
+        """
+            Posição final (exclusiva) das transações de cada cliente com data <= cut (em ns)
+        """
+        rank = np.searchsorted(self.uniqueDates, cut, side="right")
+        return np.searchsorted(self.keys, np.arange(len(self.ids), dtype=np.int64) * self.keySpan + rank)
+
+    def summary(self, end: np.ndarray, observationPeriod: int, suffix: str = "") -> tuple[np.ndarray, dict[str, np.ndarray]]:
+        """
+            frequency, recency, T e monetary_value de cada cliente considerando as transações até `end`.
+            Retorna os códigos dos clientes que têm alguma transação e as colunas calculadas
+        """
+        start = self.offsets[:-1]
+        customers = np.flatnonzero(end > start)
+        start, end = start[customers], end[customers]
+
+        frequency = (self.cumNewPeriod[end] - self.cumNewPeriod[start] - 1).astype(float)
+        recency = (self.periods[end - 1] - self.firstPeriod[customers]).astype(float)
+        T = (observationPeriod - self.firstPeriod[customers]).astype(float)
+        repeatMonetary = self.cumRepeatMonetary[end] - self.cumRepeatMonetary[start]
+        monetary = np.divide(repeatMonetary, frequency, out=np.zeros_like(frequency), where=frequency > 0)
+
+        return customers, {
+            f"frequency{suffix}": frequency,
+            f"recency{suffix}": recency,
+            f"T{suffix}": T,
+            f"monetary_value{suffix}": monetary,
+        }
+
+    def window(self, calibrationEnd, observationEnd=None, check: bool = True) -> tuple[np.ndarray, dict[str, np.ndarray]]:
+        """
+            Colunas _cal e _holdout de um corte (calibrationEnd, observationEnd). Com check=False um corte sem nenhuma
+            transação no holdout não gera erro (ex: um bucket pequeno do modo fora da memória)
+        """
+        calibrationEnd = pd.Timestamp(calibrationEnd)
+        observationEnd = pd.Timestamp(observationEnd) if observationEnd is not None else \
+            pd.Timestamp(self.dates.max())
+
+        calibrationCut = self.prefix_end(calibrationEnd.value)
+        observationCut = np.maximum(self.prefix_end(observationEnd.value), calibrationCut)
+        if check and (observationCut == calibrationCut).all():
+            raise ValueError(
+                "There is no data available. Check the `observation_period_end` and  `calibration_period_end` and confirm that values in `transactions` occur prior to those dates."
+            )
+
+        calibrationPeriod = self.to_period(calibrationEnd)
+        customers, columns = self.summary(calibrationCut, calibrationPeriod, suffix="_cal")
+
+        start, end = calibrationCut[customers], observationCut[customers]
+        count = end - start
+        hasHoldout = count > 0
+
+        # Um período que começou na calibração e continua no holdout também conta como período do holdout
+        continued = np.zeros(len(start), dtype=bool)
+        continued[hasHoldout] = ~self.newPeriod[start[hasHoldout]]
+        columns["frequency_holdout"] = self.cumNewPeriod[end] - self.cumNewPeriod[start] + continued
+
+        # No holdout o lifetimes usa a média das transações (e não dos períodos)
+        monetaryHoldout = self.cumMonetary[end] - self.cumMonetary[start]
+        columns["monetary_value_holdout"] = np.divide(
+            monetaryHoldout, count, out=np.zeros_like(monetaryHoldout), where=hasHoldout)
+        columns["duration_holdout"] = np.full(len(customers), float(self.to_period(observationEnd) - calibrationPeriod))
+        return customers, columns
+
+    def to_frame(self, customers: np.ndarray, columns: dict[str, np.ndarray]) -> pd.DataFrame:
+        return pd.DataFrame(columns, index=pd.Index(self.ids.take(customers), name=self.columnID), copy=False)
+
+
+def _cumsum(values: np.ndarray) -> np.ndarray:
+    out = np.zeros(len(values) + 1, dtype=np.float64 if values.dtype.kind == "f" else np.int64)
+    np.cumsum(values, out=out[1:])
+    return out
+
+
+def _holdout_dtype(columns: dict[str, np.ndarray], customers: np.ndarray) -> dict[str, np.ndarray]:
+    # Mesmo tipo do lifetimes: o join com clientes sem holdout gera NaN e converte a coluna para float
+    if (columns["frequency_holdout"] == 0).any() or not len(customers):
+        columns["frequency_holdout"] = columns["frequency_holdout"].astype(float)
+    return columns
+
+
+def summary_data(transactions: EncodedTransactions, observationEnd=None) -> pd.DataFrame:
+    """
+        Equivalente a lifetimes.utils.summary_data_from_transaction_data (com monetary_value)
+    """
+    if observationEnd is None:
+        observationPeriod = int(transactions.periods.max())
+    else:
+        observationPeriod = transactions.to_period(observationEnd)
+
+    # Todas as transações até o fim do período de observação (inclusive)
+    nextPeriodStart = pd.Period(ordinal=observationPeriod + 1, freq=transactions.frequency).start_time
+    end = transactions.prefix_end(nextPeriodStart.value - 1)
+
+    return transactions.to_frame(*transactions.summary(end, observationPeriod))
+
+
+def calibration_and_holdout(transactions: EncodedTransactions, calibrationEnd, observationEnd=None) -> pd.DataFrame:
+    """
+        Equivalente a lifetimes.utils.calibration_and_holdout_data (com monetary_value)
+    """
+    customers, columns = transactions.window(calibrationEnd, observationEnd)
+    return transactions.to_frame(customers, _holdout_dtype(columns, customers))
+
+
+def calibration_and_holdout_windows(transactions: EncodedTransactions, cutoffs: list[tuple]) -> pd.DataFrame:
+    """
+        Equivalente a concatenar calibration_and_holdout para cada corte (calibrationEnd, observationEnd), na ordem
+        dos cortes. Cada corte custa apenas buscas binárias sobre as somas acumuladas, e o resultado é escrito em
+        um DataFrame pré-alocado em vez de concatenado a cada iteração
+    """
+    if not cutoffs:
+        return pd.DataFrame()
+
+    # Primeiro só conta quantos clientes cada corte tem, para alocar a saída uma única vez
+    start = transactions.offsets[:-1]
+    sizes = [int((transactions.prefix_end(pd.Timestamp(calibrationEnd).value) > start).sum())
+             for calibrationEnd, _ in cutoffs]
+    total = sum(sizes)
+    customers = np.empty(total, dtype=np.int64)
+    columns = None
+
+    offset = 0
+    intHoldout = True
+    for (calibrationEnd, observationEnd), size in zip(cutoffs, sizes):
+        windowCustomers, windowColumns = transactions.window(calibrationEnd, observationEnd)
+        if columns is None:
+            columns = {name: np.empty(total, dtype=float) for name in windowColumns}
+        customers[offset:offset + size] = windowCustomers
+        for name, values in windowColumns.items():
+            columns[name][offset:offset + size] = values
+        intHoldout &= bool((windowColumns["frequency_holdout"] > 0).all())
+        offset += size
+
+    if intHoldout:
+        columns["frequency_holdout"] = columns["frequency_holdout"].astype(np.int64)
+    return transactions.to_frame(customers, columns)
@@ -0,0 +1,80 @@
+"""
+    Segmentação RFM vetorizada.
+
+    Os limiares são obtidos por seleção (np.partition, O(n)) em vez de ordenar a coluna inteira, o grupo de cada
+    cliente é montado com operações de bits sobre vetores inteiros e as descrições dos grupos saem como Categoricals
+    (um código por cliente em vez de uma string repetida por cliente).
+"""
+import numpy as np
+import pandas as pd
+
+
+def threshold(values: np.ndarray, percent: float = 0.75) -> float:
+    """
+        Valor na posição int(n * percent) dos valores ordenados (o mesmo que sort_values().iloc[int(n * percent)])
+    """
+    values = np.asarray(values, dtype=np.float64)
+    k = int(len(values) * percent)
+    return np.partition(values, k)[k]
+
+
+def split_by_percentage(values: np.ndarray, percent: float = 0.75) -> np.ndarray:
+    """
+        1 para os valores acima do limiar de `percent`, 0 para os demais
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return np.zeros(0, dtype=np.int8)
+    return (values > threshold(values, percent)).astype(np.int8)
+
+
+def quantile_scores(values: np.ndarray, nBins: int = 5) -> np.ndarray:
+    """
+        Nota de 1 a nBins pelo quantil do valor (ex: nBins=5 gera quintis). Os limites seguem a mesma regra de
+        split_by_percentage: um valor só sobe de nota se for maior que o limite, então valores repetidos em um limite
+        ficam na nota de baixo e as notas podem ficar desbalanceadas (ex: muitos clientes com frequency 0)
+    """
+    assert nBins >= 2, "nBins must be at least 2"
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return np.zeros(0, dtype=np.int8)
+
+    kth = [int(len(values) * i / nBins) for i in range(1, nBins)]
+    edges = np.partition(values, kth)[kth]
+    return (np.searchsorted(edges, values, side="left") + 1).astype(np.int8)
+
+
+def segment(frequency: np.ndarray, recency: np.ndarray, monetary: np.ndarray, percent: float = 0.75) -> dict[str, np.ndarray]:
+    """
+        Grupos de frequência, recência e valor monetário e o ranking do cliente, que junta os três grupos como bits
+        (frequência, recência, monetário), Ex: 1, 0, 1 -> 0b101 = 5
+    """
+    groupFrequency = split_by_percentage(frequency, percent)
+    groupRecency = split_by_percentage(recency, percent)
+    groupMonetary = split_by_percentage(monetary, percent)
+    return {
+        "groupFrequency": groupFrequency,
+        "groupRecency": groupRecency,
+        "groupMonetary": groupMonetary,
+        "rankingClients": (groupFrequency << 2) | (groupRecency << 1) | groupMonetary,
+    }
+
+
+def describe(ranking: np.ndarray, classes: dict[int, tuple], unknown: tuple = ("Unknown", "", "")) -> list[pd.Categorical]:
+    """
+        Para cada campo das classes (Ex: tipo, descrição e como gerenciar) um Categorical com o valor de cada cliente.
+        As categorias são montadas uma vez e cada cliente recebe apenas o código da sua classe
+    """
+    ranking = np.asarray(ranking, dtype=np.int64)
+    size = max(max(classes) + 1, int(ranking.max(initial=0)) + 1)
+    # Ranks sem classe apontam para a última posição da tabela (`unknown`)
+    lookup = np.full(size + 1, len(classes), dtype=np.int64)
+    lookup[list(classes)] = np.arange(len(classes))
+    rows = lookup[np.where(ranking >= 0, ranking, size)]
+
+    columns = []
+    for field, unknownValue in enumerate(unknown):
+        values = [value[field] for value in classes.values()] + [unknownValue]
+        categories, codes = np.unique(values, return_inverse=True)
+        columns.append(pd.Categorical.from_codes(codes[rows], categories=categories))
+    return columns
@@ -70,13 +70,13 @@ class PlotTask(Task):
         return self.generatePieData(data)
 
     def plotMonetaryClientes(self, df: pd.DataFrame):
-        data = df.groupby([self.colRank]).sum()[self.colMonetary]
+        data = df.groupby(self.colRank)[self.colMonetary].sum()
         return self.generatePieData(data)
 
     def plotFrequencyClientes(self, df: pd.DataFrame):
         dfNew = df.copy()
         dfNew['newFreq'] = df[self.colFreq] + 1
-        data = dfNew.groupby([self.colRank]).sum()[self.colFreq]
+        data = dfNew.groupby(self.colRank)[self.colFreq].sum()
         return self.generatePieData(data)
 
     def plotLTVByClientType(self, df: pd.DataFrame):
@@ -85,7 +85,7 @@ class PlotTask(Task):
             raise ValueError("As colunas 'type' e 'LTV' são necessárias no DataFrame.")
 
         # Agrupar os dados por tipo de cliente e somar o LTV
-        grouped_data = df.groupby('type')['LTV'].sum().reset_index()
+        grouped_data = df.groupby('type', observed=True)['LTV'].sum().reset_index()
 
         # Estruturar os dados em um formato adequado para o gráfico
         result = []
@@ -25,6 +25,7 @@ class GenericModelTask(Task):
         self.isTunning = isTunning
         self.isMonetary = isMonetary
         self.isRating = isRating
+        self.isFitted = False
 
     @abstractmethod
     def on_run(self, dfRFM: pd.DataFrame) -> pd.DataFrame:
@@ -32,7 +33,8 @@ class GenericModelTask(Task):
             Dado um dataset com os valores de RFM, retorna a predição do número de transações esperadas
         """
         self.data_predict = self.task_in["data_predict"].output
-        self.data_training = self.task_in["data_training"].output
+        # No modo só de predição (modelo carregado de um artefato) não há a tarefa de treino
+        self.data_training = self.task_in["data_training"].output if "data_training" in self.task_in else None
 
     @abstractmethod
     def predict(self):
@@ -0,0 +1,65 @@
+from sklearn.pipeline import Pipeline
+import time
+import numpy as np
+import pandas as pd
+
+
+class InferenceModel:
+    """
+        StandardScaler e melhor modelo já ajustados em um único objeto de predição, com o mapeamento explícito das
+        colunas de treino (Ex: frequency_cal) para as colunas da predição (Ex: frequency).
+
+        A predição é feita em blocos de chunkSize clientes: só um bloco das colunas de entrada é copiado de cada vez,
+        então a memória extra não depende do número de clientes
+    """
+
+    def __init__(self, scaler, model, columns: dict[str, str], chunkSize: int = 1 << 16) -> None:
+        """
+        Args:
+            scaler, # StandardScaler ajustado nas colunas de treino
+            model, # Melhor modelo, treinado com os dados normalizados
+            columns, # Coluna de treino -> coluna da predição, na ordem das colunas do treino
+            chunkSize = 1 << 16 # Clientes por bloco da predição
+        """
+        self.pipeline = Pipeline([("scaler", scaler), ("model", model)])
+        self.columns = dict(columns)
+        self.chunkSize = chunkSize
+        # Linhas, tempo e linhas por segundo da última predição
+        self.throughput = None
+
+    @classmethod
+    def from_training_columns(cls, scaler, model, X_Columns: list[str], chunkSize: int = 1 << 16) -> "InferenceModel":
+        """
+            Mapeamento padrão do RFM: a coluna da predição é a de treino sem o sufixo _cal
+        """
+        return cls(scaler, model, {column: column.removesuffix("_cal") for column in X_Columns}, chunkSize)
+
+    @property
+    def model(self):
+        return self.pipeline.named_steps["model"]
+
+    @property
+    def scaler(self):
+        return self.pipeline.named_steps["scaler"]
+
+    def predict(self, df: pd.DataFrame) -> np.ndarray:
+        missing = [column for column in self.columns.values() if column not in df.columns]
+        assert not missing, f"Prediction columns {missing} not found in DataFrame columns: {df.columns}"
+
+        start = time.perf_counter()
+        sources = [df[column].to_numpy() for column in self.columns.values()]
+        predictions = np.empty(len(df))
+        for begin in range(0, len(df), self.chunkSize):
+            rows = slice(begin, begin + self.chunkSize)
+            # Bloco com os nomes das colunas de treino, que o StandardScaler confere
+            chunk = pd.DataFrame({name: values[rows] for name, values in zip(self.columns, sources)}, copy=False)
+            predictions[rows] = self.pipeline.predict(chunk)
+
+        seconds = time.perf_counter() - start
+        self.throughput = {
+            "rows": len(df),
+            "seconds": seconds,
+            "rowsPerSecond": len(df) / seconds if seconds > 0 else float("inf"),
+            "chunks": -(-len(df) // self.chunkSize),
+        }
+        return predictions
@@ -1,6 +1,14 @@
+from pathlib import Path
+import copy
+import math
+import multiprocessing
+import os
+import tempfile
+import time
 import pandas as pd
 from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score, median_absolute_error
 from sklearn.preprocessing import StandardScaler
+from scipy.stats import spearmanr
 
 import numpy as np
 import xgboost as xgb
@@ -10,6 +18,38 @@ from sklearn.model_selection import GridSearchCV, train_test_split
 from sklearn.ensemble import GradientBoostingRegressor, HistGradientBoostingRegressor, RandomForestRegressor
 
 from src.GenericModels.GenericModel import GenericModelTask
+from src.GenericModels.Inference import InferenceModel
+from src.GenericModels.Tuning import SuccessiveHalvingSearch
+from src.DataBase.CandidateCache import CandidateCache
+
+
+# Fração do tempo de cada candidato (no timeBudget) usada pela busca de hiperparâmetros, o resto fica para o treino
+# final do melhor candidato da busca com todas as linhas
+TUNING_SHARE = 0.5
+
+# Dados de treino e teste compartilhados com os processos que treinam os candidatos (uma cópia por processo)
+_candidateData = None
+
+
+def _init_candidate_worker(directory: str) -> None:
+    """
+        Executado uma vez em cada processo: abre X_train e X_test gravados em disco com memory map
+    """
+    global _candidateData
+    directory = Path(directory)
+    _candidateData = tuple(np.load(directory / f"{name}.npy", mmap_mode="r")
+                           for name in ("X_train", "Y_train", "X_test", "Y_test"))
+
+
+def _fit_candidate(model) -> tuple[float, float, object]:
+    """
+        Treina um candidato e retorna o MSE no teste, o tempo de treino e o modelo treinado
+    """
+    X_train, Y_train, X_test, Y_test = _candidateData
+    start = time.perf_counter()
+    model.fit(X_train, Y_train)
+    seconds = time.perf_counter() - start
+    return mean_squared_error(Y_test, model.predict(X_test)), seconds, model
 
 
 class MachineLearningModelTask(GenericModelTask):
@@ -25,17 +65,59 @@ class MachineLearningModelTask(GenericModelTask):
         X_Columns: list = None,
         isTunning: bool = False,
         isRating: bool = False,
+        nJobs: int = None,
+        timeBudget: float = None,
+        searchMode: str = "halving",
+        tuningBudget: float = None,
+        nCandidates: int = None,
+        screenSize: float = None,
+        screenTopK: int = 2,
+        candidateCache: str = None,
+        candidateCacheSize: int = 1 << 30,
+        chunkSize: int = 1 << 16,
     ) -> None:
         """
         Args:
             name, # Nome da tarefa
             target, # Nome da coluna onde está o valor alvo (Y)
             isTunning, # Fazer o Tunning de hyperparâmetros se for True
+            nJobs = None # Número de processos que treinam os candidatos ao mesmo tempo (None usa todos os núcleos)
+            timeBudget = None # Tempo máximo (segundos) da seleção, os candidatos que não terminaram são cancelados
+            searchMode = "halving" # Busca do isTunning: "halving" (successive halving com early stopping nos modelos
+                                   # boosted) ou "grid" (GridSearchCV com a grade inteira)
+            tuningBudget = None # Tempo máximo (segundos) da busca de cada candidato no modo "halving". Com um
+                                # timeBudget a busca também para na fatia do candidato no tempo que resta (None
+                                # limita só por essa fatia)
+            nCandidates = None # Combinações sorteadas de cada grade no modo "halving" (None usa a grade inteira)
+            screenSize = None # Linhas (ou fração, se < 1) da amostra em que todos os candidatos são comparados antes
+                              # de treinar com todos os dados (None treina todos com todos os dados)
+            screenTopK = 2 # Candidatos da amostra que são treinados com todos os dados
+            candidateCache = None # Pasta do cache dos candidatos já treinados (None desativa o cache)
+            candidateCacheSize = 1 << 30 # Tamanho máximo do cache em bytes, os candidatos usados há mais tempo saem
+            chunkSize = 1 << 16 # Clientes por bloco na predição
         """
         super().__init__(name, target, isMonetary, isTunning, isRating)
+        self.nJobs = nJobs
+        self.timeBudget = timeBudget
+        self.searchMode = searchMode
+        self.tuningBudget = tuningBudget
+        self.nCandidates = nCandidates
+        self.screenSize = screenSize
+        self.screenTopK = screenTopK
+        self.candidateCache = CandidateCache(candidateCache, candidateCacheSize) if candidateCache else None
+        self.chunkSize = chunkSize
         self.models = self.createModels()
 
         self.bestModel = None
+        self.scaler = None
+        # StandardScaler + melhor modelo usados na predição
+        self.inferenceModel = None
+        # MSE, tempo de treino e situação de cada candidato na última seleção
+        self.candidateReport = None
+        # Avaliações da busca de hiperparâmetros de cada candidato (modo "halving")
+        self.searchTraces = None
+        # Concordância entre a triagem na amostra e o treino com todos os dados
+        self.screenReport = None
 
         self.X_Columns = X_Columns
 
@@ -47,6 +129,25 @@ class MachineLearningModelTask(GenericModelTask):
     def on_run(self, dfRFM: pd.DataFrame) -> pd.DataFrame:
         super().on_run(dfRFM)
 
+        # Com um artefato carregado (load_artifact) só faz a predição
+        if not self.isFitted:
+            self.train()
+
+        if self.isMonetary:
+            xExpected = "ExpectedMonetary"
+        else:
+            xExpected = "ExpectedFrequency"
+
+        # Normaliza com o mesmo StandardScaler do treino, bloco a bloco
+        self.data_predict[xExpected] = self.inferenceModel.predict(self.data_predict)
+        print(f"Predição de {type(self.inferenceModel.model).__name__}:", self.inferenceModel.throughput)
+
+        return self.data_predict
+
+    def train(self) -> None:
+        """
+            Normaliza os dados de treino e seleciona o melhor modelo
+        """
         if self.target not in self.data_training.columns:
             raise ValueError(
                 f"Target column '{self.target}' not found in DataFrame columns: {self.data_training.columns}")
@@ -61,23 +162,38 @@ class MachineLearningModelTask(GenericModelTask):
         Y = Y[Y.index.isin(X.index.values)]
 
         # Normalizar os dados
-        scaler = StandardScaler()
-        X = scaler.fit_transform(X)
+        self.scaler = StandardScaler()
+        X = self.scaler.fit_transform(X)
 
         self.X_train, self.X_test, self.Y_train, self.Y_test = train_test_split(
             X, np.ravel(Y.values), random_state=42)
 
         self.bestModel = self.selectBestModel()
+        self.inferenceModel = InferenceModel.from_training_columns(self.scaler, self.bestModel, self.X_Columns,
+                                                                   self.chunkSize)
+        self.isFitted = True
 
-        if self.isMonetary:
-            xExpected = "ExpectedMonetary"
-        else:
-            xExpected = "ExpectedFrequency"
-
-        self.data_predict[xExpected] = self.bestModel.predict(
-            self.data_predict[["frequency", "recency", "T", "monetary_value"]])
+    def to_artifact(self) -> dict:
+        """
+            O que é preciso para prever sem treinar de novo: o StandardScaler e o melhor modelo em um único objeto
+        """
+        return {"inference": self.inferenceModel}
 
-        return self.data_predict
+    def load_artifact(self, artifact: dict) -> None:
+        """
+            Usa o modelo de um artefato (to_artifact) em vez de treinar os candidatos no on_run
+        """
+        if "inference" in artifact:
+            self.inferenceModel = artifact["inference"]
+            self.inferenceModel.chunkSize = self.chunkSize
+        else:
+            # Artefatos antigos guardavam o modelo e o StandardScaler separados
+            self.inferenceModel = InferenceModel.from_training_columns(artifact["scaler"], artifact["model"],
+                                                                       artifact["X_Columns"], self.chunkSize)
+        self.bestModel = self.inferenceModel.model
+        self.scaler = self.inferenceModel.scaler
+        self.X_Columns = list(self.inferenceModel.columns)
+        self.isFitted = True
     
     def ratingBestModel(self, predict: pd.DataFrame) -> pd.DataFrame:
         print("Metricas do ",type(self.bestModel).__name__)
@@ -87,13 +203,53 @@ class MachineLearningModelTask(GenericModelTask):
 
     def selectBestModel(self):
         """
-            Seleciona o melhor modelo de acordo com o dataset passado
+            Seleciona o melhor modelo de acordo com o dataset passado: o menor MSE entre os candidatos que terminaram
+            dentro do timeBudget (em um empate, o primeiro da lista de candidatos).
+            Com screenSize os candidatos são antes comparados em uma amostra estratificada do treino, e só os
+            screenTopK melhores da amostra são treinados com todos os dados
         """
+        deadline = None if self.timeBudget is None else time.monotonic() + self.timeBudget
+        self.candidateReport = [{"model": self.__model_name(model), "mse": None, "seconds": None, "status": "cancelled"}
+                                for model in self.models]
+        self.searchTraces = {}
+        self.screenReport = None
+
+        finalists = range(len(self.models))
+        sampleSize = self.__screen_size()
+        if sampleSize is not None:
+            rows = self.__stratified_sample(sampleSize)
+            # Cópias sem treino, os modelos da lista são treinados depois com todos os dados
+            sampleResults = self.__train_candidates([copy.deepcopy(model) for model in self.models],
+                                                    self.X_train[rows], self.Y_train[rows], deadline)
+            screened = [i for i, result in enumerate(sampleResults) if result is not None]
+            for i in screened:
+                self.candidateReport[i].update(sampleMse=float(sampleResults[i][0]), sampleSeconds=sampleResults[i][1],
+                                               status="screened out")
+            finalists = sorted(sorted(screened, key=lambda i: (sampleResults[i][0], i))[:self.screenTopK])
+
+        results = self.__train_candidates([self.models[i] for i in finalists], self.X_train, self.Y_train, deadline)
+
         bestScore = None
-        for model in self.models:
-            score = self.fitAndRating(model)
-            if bestScore is None or bestScore > score[0]:
-                bestScore, self.bestModel = score
+        for i, result in zip(finalists, results):
+            entry = self.candidateReport[i]
+            if result is None:
+                entry["status"] = "cancelled"
+                continue
+            score, seconds, fitted, cached = result
+            entry.update(mse=float(score), seconds=seconds, status="finished", cached=cached)
+            if isinstance(fitted, SuccessiveHalvingSearch):
+                entry.update(evaluations=len(fitted.trace_), bestParams=fitted.best_params_)
+                self.searchTraces[entry["model"]] = fitted.trace_
+            if bestScore is None or bestScore > score:
+                bestScore, self.bestModel = score, fitted
+        print("Candidatos:", self.candidateReport)
+
+        if bestScore is None:
+            raise TimeoutError(f"No candidate model finished within the time budget of {self.timeBudget}s")
+
+        if sampleSize is not None:
+            self.screenReport = self.__screen_agreement(sampleSize)
+            print("Triagem na amostra:", self.screenReport)
 
         if self.isRating:
             predict = self.predict(self.bestModel)
@@ -104,42 +260,188 @@ class MachineLearningModelTask(GenericModelTask):
         else:
             return self.bestModel
 
+    def __screen_size(self) -> int | None:
+        """
+            Número de linhas da amostra da triagem (None quando a triagem não se aplica)
+        """
+        if self.screenSize is None:
+            return None
+        size = int(self.screenSize * len(self.X_train)) if self.screenSize < 1 else int(self.screenSize)
+        return size if size < len(self.X_train) else None
+
+    def __stratified_sample(self, size: int) -> np.ndarray:
+        """
+            Linhas de X_train estratificadas pelos decis do target, para a amostra manter a proporção de clientes
+            sem compras (ou sem gasto) no holdout, que costumam ser a maioria das janelas do RFM
+        """
+        strata = pd.qcut(self.Y_train, 10, labels=False, duplicates="drop")
+        rows, _ = train_test_split(np.arange(len(self.X_train)), train_size=size, stratify=strata, random_state=42)
+        return np.sort(rows)
+
+    def __screen_agreement(self, sampleSize: int) -> dict:
+        """
+            Concordância entre a ordem dos finalistas na amostra e com todos os dados, para calibrar o screenSize
+        """
+        finished = [entry for entry in self.candidateReport if entry["status"] == "finished"]
+        sampleMse = [entry["sampleMse"] for entry in finished]
+        fullMse = [entry["mse"] for entry in finished]
+        return {
+            "sampleSize": sampleSize,
+            "finalists": [entry["model"] for entry in finished],
+            # Correlação de Spearman entre os MSEs da amostra e de todos os dados (indefinida com menos de 2
+            # finalistas ou com MSEs todos iguais)
+            "spearman": float(spearmanr(sampleMse, fullMse).statistic)
+            if len(set(sampleMse)) > 1 and len(set(fullMse)) > 1 else None,
+            "sameWinner": bool(np.argmin(sampleMse) == np.argmin(fullMse)),
+        }
+
+    def __train_candidates(self, models: list, X_train: np.ndarray, Y_train: np.ndarray, deadline: float | None) -> list:
+        """
+            MSE no teste, tempo de treino, modelo treinado e se veio do candidateCache, de cada candidato (None para os
+            cancelados pelo timeBudget). Só os candidatos que não estão no cache são treinados
+        """
+        if self.candidateCache is None:
+            return [None if result is None else (*result, False)
+                    for result in self.__fit_candidates(models, X_train, Y_train, deadline)]
+
+        for model in models:
+            if isinstance(model, SuccessiveHalvingSearch):
+                # A chave usa o tuningBudget configurado, e não o limite de tempo de uma seleção anterior
+                model.maxSeconds = self.tuningBudget
+        dataKey = CandidateCache.data_key(X_train, Y_train, self.X_test, self.Y_test)
+        keys = [self.candidateCache.key(dataKey, model) for model in models]
+        results = []
+        for key in keys:
+            entry = self.candidateCache.load(key)
+            results.append(None if entry is None else (entry["mse"], entry["seconds"], entry["model"], True))
+
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            for i, result in zip(missing, self.__fit_candidates([models[i] for i in missing], X_train, Y_train, deadline)):
+                if result is None:
+                    continue
+                score, seconds, fitted = result
+                results[i] = (score, seconds, fitted, False)
+                if isinstance(fitted, SuccessiveHalvingSearch) and not fitted.completed_:
+                    # Busca cortada pelo tempo: a chave é a da busca completa, então o resultado não é reaproveitado
+                    continue
+                self.candidateCache.save(keys[i], {"model": fitted, "scaler": self.scaler, "mse": float(score),
+                                                   "seconds": seconds})
+        return results
+
+    def __fit_candidates(self, models: list, X_train: np.ndarray, Y_train: np.ndarray, deadline: float | None) -> list:
+        """
+            MSE no teste, tempo de treino e modelo treinado de cada candidato (None para os cancelados pelo timeBudget)
+        """
+        nJobs = min(len(models), self.nJobs or os.cpu_count() or 1)
+        self.__budget_searches(models, max(nJobs, 1), deadline)
+        if nJobs <= 1 and deadline is None:
+            results = []
+            for model in models:
+                start = time.perf_counter()
+                model.fit(X_train, Y_train)
+                seconds = time.perf_counter() - start
+                results.append((self.rating(self.predict(model)), seconds, model))
+            return results
+        return self.__parallel_candidates(models, X_train, Y_train, max(nJobs, 1), deadline)
+
+    def __budget_searches(self, models: list, nJobs: int, deadline: float | None) -> None:
+        """
+            Limita as buscas do modo "halving" ao tempo que resta do timeBudget: os candidatos dividem os nJobs
+            processos, e cada busca usa TUNING_SHARE da fatia do seu candidato. Assim a busca termina com o melhor da
+            última rodada avaliada em vez de ser cancelada junto com o candidato. Chamado depois das chaves do
+            candidateCache, que usam o tuningBudget configurado
+        """
+        searches = [model for model in models if isinstance(model, SuccessiveHalvingSearch)]
+        if not searches:
+            return
+        maxSeconds = self.tuningBudget
+        if deadline is not None:
+            share = max(deadline - time.monotonic(), 0) / math.ceil(len(models) / nJobs) * TUNING_SHARE
+            maxSeconds = share if maxSeconds is None else min(maxSeconds, share)
+        for search in searches:
+            search.maxSeconds = maxSeconds
+
+    def __parallel_candidates(self, models: list, X_train: np.ndarray, Y_train: np.ndarray, nJobs: int,
+                              deadline: float | None) -> list:
+        """
+            Treina os candidatos ao mesmo tempo, um por processo. X_train e X_test são gravados uma única vez em
+            arquivos .npy que os processos abrem com memory map, em vez de enviar os dados junto com cada candidato.
+            Usa multiprocessing.Pool (e não ProcessPoolExecutor) porque, ao fim do timeBudget, os processos dos
+            candidatos que ainda estão treinando precisam ser encerrados. Os processos são criados com spawn: um fork
+            do servidor Flask copiaria as threads e os locks dele (e os pools de threads do xgboost e do lightgbm)
+            em um estado inconsistente. Retorna None para os candidatos cancelados
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            data = {"X_train": X_train, "Y_train": Y_train, "X_test": self.X_test, "Y_test": self.Y_test}
+            for name, values in data.items():
+                np.save(Path(directory) / f"{name}.npy", np.ascontiguousarray(values, dtype=np.float64))
+
+            pool = multiprocessing.get_context("spawn").Pool(nJobs, initializer=_init_candidate_worker,
+                                                             initargs=(directory,))
+            try:
+                pending = [pool.apply_async(_fit_candidate, (model,)) for model in models]
+                results = []
+                for future in pending:
+                    future.wait(None if deadline is None else max(deadline - time.monotonic(), 0))
+                    results.append(future.get() if future.ready() else None)
+            finally:
+                # Encerra os processos, inclusive os que ainda estão treinando candidatos fora do prazo
+                pool.terminate()
+                pool.join()
+        return results
+
+    @staticmethod
+    def __model_name(model) -> str:
+        return type(model.estimator if isinstance(model, (GridSearchCV, SuccessiveHalvingSearch)) else model).__name__
+
+    def search(self, estimator, grid: dict):
+        """
+            Busca de hiperparâmetros de um candidato, de acordo com o searchMode
+        """
+        if self.searchMode == "grid":
+            return GridSearchCV(estimator=estimator, param_grid=grid, n_jobs=-1, scoring="neg_mean_squared_error")
+        if self.searchMode == "halving":
+            return SuccessiveHalvingSearch(estimator, grid, nCandidates=self.nCandidates, maxSeconds=self.tuningBudget)
+        raise ValueError(f"Unknown searchMode '{self.searchMode}', use 'halving' or 'grid'")
+
     def createModels(self):
         if self.isTunning == False:
             lasso = LassoCV()
             Enet = ElasticNet()
-            rf = RandomForestRegressor()
-            GBoost = GradientBoostingRegressor()
-            HGBoost = HistGradientBoostingRegressor()
+            # Sementes fixas para o MSE (e a escolha do melhor modelo) não mudar entre execuções
+            rf = RandomForestRegressor(random_state=42)
+            GBoost = GradientBoostingRegressor(random_state=42)
+            HGBoost = HistGradientBoostingRegressor(random_state=42)
             model_xgb = xgb.XGBRegressor()
             model_lgb = lgb.LGBMRegressor(objective='regression', verbose=-1)
 
         else:
-            grid = {'n_alphas' : [100,200,500,100],'max_iter' : [1000,1500,2000], 'random_state' : [42]}
-            lasso = GridSearchCV(estimator=LassoCV(max_iter=5000), param_grid=grid, n_jobs=-1, scoring="neg_mean_squared_error")
+            grid = {'alphas' : [100,200,500,100],'max_iter' : [1000,1500,2000], 'random_state' : [42]}
+            lasso = self.search(LassoCV(max_iter=5000), grid)
 
             #Enet = ElasticNet()
             grid = {"max_iter": [1000,1500,2000],"alpha": [0.0001, 0.001, 0.01, 0.1, 1, 10, 100],"l1_ratio": np.arange(0.0, 1.0, 0.1), 'random_state' : [42]}
-            Enet = GridSearchCV(estimator=ElasticNet(max_iter=5000), param_grid=grid, n_jobs=-1, scoring="neg_mean_squared_error")
+            Enet = self.search(ElasticNet(max_iter=5000), grid)
 
             #rf = RandomForestRegressor()
             grid = {'bootstrap': [True, False],'min_samples_leaf': [1, 2, 4], 'min_samples_split': [2, 5, 10], 'n_estimators': [200, 800, 1000],'random_state' : [42]}    
-            rf = GridSearchCV(estimator=RandomForestRegressor(), param_grid=grid, n_jobs=-1, scoring="neg_mean_squared_error")
+            rf = self.search(RandomForestRegressor(), grid)
             
             #GBoost = GradientBoostingRegressor()
             grid = {'n_estimators':[500,1000,2000],'learning_rate':[.001,0.01,.1],'max_depth':[1,2,4],'subsample':[.5,.75,1],'random_state':[42]}
-            GBoost = GridSearchCV(estimator=GradientBoostingRegressor(), param_grid=grid, n_jobs=-1, scoring="neg_mean_squared_error")
+            GBoost = self.search(GradientBoostingRegressor(), grid)
             
             #HGBoost = HistGradientBoostingRegressor()
             grid = {'learning_rate':[.001,0.01,.1],'max_depth':[1,2,4,None],'max_leaf_nodes' : [31,None],'random_state':[42]}
-            HGBoost = GridSearchCV(estimator=HistGradientBoostingRegressor(), param_grid=grid, n_jobs=-1, scoring="neg_mean_squared_error")
+            HGBoost = self.search(HistGradientBoostingRegressor(), grid)
 
             #model_xgb = xgb.XGBRegressor()
             grid = { 'max_depth': [3,6,10],'learning_rate': [0.01, 0.05, 0.1],'n_estimators': [100, 500, 1000],'colsample_bytree': [0.3, 0.7],'random_state':[42]}
-            model_xgb = GridSearchCV(estimator=xgb.XGBRegressor(), param_grid=grid, n_jobs=-1, scoring="neg_mean_squared_error")
+            model_xgb = self.search(xgb.XGBRegressor(), grid)
            
             #model_lgb = lgb.LGBMRegressor(objective='regression')
-            model_lgb =GridSearchCV(estimator=lgb.LGBMRegressor(), param_grid=grid, n_jobs=-1, scoring="neg_mean_squared_error")
+            model_lgb =self.search(lgb.LGBMRegressor(verbose=-1), grid)
         
         models = [lasso, Enet, rf, GBoost, HGBoost, model_xgb, model_lgb]
         return models
@@ -0,0 +1,162 @@
+"""
+    Busca do penalizer dos modelos do lifetimes (BG/NBD, Pareto e Gamma-Gamma) pelo erro no holdout das janelas de
+    treino do RFM (colunas _cal e _holdout).
+
+    Os valores do penalizer são ordenados e divididos em trechos contíguos, um por processo. Dentro de um trecho cada
+    ajuste parte dos parâmetros do ajuste do valor vizinho (warm start por um MemoryParamsStore), que costumam estar
+    perto do novo ótimo.
+"""
+from src.workflows.task import Task
+from src.workflows.workers import detached, process_pool, worker_state
+from src.DataBase.ModelParams import MemoryParamsStore
+from src.TrasactionModels.TransactionModel import TransactionModelTask, compress
+from lifetimes.utils import ConvergenceError
+from pathlib import Path
+from sklearn.metrics import mean_squared_error
+import json
+import os
+import numpy as np
+import pandas as pd
+
+
+def holdout_mse(model: Task, df: pd.DataFrame) -> float:
+    """
+        MSE no holdout de um modelo ajustado nas colunas _cal: número de transações até duration_holdout (BG/NBD e
+        Pareto) ou valor médio das transações (Gamma-Gamma, só clientes com compras repetidas nos dois períodos)
+    """
+    if isinstance(model, TransactionModelTask):
+        frequency, recency, T = (df[column].to_numpy(dtype=np.float64) for column in model.columns(True))
+        duration = df["duration_holdout"].to_numpy(dtype=np.float64)
+        expected = np.empty(len(df))
+        # Cada janela tem um único duration_holdout, então há poucos horizontes distintos
+        for horizon in np.unique(duration):
+            rows = duration == horizon
+            columns, _, inverse = compress(frequency[rows], recency[rows], T[rows])
+            expected[rows] = model.expected_purchases(np.array([horizon]), *columns)[:, 0][inverse]
+        # Sem penalização o ajuste pode ir para parâmetros degenerados (Ex: r e alpha enormes), em que a predição
+        # não é finita
+        if not np.isfinite(expected).all():
+            return float("nan")
+        return float(mean_squared_error(df["frequency_holdout"], expected))
+
+    rows = df[(df["frequency_cal"] > 0) & (df["monetary_value_cal"] > 0) & (df["frequency_holdout"] > 0)]
+    expected = model.model.conditional_expected_average_profit(rows["frequency_cal"], rows["monetary_value_cal"])
+    return float(mean_squared_error(rows["monetary_value_holdout"], expected))
+
+
+def sweep(model: Task, df: pd.DataFrame, penalizers: list[float]) -> list[dict]:
+    """
+        Ajusta o modelo com cada penalizer, na ordem, partindo sempre do último ajuste válido (que convergiu e tem
+        uma predição finita)
+    """
+    model.paramsStore = MemoryParamsStore()
+    results = []
+    for penalizer in penalizers:
+        model.penalizer = float(penalizer)
+        model.model = model.createModel()
+        try:
+            if isinstance(model, TransactionModelTask):
+                model.fit(df)
+            else:
+                model.fit(df[(df["frequency_cal"] > 0) & (df["monetary_value_cal"] > 0)], "monetary_value_cal",
+                          "frequency_cal")
+        except ConvergenceError:
+            results.append({"penalizer": float(penalizer), "mse": None, "warmStart": None, "seconds": None,
+                            "evaluations": None})
+            continue
+        report = model.fitReport
+        mse = holdout_mse(model, df)
+        if not np.isfinite(mse):
+            # Um ajuste degenerado não serve de ponto inicial para o próximo valor
+            model.paramsStore = MemoryParamsStore()
+            mse = None
+        results.append({"penalizer": float(penalizer), "mse": mse, "warmStart": report["warmStart"],
+                        "seconds": report["seconds"], "evaluations": report["evaluations"]})
+    return results
+
+
+def save_penalizer(overridesFile: str | Path, modelType: str, modelId: str, penalizer: float) -> None:
+    """
+        Grava o penalizer no arquivo das props ajustadas em execução ({modelType: {modelId: {prop: valor}}}), que o
+        load_model junta às props do Models.json. O Models.json versionado não é alterado
+    """
+    overridesFile = Path(overridesFile)
+    overrides = {}
+    if overridesFile.exists():
+        with open(overridesFile, "r") as file:
+            overrides = json.load(file)
+    overrides.setdefault(modelType, {}).setdefault(modelId, {})["penalizer"] = penalizer
+
+    # Escreve em um arquivo temporário e renomeia, para nunca deixar o arquivo pela metade
+    overridesFile.parent.mkdir(parents=True, exist_ok=True)
+    tmp = overridesFile.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp, "w") as file:
+        json.dump(overrides, file, indent=2, ensure_ascii=False)
+    os.replace(tmp, overridesFile)
+
+
+def _sweep_segment(penalizers: list[float]) -> list[dict]:
+    # O estado do processo é o modelo e as janelas de treino da busca
+    return sweep(*worker_state(), penalizers)
+
+
+class PenalizerSweepTask(Task):
+    def __init__(
+        self,
+        name: str,
+        model: Task,
+        penalizers: list[float] = (0.0, 0.001, 0.01, 0.1, 1.0),
+        nJobs: int = None,
+        overridesFile: str = None,
+        modelType: str = None,
+        modelId: str = None,
+    ) -> None:
+        """
+        Args:
+            name, # Nome da tarefa
+            model, # Tarefa do modelo (BGFModelTask, ParetoModelTask ou GammaGammaModelTask), recebe o melhor penalizer
+            penalizers = (0.0, 0.001, 0.01, 0.1, 1.0) # Valores testados
+            nJobs = None # Número de processos (None usa todos os núcleos), cada um com um trecho contíguo dos valores
+            overridesFile, modelType, modelId # Arquivo das props ajustadas em execução, grupo ("frequencyModels" ou
+                                              # "monetaryModels") e id do modelo onde o melhor penalizer é gravado
+                                              # (None não grava)
+        """
+        super().__init__(name)
+        self.model = model
+        self.penalizers = sorted(set(float(penalizer) for penalizer in penalizers))
+        self.nJobs = nJobs
+        self.overridesFile = overridesFile
+        self.modelType = modelType
+        self.modelId = modelId
+        self.bestPenalizer = None
+
+    def on_run(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+            Recebe as janelas de treino do RFM e retorna o resultado de cada penalizer
+        """
+        assert "frequency_holdout" in df.columns, "PenalizerSweepTask requires the training RFM (isTraining=True)"
+        assert hasattr(self.model, "penalizer"), "PenalizerSweepTask requires a BG/NBD, Pareto or Gamma-Gamma model"
+        model = detached(self.model)
+
+        nJobs = min(len(self.penalizers), self.nJobs or os.cpu_count() or 1)
+        segments = [list(segment) for segment in np.array_split(self.penalizers, nJobs)]
+        if nJobs == 1:
+            results = sweep(model, df, self.penalizers)
+        else:
+            with process_pool(nJobs, (model, df)) as executor:
+                # map devolve os trechos na ordem dos valores, então o resultado é determinístico
+                results = [result for segment in executor.map(_sweep_segment, segments) for result in segment]
+
+        results = pd.DataFrame(results)
+        converged = results.dropna(subset=["mse"])
+        if converged.empty:
+            raise ConvergenceError("The model did not converge for any penalizer")
+        # Em um empate fica o menor penalizer
+        self.bestPenalizer = float(converged.loc[converged["mse"].idxmin(), "penalizer"])
+        # A tarefa do modelo passa a usar o melhor valor
+        self.model.penalizer = self.bestPenalizer
+        print(f"Penalizer de {type(self.model).__name__}:\n{results}\nMelhor penalizer: {self.bestPenalizer}")
+
+        if self.overridesFile is not None:
+            save_penalizer(self.overridesFile, self.modelType, self.modelId, self.bestPenalizer)
+        return results
@@ -0,0 +1,159 @@
+"""
+    Busca de hiperparâmetros por successive halving, usada no lugar do GridSearchCV exaustivo.
+
+    Todos os candidatos (a grade inteira ou uma amostra aleatória de nCandidates) começam treinando em uma pequena
+    parte das linhas; a cada rodada só o melhor 1/factor dos candidatos continua e o número de linhas é multiplicado
+    por factor, até a última rodada usar todas as linhas de treino. Os modelos boosted param de adicionar árvores
+    quando o MSE da validação para de melhorar (early stopping), então n_estimators vira um limite e não um custo fixo.
+"""
+from sklearn.base import clone
+from sklearn.ensemble import GradientBoostingRegressor, HistGradientBoostingRegressor
+from sklearn.metrics import mean_squared_error
+from sklearn.model_selection import ParameterGrid, train_test_split
+import math
+import time
+import numpy as np
+import lightgbm as lgb
+import xgboost as xgb
+
+
+class SuccessiveHalvingSearch:
+    """
+        Mesma interface do GridSearchCV usada pelo MachineLearningModelTask (estimator, fit, predict, best_estimator_
+        e best_params_), com um histórico de cada avaliação em trace_ e completed_ = False quando o maxSeconds
+        interrompeu a busca antes da última rodada
+    """
+
+    def __init__(
+        self,
+        estimator,
+        param_grid: dict,
+        nCandidates: int = None,
+        factor: int = 3,
+        minSamples: int = 200,
+        maxSeconds: float = None,
+        earlyStopping: int = 20,
+        validationSize: float = 0.2,
+        random_state: int = 42,
+    ) -> None:
+        """
+        Args:
+            estimator, # Modelo base, cada candidato é um clone com os parâmetros da grade
+            param_grid, # Grade de parâmetros (mesmo formato do GridSearchCV)
+            nCandidates = None # Número de combinações sorteadas da grade (None usa a grade inteira)
+            factor = 3 # A cada rodada fica 1/factor dos candidatos e as linhas são multiplicadas por factor
+            minSamples = 200 # Mínimo de linhas da primeira rodada
+            maxSeconds = None # Tempo máximo da busca, depois dele o melhor da última rodada avaliada é usado (sem contar
+                              # o treino final do melhor candidato)
+            earlyStopping = 20 # Rodadas sem melhora na validação para os modelos boosted pararem
+            validationSize = 0.2 # Fração das linhas separada para o MSE de cada candidato
+            random_state = 42 # Semente do sorteio dos candidatos, das linhas e da validação
+        """
+        self.estimator = estimator
+        self.param_grid = param_grid
+        self.nCandidates = nCandidates
+        self.factor = factor
+        self.minSamples = minSamples
+        self.maxSeconds = maxSeconds
+        self.earlyStopping = earlyStopping
+        self.validationSize = validationSize
+        self.random_state = random_state
+
+        self.best_estimator_ = None
+        self.best_params_ = None
+        self.best_score_ = None
+        self.trace_ = None
+        self.seconds_ = None
+        self.completed_ = None
+
+    def fit(self, X: np.ndarray, y: np.ndarray):
+        start = time.perf_counter()
+        rng = np.random.default_rng(self.random_state)
+        candidates = list(ParameterGrid(self.param_grid))
+        if self.nCandidates is not None and self.nCandidates < len(candidates):
+            candidates = [candidates[i] for i in np.sort(rng.choice(len(candidates), self.nCandidates, replace=False))]
+
+        X_fit, X_val, y_fit, y_val = train_test_split(X, y, test_size=self.validationSize,
+                                                      random_state=self.random_state)
+        # As linhas de cada rodada são um prefixo da mesma permutação, então cada rodada contém a anterior
+        order = rng.permutation(len(X_fit))
+        nRounds = max(1, math.ceil(math.log(len(candidates), self.factor)) + 1) if len(candidates) > 1 else 1
+
+        self.trace_ = []
+        self.completed_ = True
+        survivors = list(range(len(candidates)))
+        scores = {}
+        for iteration in range(nRounds):
+            samples = min(len(X_fit), max(self.minSamples, len(X_fit) // self.factor ** (nRounds - 1 - iteration)))
+            rows = order[:samples]
+            roundScores = {}
+            for index in survivors:
+                # Pelo menos um candidato é sempre avaliado
+                if self.maxSeconds is not None and self.trace_ and time.perf_counter() - start > self.maxSeconds:
+                    break
+                fitStart = time.perf_counter()
+                model = self.__fit(clone(self.estimator).set_params(**candidates[index]),
+                                   X_fit[rows], y_fit[rows], X_val, y_val)
+                roundScores[index] = (mean_squared_error(y_val, model.predict(X_val)), model)
+                self.trace_.append({
+                    "iteration": iteration, "samples": int(samples), "params": candidates[index],
+                    "mse": float(roundScores[index][0]), "iterations": _fitted_iterations(model),
+                    "seconds": time.perf_counter() - fitStart,
+                })
+            if not roundScores:
+                self.completed_ = False
+                break
+            scores = roundScores
+            if len(roundScores) < len(survivors):
+                # Sem tempo para avaliar todos os candidatos da rodada: usa os que foram avaliados
+                self.completed_ = False
+                break
+            keep = max(1, math.ceil(len(survivors) / self.factor))
+            survivors = sorted(roundScores, key=lambda index: (roundScores[index][0], index))[:keep]
+
+        best = min(scores, key=lambda index: (scores[index][0], index))
+        self.best_params_ = candidates[best]
+        self.best_score_ = -scores[best][0]
+
+        # Treina o melhor candidato com todas as linhas, com o número de árvores encontrado pelo early stopping
+        final = clone(self.estimator).set_params(**self.best_params_)
+        iterations = _fitted_iterations(scores[best][1])
+        if isinstance(final, (xgb.XGBRegressor, lgb.LGBMRegressor)) and iterations is not None:
+            final.set_params(n_estimators=iterations)
+        self.best_estimator_ = self.__fit(final, X, y, None, None)
+        self.seconds_ = time.perf_counter() - start
+        return self
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        return self.best_estimator_.predict(X)
+
+    def __fit(self, model, X: np.ndarray, y: np.ndarray, X_val: np.ndarray | None, y_val: np.ndarray | None):
+        """
+            Treina um candidato com early stopping nos modelos boosted (sem validação, no treino final do XGBoost e
+            do LightGBM, o número de árvores já vem da busca)
+        """
+        if isinstance(model, GradientBoostingRegressor):
+            model.set_params(n_iter_no_change=self.earlyStopping)
+        elif isinstance(model, HistGradientBoostingRegressor):
+            model.set_params(early_stopping=True, n_iter_no_change=self.earlyStopping)
+        elif isinstance(model, xgb.XGBRegressor) and X_val is not None:
+            model.set_params(early_stopping_rounds=self.earlyStopping)
+            return model.fit(X, y, eval_set=[(X_val, y_val)], verbose=False)
+        elif isinstance(model, lgb.LGBMRegressor) and X_val is not None:
+            return model.fit(X, y, eval_set=[(X_val, y_val)],
+                             callbacks=[lgb.early_stopping(self.earlyStopping, verbose=False)])
+        return model.fit(X, y)
+
+
+def _fitted_iterations(model) -> int | None:
+    """
+        Número de árvores usadas por um modelo boosted depois do early stopping
+    """
+    if isinstance(model, xgb.XGBRegressor):
+        best = getattr(model, "best_iteration", None)
+        return None if best is None else best + 1
+    if isinstance(model, lgb.LGBMRegressor):
+        return model.best_iteration_ or None
+    if isinstance(model, (GradientBoostingRegressor, HistGradientBoostingRegressor)):
+        return int(model.n_iter_) if hasattr(model, "n_iter_") else int(model.n_estimators_)
+    return None
@@ -0,0 +1,224 @@
+"""
+    Intervalos de confiança do LTV de cada cliente por bootstrap.
+
+    Cada réplica reamostra os clientes com reposição, reajusta o modelo de transações (BG/NBD ou Pareto) e o
+    Gamma-Gamma e recalcula o LTV de todos os clientes. Reamostrar n clientes com reposição é o mesmo que sortear uma
+    multinomial sobre as linhas distintas, então o modelo de transações é reajustado sobre os trios
+    (frequency, recency, T) distintos com os pesos sorteados, sem montar a base reamostrada.
+
+    As réplicas rodam em processos, cada uma com a sua semente (SeedSequence.spawn), e o LTV de cada réplica é
+    consumido na ordem das réplicas por estimadores P² dos quantis (Jain e Chlamtac, 1985), que guardam 5 marcadores
+    por cliente e por quantil em vez de todas as réplicas.
+"""
+from src.workflows.task import Task
+from src.workflows.workers import detached, process_pool, worker_state
+from src.TrasactionModels.TransactionModel import compress
+import copy
+import os
+import numpy as np
+import pandas as pd
+
+
+class P2Quantiles:
+    """
+        Estimativa de quantis de cada posição de um vetor a partir de uma sequência de vetores (um por réplica), com
+        memória fixa: 5 marcadores por posição e por quantil (algoritmo P²)
+    """
+
+    def __init__(self, quantiles: list[float], size: int) -> None:
+        self.quantiles = np.asarray(quantiles, dtype=np.float64)
+        self.size = size
+        self.count = 0
+        self.buffer = np.empty((5, size))
+        self.heights = None
+        self.positions = None
+        # Incremento da posição desejada de cada marcador a cada observação
+        self.increments = np.stack([np.zeros_like(self.quantiles), self.quantiles / 2, self.quantiles,
+                                    (1 + self.quantiles) / 2, np.ones_like(self.quantiles)], axis=1)
+
+    def update(self, values: np.ndarray) -> None:
+        values = np.asarray(values, dtype=np.float64)
+        if self.count < 5:
+            self.buffer[self.count] = values
+            self.count += 1
+            if self.count == 5:
+                self.heights = np.broadcast_to(np.sort(self.buffer, axis=0).T, (len(self.quantiles), self.size, 5)).copy()
+                self.positions = np.broadcast_to(np.arange(1, 6, dtype=np.float64),
+                                                 (len(self.quantiles), self.size, 5)).copy()
+                self.buffer = None
+            return
+
+        q, n = self.heights, self.positions
+        x = np.broadcast_to(values, q.shape[:2])
+        # Célula da observação e atualização dos extremos
+        cell = (x >= q[..., 1]).astype(np.int8) + (x >= q[..., 2]) + (x >= q[..., 3])
+        np.minimum(q[..., 0], x, out=q[..., 0])
+        np.maximum(q[..., 4], x, out=q[..., 4])
+        n += np.arange(5) > cell[..., None]
+
+        self.count += 1
+        desired = 1 + (self.count - 1) * self.increments[:, None, :]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for i in (1, 2, 3):
+                d = desired[..., i] - n[..., i]
+                up = (d >= 1) & (n[..., i + 1] - n[..., i] > 1)
+                down = (d <= -1) & (n[..., i - 1] - n[..., i] < -1)
+                move = up | down
+                if not move.any():
+                    continue
+                step = np.where(up, 1.0, -1.0)
+
+                # Interpolação parabólica, ou linear quando a parábola sai do intervalo dos vizinhos
+                parabolic = q[..., i] + step / (n[..., i + 1] - n[..., i - 1]) * (
+                    (n[..., i] - n[..., i - 1] + step) * (q[..., i + 1] - q[..., i]) / (n[..., i + 1] - n[..., i])
+                    + (n[..., i + 1] - n[..., i] - step) * (q[..., i] - q[..., i - 1]) / (n[..., i] - n[..., i - 1])
+                )
+                neighbour = np.where(up, i + 1, i - 1)[..., None]
+                qNeighbour = np.take_along_axis(q, neighbour, axis=-1)[..., 0]
+                nNeighbour = np.take_along_axis(n, neighbour, axis=-1)[..., 0]
+                linear = q[..., i] + step * (qNeighbour - q[..., i]) / (nNeighbour - n[..., i])
+                inside = (q[..., i - 1] < parabolic) & (parabolic < q[..., i + 1])
+
+                q[..., i] = np.where(move, np.where(inside, parabolic, linear), q[..., i])
+                n[..., i] += np.where(move, step, 0.0)
+
+    def result(self) -> np.ndarray:
+        """
+            Matriz posições x quantis
+        """
+        assert self.count > 0, "No values were added"
+        if self.count < 5:
+            return np.quantile(self.buffer[:self.count], self.quantiles, axis=0).T
+        return self.heights[..., 2].T.copy()
+
+
+class BootstrapSample:
+    """
+        Dados e modelos de uma réplica do bootstrap. Não é uma Task para poder ser enviado aos processos
+    """
+
+    def __init__(self, transactionModel: Task, monetaryModel: Task, ltv: Task, df: pd.DataFrame) -> None:
+        training = transactionModel.data_training
+        assert training is not None, "Bootstrap requires the training RFM (it does not run in score-only mode)"
+        assert hasattr(transactionModel, "expected_purchases"), "Bootstrap requires a BG/NBD or Pareto transaction model"
+        assert hasattr(monetaryModel, "createModel") and hasattr(monetaryModel.model, "conditional_expected_average_profit"), \
+            "Bootstrap requires a Gamma-Gamma monetary model"
+
+        self.transactionModel = detached(transactionModel)
+        self.monetaryModel = monetaryModel.createModel()
+
+        # Trios distintos do treino e quantos clientes cada um representa
+        frequency, recency, T = (training[column].to_numpy(dtype=np.float64) for column in transactionModel.columns(True))
+        self.training, self.counts, _ = compress(frequency, recency, T)
+        self.transactionInitial = transactionModel.initial_params(transactionModel.model.params_, T)
+
+        # Clientes do LTV: o modelo de transações prevê por trio distinto e o Gamma-Gamma é ajustado nesses clientes
+        frequency, recency, T = (df[column].to_numpy(dtype=np.float64) for column in transactionModel.columns(False))
+        self.predict, _, self.inverse = compress(frequency, recency, T)
+        self.frequency = frequency
+        self.monetary = df["monetary_value"].to_numpy(dtype=np.float64)
+        self.monetaryInitial = np.log(monetaryModel.model.params_[["p", "q", "v"]].to_numpy(dtype=np.float64))
+
+        # Mesmo LTV do LTVTask: fluxo de caixa descontado ou as compras até numPeriods descontadas pelo prazo total
+        factor = {"W": 4.345, "M": 1.0, "D": 30, "H": 30 * 24}[ltv.frequency]
+        self.isDiscountedCashFlow = ltv.isDiscountedCashFlow
+        self.discountFactors = (1 + ltv.discountRate) ** -(np.arange(1, ltv.numPeriods + 1) / factor)
+        self.discount = (1 + ltv.discountRate) ** (ltv.numPeriods / factor)
+        self.numPeriods = transactionModel.numPeriods
+
+    def replicate(self, seed: np.random.SeedSequence) -> np.ndarray:
+        """
+            LTV de cada cliente com os modelos ajustados em uma reamostragem dos clientes
+        """
+        rng = np.random.default_rng(seed)
+        transactionModel = self.transactionModel
+
+        # Reamostragem dos clientes do treino, como pesos sobre os trios distintos
+        weights = rng.multinomial(self.counts.sum(), self.counts / self.counts.sum())
+        rows = weights > 0
+        transactionModel.model = transactionModel.createModel()
+        transactionModel.model.penalizer_coef = transactionModel.penalizer_for(weights[rows])
+        transactionModel.model.fit(*(column[rows] for column in self.training), weights=weights[rows],
+                                   initial_params=self.transactionInitial)
+
+        if self.isDiscountedCashFlow:
+            curve = transactionModel.expected_purchases(np.arange(1, len(self.discountFactors) + 1, dtype=np.float64),
+                                                        *self.predict)
+            purchases = (np.diff(curve, axis=1, prepend=0) @ self.discountFactors)[self.inverse]
+        else:
+            purchases = transactionModel.expected_purchases(np.array([self.numPeriods], dtype=np.float64),
+                                                            *self.predict)[:, 0][self.inverse] / self.discount
+
+        # Reamostragem dos clientes do Gamma-Gamma
+        weights = rng.multinomial(len(self.monetary), np.full(len(self.monetary), 1 / len(self.monetary)))
+        rows = weights > 0
+        monetaryModel = copy.copy(self.monetaryModel)
+        monetaryModel.fit(self.frequency[rows], self.monetary[rows], weights=weights[rows],
+                          initial_params=self.monetaryInitial)
+        expectedMonetary = monetaryModel.conditional_expected_average_profit(self.frequency, self.monetary)
+
+        ltv = np.asarray(expectedMonetary, dtype=np.float64) * purchases
+        return np.maximum(ltv, 0, out=ltv)
+
+
+def _bootstrap_replicate(seed: np.random.SeedSequence) -> np.ndarray:
+    # O estado do processo é a BootstrapSample
+    return worker_state().replicate(seed)
+
+
+class BootstrapLTVTask(Task):
+    def __init__(
+        self,
+        name: str,
+        transactionModel: Task,
+        monetaryModel: Task,
+        ltv: Task,
+        nReplicates: int = 200,
+        quantiles: list[float] = (0.05, 0.5, 0.95),
+        seed: int = 42,
+        nJobs: int = None,
+    ) -> None:
+        """
+        Args:
+            name, # Nome da tarefa
+            transactionModel, monetaryModel # Tarefas dos modelos (BG/NBD ou Pareto e Gamma-Gamma) já executadas
+            ltv, # Tarefa do LTV, de onde vêm a taxa de desconto, o prazo e o modo de cálculo
+            nReplicates = 200 # Número de réplicas do bootstrap
+            quantiles = (0.05, 0.5, 0.95) # Quantis do LTV de cada cliente, geram as colunas LTV_p5, LTV_p50, LTV_p95
+            seed = 42 # Semente das réplicas (o resultado não depende do número de processos)
+            nJobs = None # Número de processos (None usa todos os núcleos)
+        """
+        super().__init__(name)
+        self.transactionModel = transactionModel
+        self.monetaryModel = monetaryModel
+        self.ltv = ltv
+        self.nReplicates = nReplicates
+        self.quantiles = list(quantiles)
+        self.seed = seed
+        self.nJobs = nJobs
+
+    def on_run(self, df: pd.DataFrame) -> pd.DataFrame:
+        sample = BootstrapSample(self.transactionModel, self.monetaryModel, self.ltv, df)
+        seeds = np.random.SeedSequence(self.seed).spawn(self.nReplicates)
+        accumulator = P2Quantiles(self.quantiles, len(df))
+
+        nJobs = min(self.nReplicates, self.nJobs or os.cpu_count() or 1)
+        if nJobs == 1:
+            for seed in seeds:
+                accumulator.update(sample.replicate(seed))
+        else:
+            with process_pool(nJobs, sample) as executor:
+                # No máximo 2 réplicas por processo em andamento, consumidas na ordem das sementes: a memória não
+                # cresce com nReplicates e o resultado é o mesmo para qualquer número de processos
+                window = 2 * nJobs
+                futures = [executor.submit(_bootstrap_replicate, seed) for seed in seeds[:window]]
+                for i in range(self.nReplicates):
+                    accumulator.update(futures[i].result())
+                    futures[i] = None
+                    if i + window < self.nReplicates:
+                        futures.append(executor.submit(_bootstrap_replicate, seeds[i + window]))
+
+        for quantile, values in zip(self.quantiles, accumulator.result().T):
+            df[f"LTV_p{quantile * 100:g}"] = values
+        return df
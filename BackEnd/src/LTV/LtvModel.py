@@ -1,4 +1,5 @@
 from src.workflows.task import Task
+import numpy as np
 import pandas as pd
 from pathlib import Path
 
@@ -12,7 +13,11 @@ class LTVTask(Task):
         isTraining: bool = False,
         discountRate: float = 0.01,
         numPeriods: int = 180,
-        frequency: str = "W"
+        frequency: str = "W",
+        horizons: list[int] = None,
+        isDiscountedCashFlow: bool = False,
+        transactionModel: Task = None,
+        isFloat32: bool = False,
     ) -> None:
         super().__init__(name)
         """
@@ -22,7 +27,13 @@ class LTVTask(Task):
                 columnMonetary  # Nome da coluna onde encontra-se os valores previstos monetários
                 # Nome da coluna onde encontra-se os valores previstos de numeros de  transação
                 columnFrequency
-
+                horizons = None # Horizontes (em períodos) das colunas <columnFrequency>_<horizonte>, gera LTV_<horizonte>
+                                # descontando cada horizonte pelo seu próprio prazo
+                isDiscountedCashFlow = False # Fluxo de caixa descontado: soma as transações esperadas em cada um dos
+                                             # numPeriods períodos descontadas pelo seu próprio prazo, em vez de
+                                             # descontar todo o columnFrequency pelo prazo total
+                transactionModel = None # Tarefa do modelo de transações (BG/NBD ou Pareto), usada no isDiscountedCashFlow
+                isFloat32 = False # Colunas de LTV em float32 (metade da memória)
 
         """
         self.isTraining = isTraining
@@ -31,6 +42,10 @@ class LTVTask(Task):
         self.discountRate = discountRate
         self.numPeriods = numPeriods
         self.frequency = frequency
+        self.horizons = horizons
+        self.isDiscountedCashFlow = isDiscountedCashFlow
+        self.transactionModel = transactionModel
+        self.dtype = np.float32 if isFloat32 else np.float64
 
     def on_run(self, df: pd.DataFrame) -> pd.DataFrame:
         """
@@ -38,21 +53,55 @@ class LTVTask(Task):
         """
 
         factor = {"W": 4.345, "M": 1.0, "D": 30, "H": 30 * 24}[self.frequency]
-        
+        discount = (1 + self.discountRate) ** (self.numPeriods / factor)
+
         if self.isTraining:
-            self.columnMonetary = "monetary_value_cal"
-            self.columnFrequency = "frequency_cal"
-            df[f"LTV_cal"] = (df[self.columnMonetary] * df[self.columnFrequency]) / (1 + self.discountRate) ** (self.numPeriods / factor)
-
-            self.columnMonetary = "monetary_value_holdout"
-            self.columnFrequency = "frequency_holdout"
-            df[f"LTV_holdout"] = (df[self.columnMonetary] * df[self.columnFrequency]) / (1 + self.discountRate) ** (self.numPeriods / factor)
-            df[f"LTV_holdout"] = df[f"LTV_holdout"].apply(lambda x: max(x, 0))  # Ajusta valores negativos para 0
+            df[f"LTV_cal"] = self.__ltv(df["monetary_value_cal"], df["frequency_cal"], discount, clip=False)
+            df[f"LTV_holdout"] = self.__ltv(df["monetary_value_holdout"], df["frequency_holdout"], discount)
         else:
             assert self.columnMonetary in df.columns, f"Monetary column '{self.columnMonetary}' not found in DataFrame columns: {df.columns}"
-            assert self.columnFrequency in df.columns, f"Frequency column '{self.columnFrequency}' not found in DataFrame columns: {df.columns}"
-            # (Numero de transações *  Valor de Cada Transação) / Correção monetaria
-            df[f"LTV"] = (df[self.columnMonetary] * df[self.columnFrequency]) / (1 + self.discountRate) ** (self.numPeriods / factor)
-            df[f"LTV"] = df[f"LTV"].apply(lambda x: max(x, 0))  # Ajusta valores negativos para 0
+            if self.isDiscountedCashFlow:
+                df[f"LTV"] = self.__discounted_cash_flow(df, factor)
+            else:
+                assert self.columnFrequency in df.columns, f"Frequency column '{self.columnFrequency}' not found in DataFrame columns: {df.columns}"
+                # (Numero de transações *  Valor de Cada Transação) / Correção monetaria
+                df[f"LTV"] = self.__ltv(df[self.columnMonetary], df[self.columnFrequency], discount)
+
+            if self.horizons:
+                self.__add_horizons(df, factor)
     
         return df
+
+    def __ltv(self, monetary: pd.Series, frequency: pd.Series, discount: float, clip: bool = True) -> np.ndarray:
+        ltv = monetary.to_numpy(dtype=self.dtype) * frequency.to_numpy(dtype=self.dtype)
+        ltv /= self.dtype(discount)
+        if clip:
+            np.maximum(ltv, 0, out=ltv)  # Ajusta valores negativos para 0
+        return ltv
+
+    def __discounted_cash_flow(self, df: pd.DataFrame, factor: float) -> np.ndarray:
+        """
+            valor monetário * soma, em cada período t = 1..numPeriods, de (E[N(t)] - E[N(t - 1)]) / (1 + taxa) ** (t / factor)
+        """
+        assert hasattr(self.transactionModel, "discounted_purchases"), \
+            "isDiscountedCashFlow requires a transactionModel with discounted_purchases (BG/NBD or Pareto)"
+        discountFactors = (1 + self.discountRate) ** -(np.arange(1, self.numPeriods + 1) / factor)
+        ltv = self.transactionModel.discounted_purchases(df, discountFactors).astype(self.dtype)
+        ltv *= df[self.columnMonetary].to_numpy(dtype=self.dtype)
+        np.maximum(ltv, 0, out=ltv)
+        return ltv
+
+    def __add_horizons(self, df: pd.DataFrame, factor: float) -> None:
+        """
+            LTV de todos os horizontes em uma única operação sobre a matriz clientes x horizontes
+        """
+        columns = [f"{self.columnFrequency}_{horizon}" for horizon in self.horizons]
+        missing = [column for column in columns if column not in df.columns]
+        assert not missing, f"Horizon columns {missing} not found in DataFrame columns: {df.columns}"
+
+        discount = (1 + self.discountRate) ** (np.asarray(self.horizons, dtype=np.float64) / factor)
+        ltv = df[self.columnMonetary].to_numpy(dtype=self.dtype)[:, None] * df[columns].to_numpy(dtype=self.dtype)
+        ltv /= discount.astype(self.dtype)
+        np.maximum(ltv, 0, out=ltv)
+        for i, horizon in enumerate(self.horizons):
+            df[f"LTV_{horizon}"] = ltv[:, i]
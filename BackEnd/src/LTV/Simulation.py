@@ -0,0 +1,137 @@
+"""
+    Simulação de Monte Carlo das compras e dos gastos futuros de cada cliente.
+
+    Em vez das esperanças fechadas (ExpectedFrequency e ExpectedMonetary), sorteia caminhos de compras da posteriori de
+    cada cliente dado o seu histórico (BG/NBD ou Pareto e Gamma-Gamma já ajustados), como arrays
+    clientes x simulações x períodos. Os clientes são processados em blocos de no máximo chunkSize células, então a
+    memória não depende do número de clientes, e cada bloco tem a sua semente (SeedSequence.spawn): o resultado é o
+    mesmo para qualquer número de threads.
+"""
+from src.workflows.task import Task
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+import numpy as np
+import pandas as pd
+
+
+class PurchaseSimulator:
+    """
+        Sorteia o LTV de cada cliente em cada simulação. Não é uma Task, é usado pelo SimulationLTVTask
+    """
+
+    def __init__(self, transactionModel: Task, monetaryModel: Task, ltv: Task, nSimulations: int) -> None:
+        assert hasattr(transactionModel, "simulate_purchases"), "Simulation requires a BG/NBD or Pareto transaction model"
+        assert hasattr(monetaryModel, "simulate_spend"), "Simulation requires a Gamma-Gamma monetary model"
+        self.transactionModel = transactionModel
+        self.monetaryModel = monetaryModel
+        self.nSimulations = nSimulations
+
+        # Mesmo LTV do LTVTask: fluxo de caixa descontado ou as compras até numPeriods descontadas pelo prazo total
+        factor = {"W": 4.345, "M": 1.0, "D": 30, "H": 30 * 24}[ltv.frequency]
+        if ltv.isDiscountedCashFlow:
+            self.discountFactors = (1 + ltv.discountRate) ** -(np.arange(1, ltv.numPeriods + 1) / factor)
+        else:
+            numPeriods = transactionModel.numPeriods
+            self.discountFactors = np.full(numPeriods, (1 + ltv.discountRate) ** -(ltv.numPeriods / factor))
+
+    @property
+    def numPeriods(self) -> int:
+        return len(self.discountFactors)
+
+    def simulate(self, seed: np.random.SeedSequence, frequency: np.ndarray, recency: np.ndarray, T: np.ndarray,
+                 monetary: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+            Total de compras e LTV de cada cliente em cada simulação (duas matrizes clientes x simulações)
+        """
+        rng = np.random.default_rng(seed)
+        purchases = self.transactionModel.simulate_purchases(rng, self.nSimulations, self.numPeriods,
+                                                             frequency, recency, T)
+        spend = self.monetaryModel.simulate_spend(rng, purchases, frequency, monetary)
+        return purchases.sum(axis=2), spend @ self.discountFactors
+
+
+class SimulationLTVTask(Task):
+    def __init__(
+        self,
+        name: str,
+        transactionModel: Task,
+        monetaryModel: Task,
+        ltv: Task,
+        nSimulations: int = 1000,
+        quantiles: list[float] = (0.05, 0.5, 0.95),
+        seed: int = 42,
+        chunkSize: int = 1 << 22,
+        nThreads: int = None,
+    ) -> None:
+        """
+        Args:
+            name, # Nome da tarefa
+            transactionModel, monetaryModel # Tarefas dos modelos (BG/NBD ou Pareto e Gamma-Gamma) já executadas
+            ltv, # Tarefa do LTV, de onde vêm a taxa de desconto, o prazo e o modo de cálculo
+            nSimulations = 1000 # Número de simulações de cada cliente
+            quantiles = (0.05, 0.5, 0.95) # Quantis do LTV simulado, geram as colunas SimulatedLTV_p5, _p50 e _p95
+            seed = 42 # Semente das simulações (o resultado não depende de nThreads)
+            chunkSize = 1 << 22 # Máximo de células (clientes x simulações x períodos) sorteadas de uma vez
+            nThreads = None # Número de threads (None usa todos os núcleos)
+        """
+        super().__init__(name)
+        self.transactionModel = transactionModel
+        self.monetaryModel = monetaryModel
+        self.ltv = ltv
+        self.nSimulations = nSimulations
+        self.quantiles = list(quantiles)
+        self.seed = seed
+        self.chunkSize = chunkSize
+        self.nThreads = nThreads
+        self.portfolio = None
+        self.throughput = None
+
+    def on_run(self, df: pd.DataFrame) -> pd.DataFrame:
+        simulator = PurchaseSimulator(self.transactionModel, self.monetaryModel, self.ltv, self.nSimulations)
+        frequency, recency, T = (df[column].to_numpy(dtype=np.float64) for column in self.transactionModel.columns(False))
+        monetary = df["monetary_value"].to_numpy(dtype=np.float64)
+
+        # Blocos de clientes com no máximo chunkSize células (pelo menos um cliente por bloco)
+        size = max(1, self.chunkSize // (self.nSimulations * simulator.numPeriods))
+        starts = range(0, len(df), size)
+        seeds = np.random.SeedSequence(self.seed).spawn(len(starts))
+
+        purchases = np.empty(len(df))
+        ltv = np.empty(len(df))
+        ltvQuantiles = np.empty((len(df), len(self.quantiles)))
+        # LTV total da base em cada simulação
+        self.portfolio = np.zeros(self.nSimulations)
+
+        def run(start: int, seed: np.random.SeedSequence) -> np.ndarray:
+            rows = slice(start, start + size)
+            chunkPurchases, chunkLTV = simulator.simulate(seed, frequency[rows], recency[rows], T[rows], monetary[rows])
+            # Cada bloco escreve só as suas linhas
+            purchases[rows] = chunkPurchases.mean(axis=1)
+            ltv[rows] = chunkLTV.mean(axis=1)
+            ltvQuantiles[rows] = np.quantile(chunkLTV, self.quantiles, axis=1).T
+            return chunkLTV.sum(axis=0)
+
+        begin = time.perf_counter()
+        nThreads = max(1, min(len(starts), self.nThreads or os.cpu_count() or 1))
+        with ThreadPoolExecutor(max_workers=nThreads) as executor:
+            # Os totais são somados na ordem dos blocos, então o resultado não depende de nThreads
+            for total in executor.map(run, starts, seeds):
+                self.portfolio += total
+        seconds = time.perf_counter() - begin
+
+        self.throughput = {
+            "simulations": len(df) * self.nSimulations,
+            "seconds": seconds,
+            "simulationsPerSecond": len(df) * self.nSimulations / seconds if seconds > 0 else float("inf"),
+            "chunks": len(starts),
+            "threads": nThreads,
+        }
+        print(f"Simulação de Monte Carlo: {self.throughput['simulations']:,} simulações em {seconds:.2f}s "
+              f"({self.throughput['simulationsPerSecond']:,.0f} simulações/s, {nThreads} threads)")
+
+        df["SimulatedFrequency"] = purchases
+        df["SimulatedLTV"] = ltv
+        for quantile, values in zip(self.quantiles, ltvQuantiles.T):
+            df[f"SimulatedLTV_p{quantile * 100:g}"] = values
+        return df
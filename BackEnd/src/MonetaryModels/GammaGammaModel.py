@@ -1,8 +1,12 @@
 from sklearn.metrics import mean_squared_error
 from src.workflows.task import Task
+import numpy as np
 import pandas as pd
 from lifetimes import GammaGammaFitter
+from src.DataBase.Buckets import FrameParts
+from src.DataBase.ModelParams import ModelParamsStore, warm_fit
 from src.MonetaryModels.MonetaryModel import MonetaryModelTask
+from src.TrasactionModels.TransactionModel import compress_parts
 
 class GammaGammaModelTask(MonetaryModelTask):
     def __init__(
@@ -11,15 +15,22 @@ class GammaGammaModelTask(MonetaryModelTask):
         isTunning: bool = False,
         penalizer: float = 0.01,
         isRating: bool = False,
+        paramsStore: str = None,
+        datasetKey: str = None,
     ) -> None:
         """
         Args:
             isTraining = True #Caso seja para efetuar a predição em um dataset com ou sem o período de observação
             isTunning = None # Fazer o Tunning de hyperparâmetros se for True
             penalizer = 0.1 # Coeficiente de penalização usado pelo modelo
+            paramsStore = None # Arquivo JSON onde os parâmetros ajustados ficam salvos para o próximo ajuste (warm start)
+            datasetKey = None # Identificador da base no paramsStore
         """
         super().__init__(name, isTunning, isRating)
         self.penalizer = penalizer
+        self.paramsStore = ModelParamsStore(paramsStore) if paramsStore else None
+        self.datasetKey = datasetKey
+        self.fitReport = None
         self.model = self.createModel()
 
     def on_run(self, dfRFM: pd.DataFrame) -> pd.DataFrame:
@@ -27,9 +38,19 @@ class GammaGammaModelTask(MonetaryModelTask):
         monetary = "monetary_value"
         frequency = "frequency"
 
+        if isinstance(self.data_predict, FrameParts):
+            # RFM fora da memória: ajusta com os pares comprimidos parte por parte e prevê cada parte
+            assert not self.isRating, "isRating requires the whole RFM in memory"
+            if not self.isFitted:
+                self.fit(self.data_predict, monetary, frequency)
+            self.data_predict = pd.concat([self.__predict_part(part, monetary, frequency)
+                                           for part in self.data_predict], ignore_index=True)
+            return self.data_predict
+
         self.data_predict = self.data_predict[self.data_predict[monetary] > 0]
 
-        self.fit(self.data_predict, monetary, frequency)
+        if not self.isFitted:
+            self.fit(self.data_predict, monetary, frequency)
 
         self.data_predict['ExpectedMonetary'] = self.predict(self.data_predict, monetary, frequency)
         
@@ -42,19 +63,62 @@ class GammaGammaModelTask(MonetaryModelTask):
         gamma = GammaGammaFitter(penalizer_coef=self.penalizer)
         return gamma
 
-    def fit(self, df: pd.DataFrame, monetary: str, frequency: str) -> pd.DataFrame:
+    def fit(self, df: pd.DataFrame | FrameParts, monetary: str, frequency: str) -> pd.DataFrame:
         """
-            Treina o modelo com os dados passados
+            Treina o modelo com os dados passados. Um FrameParts (RFM fora da memória) é comprimido parte por parte
+            nos pares (frequency, monetary) distintos com monetary > 0, com peso igual ao número de clientes
         """
-        self.model.fit(df[frequency], df[monetary])
+        if isinstance(df, FrameParts):
+            (frequencies, values), weights = compress_parts(df, [frequency, monetary],
+                                                            select=lambda part: part[monetary] > 0)
+        else:
+            frequencies, values, weights = df[frequency], df[monetary], None
+        key = ModelParamsStore.key(self.datasetKey, self.__class__.__name__)
+        # O lifetimes otimiza o log de (p, q, v)
+        self.fitReport = warm_fit(
+            self.model,
+            lambda initial: self.model.fit(frequencies, values, weights=weights, initial_params=initial),
+            self.paramsStore, key, lambda params: np.log(params[["p", "q", "v"]].to_numpy(dtype=float)))
+        self.isFitted = True
+        if self.paramsStore is not None:
+            print(f"Ajuste de {self.__class__.__name__}:", self.fitReport)
         return self.model
 
+    def to_artifact(self) -> dict:
+        """
+            O que é preciso para prever sem ajustar de novo: os parâmetros do modelo
+        """
+        return {"params": self.model.params_.astype(float).to_dict()}
+
+    def load_artifact(self, artifact: dict) -> None:
+        """
+            Usa os parâmetros de um artefato (to_artifact) em vez de ajustar o modelo no on_run
+        """
+        self.model.params_ = pd.Series(artifact["params"])[["p", "q", "v"]]
+        self.isFitted = True
+
+    def __predict_part(self, part: pd.DataFrame, monetary: str, frequency: str) -> pd.DataFrame:
+        part = part[part[monetary] > 0].copy()
+        part['ExpectedMonetary'] = self.predict(part, monetary, frequency)
+        return part
+
     def predict(self, df: pd.DataFrame, monetary: str, frequency: str) -> pd.DataFrame:
         """
             Dado um período, retorna o número de transações esperadas até ele
         """
         return self.model.conditional_expected_average_profit(df[frequency], df[monetary])
     
+    def simulate_spend(self, rng: np.random.Generator, purchases: np.ndarray, frequency: np.ndarray,
+                       monetary: np.ndarray) -> np.ndarray:
+        """
+            Valor gasto em cada período das compras simuladas (clientes x simulações x períodos). O nu de cada cliente
+            vem da posteriori Gamma(p * x + q, v + x * monetary) e a soma de k compras é Gamma(p * k, nu)
+        """
+        p, q, v = self.model.params_[["p", "q", "v"]]
+        x, monetary = frequency[:, None], monetary[:, None]
+        nu = rng.gamma(p * x + q, 1 / (v + x * monetary), size=purchases.shape[:2])
+        return rng.gamma(p * purchases) / nu[..., None]
+
     def rating(self, df: pd.DataFrame) -> pd.DataFrame:
         """
         Retorna a classificação do cliente e calcula métricas de erro
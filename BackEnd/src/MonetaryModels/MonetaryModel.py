@@ -17,6 +17,7 @@ class MonetaryModelTask(Task):
         self.model = None
         self.isTunning = isTunning
         self.isRating = isRating
+        self.isFitted = False
 
     @abstractmethod
     def on_run(self, dfRFM: pd.DataFrame) -> pd.DataFrame:
@@ -24,7 +25,8 @@ class MonetaryModelTask(Task):
             Dado um dataset com os valores de RFM, retorna a predição do número de transações esperadas
         """
         self.data_predict = self.task_in["data_predict"].output
-        self.data_training = self.task_in["data_training"].output
+        # No modo só de predição (modelo carregado de um artefato) não há a tarefa de treino
+        self.data_training = self.task_in["data_training"].output if "data_training" in self.task_in else None
 
     @abstractmethod
     def createModel(self, df: pd.DataFrame):
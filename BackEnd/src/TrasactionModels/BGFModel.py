@@ -1,9 +1,16 @@
+import numpy as np
 import pandas as pd
 from lifetimes import BetaGeoFitter
+from scipy.special import hyp2f1
 from sklearn.metrics import mean_squared_error
+from src.DataBase.Buckets import FrameParts
+from src.TrasactionModels.NativeFitters import BetaGeoNativeFitter
 from src.TrasactionModels.TransactionModel import TransactionModelTask
 
 class BGFModelTask(TransactionModelTask):
+    PARAMS = ["r", "alpha", "a", "b"]
+    TIME_PARAMS = ["alpha"]
+
     def __init__(
         self,
         name: str,
@@ -11,27 +18,46 @@ class BGFModelTask(TransactionModelTask):
         penalizer: float = 0.1,
         numPeriods: int = 1,
         isRating: bool = False,
+        isCompressed: bool = True,
+        engine: str = "lifetimes",
+        paramsStore: str = None,
+        datasetKey: str = None,
+        horizons: list[int] = None,
     ) -> None:
         """
         Args:
             name, #Nome da tarefa
             isTraining = True #Caso seja para efetuar a predição em um dataset com ou sem o período de observação
             penalizer = 0.1# Coeficiente de penalização usado pelo modelo
+            isCompressed = True # Treina e prevê sobre os trios (frequency, recency, T) distintos, com pesos
+            engine = "lifetimes" # "native" usa o fitter vetorizado de NativeFitters
+            paramsStore = None # Arquivo JSON onde os parâmetros ajustados ficam salvos para o próximo ajuste (warm start)
+            datasetKey = None # Identificador da base no paramsStore
+            horizons = None # Horizontes previstos juntos em colunas ExpectedFrequency_<horizonte>, Ex: [4, 13, 26, 52]
         """
-        super().__init__(name,  isTraining, penalizer, numPeriods, isRating)
+        super().__init__(name,  isTraining, penalizer, numPeriods, isRating, isCompressed, engine, paramsStore, datasetKey,
+                         horizons)
         self.model = self.createModel()
 
     def on_run(self, dfRFM: pd.DataFrame) -> pd.DataFrame:
         super().on_run(dfRFM)
-        self.fit(self.data_training)
+        # O RFM de treino pode vir em partes (FrameParts): o fit comprime uma parte por vez
+        assert not (self.isRating and isinstance(self.data_training, FrameParts)), \
+            "isRating requires the whole training RFM in memory"
+        if not self.isFitted:
+            self.fit(self.data_training)
         self.data_predict['ExpectedFrequency'] = self.predict(self.data_predict)
+        if self.horizons:
+            self.add_horizons(self.data_predict)
         
-        if self.isRating:
+        if self.isRating and self.data_training is not None:
             self.rating()
 
         return self.data_predict
 
     def createModel(self) -> pd.DataFrame:
+        if self.engine == "native":
+            return BetaGeoNativeFitter(penalizer_coef=self.penalizer)
         pareto = BetaGeoFitter(penalizer_coef=self.penalizer)
         return pareto
 
@@ -43,18 +69,55 @@ class BGFModelTask(TransactionModelTask):
         # cal --> X em momento de treino
         # holdout --> Y em momento de treino
         # sem nada é no momento de Teste, momento de previsão, final
-        if isTraining:
-            self.model.fit(frequency=df['frequency_cal'],
-                           recency=df['recency_cal'],
-                           T=df['T_cal'])
-        else:
-            self.model.fit(frequency=df['frequency'],
-                           recency=df['recency'],
-                           T=df['T'])
+        frequency, recency, T, weights = self.sufficient_statistics(df, isTraining)
+        self.warm_fit(lambda initial: self.model.fit(frequency=frequency, recency=recency, T=T, weights=weights,
+                                                     initial_params=initial), T)
 
     def predict(self, df: pd.DataFrame, isTraining: bool = False) -> pd.DataFrame:
         return super().predict(df, isTraining=isTraining)
 
+    def expected_purchases(self, horizons: np.ndarray, frequency: np.ndarray, recency: np.ndarray, T: np.ndarray) -> np.ndarray:
+        """
+            Equação (10) de Fader, Hardie e Lee (2005), a mesma do BetaGeoFitter, com uma coluna por horizonte
+        """
+        r, alpha, a, b = self.model.params_[self.PARAMS]
+        x, recency, T = frequency[:, None], recency[:, None], T[:, None]
+        t = horizons[None, :]
+
+        # Termos de cada cliente, os mesmos em todos os horizontes
+        _a, _b, _c = r + x, b + x, a + b + x - 1
+        logAlphaT = np.log(alpha + T)
+        firstTerm = _c / (a - 1)
+        denominator = 1 + (x > 0) * (a / (b + x - 1)) * ((alpha + T) / (alpha + recency)) ** _a
+
+        _z = t / (alpha + T + t)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            lnHyp = np.log(hyp2f1(_a, _b, _c, _z))
+            lnHypAlt = np.log(hyp2f1(_c - _a, _c - _b, _c, _z)) + (_c - _a - _b) * np.log(1 - _z)
+        lnHyp = np.where(np.isinf(lnHyp), lnHypAlt, lnHyp)
+        return firstTerm * (1 - np.exp(lnHyp + _a * (logAlphaT - np.log(alpha + T + t)))) / denominator
+
+    def simulate_purchases(self, rng: np.random.Generator, nSimulations: int, numPeriods: int, frequency: np.ndarray,
+                           recency: np.ndarray, T: np.ndarray) -> np.ndarray:
+        """
+            Compras de cada cliente em cada período futuro (clientes x simulações x períodos), sorteadas da posteriori
+            dado o histórico: o cliente está vivo com P(alive), e vivo tem lambda ~ Gamma(r + x, alpha + T) e
+            p ~ Beta(a, b + x). As compras seguem um processo de Poisson que para depois de Geométrica(p) compras
+        """
+        r, alpha, a, b = self.model.params_[self.PARAMS]
+        x, recency, T = frequency[:, None], recency[:, None], T[:, None]
+        shape = (len(x), nSimulations)
+
+        with np.errstate(divide="ignore"):
+            ratio = np.where(x > 0, a / (b + x - 1) * ((alpha + T) / (alpha + recency)) ** (r + x), 0.0)
+        alive = rng.random(shape) < 1 / (1 + ratio)
+        rate = rng.gamma(r + x, 1 / (alpha + T), size=shape)
+        dropout = rng.geometric(rng.beta(a, b + x, size=shape)) * alive
+
+        purchases = np.cumsum(rng.poisson(rate[..., None], size=(*shape, numPeriods)), axis=2)
+        np.minimum(purchases, dropout[..., None], out=purchases)
+        return np.diff(purchases, axis=2, prepend=0)
+
     def rating(self) -> pd.DataFrame:
         """
             Retorna a classificação do cliente
@@ -0,0 +1,276 @@
+"""
+    Ajuste vetorizado (NumPy/SciPy) dos modelos BG/NBD e Pareto/NBD, com gradientes analíticos.
+
+    A interface imita a dos fitters do lifetimes (fit, params_, penalizer_coef e
+    conditional_expected_number_of_purchases_up_to_time), para as tarefas poderem trocar de motor sem mudar o resto.
+    Assim como no lifetimes, o tempo é escalado para que o maior T seja 1 e a penalização é aplicada aos parâmetros
+    na escala do ajuste: penalizer_coef * sum(params ** 2).
+
+    O otimizador trabalha com o log dos parâmetros (sempre positivos) e recebe o valor e o gradiente em uma única
+    chamada (L-BFGS-B). Os pesos representam quantos clientes cada linha resume, então o ajuste com pesos é o mesmo
+    ajuste da base sem compressão.
+"""
+import numpy as np
+import pandas as pd
+from abc import ABC, abstractmethod
+from lifetimes.utils import ConvergenceError
+from scipy.optimize import minimize
+from scipy.special import digamma, gammaln, hyp2f1
+
+
+class NativeFitter(ABC):
+    PARAMS: list[str] = []
+    # Parâmetros cuja unidade é tempo (divididos pela escala no final do ajuste)
+    TIME_PARAMS: list[str] = []
+
+    def __init__(self, penalizer_coef: float = 0.0) -> None:
+        self.penalizer_coef = penalizer_coef
+        self.params_ = None
+        self.result_ = None
+
+    def fit(
+        self,
+        frequency,
+        recency,
+        T,
+        weights=None,
+        initial_params=None,
+        tol: float = 1e-8,
+        maxiter: int = 1000,
+    ):
+        """
+        Args:
+            frequency, recency, T # Colunas do RFM (uma linha por cliente ou por trio distinto, com weights)
+            weights = None # Número de clientes de cada linha
+            initial_params = None # Ponto inicial no espaço do otimizador (log dos parâmetros na escala do ajuste)
+        """
+        frequency = np.asarray(frequency, dtype=np.float64)
+        recency = np.asarray(recency, dtype=np.float64)
+        T = np.asarray(T, dtype=np.float64)
+        weights = np.ones_like(frequency) if weights is None else np.asarray(weights, dtype=np.float64)
+
+        self._scale = 1.0 / T.max()
+        args = (frequency, recency * self._scale, T * self._scale, weights)
+        x0 = np.zeros(len(self.PARAMS)) if initial_params is None else np.asarray(initial_params, dtype=np.float64)
+
+        self.result_ = minimize(self._objective, x0, args=args, jac=True, method="L-BFGS-B", tol=tol,
+                                options={"maxiter": maxiter})
+        if not self.result_.success:
+            raise ConvergenceError(f"The model did not converge: {self.result_.message}")
+
+        self.log_params_ = self.result_.x
+        self._negative_log_likelihood_ = self.result_.fun
+        self.params_ = pd.Series(np.exp(self.result_.x), index=self.PARAMS)
+        for name in self.TIME_PARAMS:
+            self.params_[name] /= self._scale
+        return self
+
+    def _unload_params(self, *names) -> list[float]:
+        return [self.params_[name] for name in names]
+
+    def _objective(self, logParams: np.ndarray, frequency, recency, T, weights) -> tuple[float, np.ndarray]:
+        """
+            -sum(weights * ll) / sum(weights) + penalização, e o gradiente em relação ao log dos parâmetros
+        """
+        params = np.exp(logParams)
+        ll, gradient = self._log_likelihood(params, frequency, recency, T, gradient=True)
+        total = weights.sum()
+        value = -(weights @ ll) / total + self.penalizer_coef * (params ** 2).sum()
+        # Regra da cadeia: d/dlog(p) = p * d/dp
+        grad = -(weights @ gradient) / total * params + 2 * self.penalizer_coef * params ** 2
+        return value, grad
+
+    @abstractmethod
+    def _log_likelihood(self, params, frequency, recency, T, gradient: bool = False):
+        """
+            Log-verossimilhança de cada linha e, com gradient=True, o gradiente em relação aos parâmetros (linhas x
+            parâmetros)
+        """
+        pass
+
+
+class BetaGeoNativeFitter(NativeFitter):
+    PARAMS = ["r", "alpha", "a", "b"]
+    TIME_PARAMS = ["alpha"]
+
+    def _log_likelihood(self, params, x, recency, T, gradient: bool = False):
+        """
+            Log-verossimilhança de cada cliente (seção 7 de Fader, Hardie e Lee, 2005) e, se pedido,
+            as derivadas em relação a (r, alpha, a, b)
+        """
+        r, alpha, a, b = params
+        hasRepeat = x > 0
+        bx = b + np.maximum(x, 1) - 1
+
+        A1 = gammaln(r + x) - gammaln(r) + r * np.log(alpha)
+        A2 = gammaln(a + b) + gammaln(b + x) - gammaln(b) - gammaln(a + b + x)
+        A3 = -(r + x) * np.log(alpha + T)
+        A4 = np.where(hasRepeat, np.log(a) - np.log(bx) - (r + x) * np.log(alpha + recency), -np.inf)
+        tail = np.logaddexp(A3, A4)
+        ll = A1 + A2 + tail
+        if not gradient:
+            return ll
+
+        # Peso de cada termo do logaddexp (softmax), usado nas derivadas do log da soma
+        w3 = np.exp(A3 - tail)
+        w4 = 1.0 - w3
+        psiAB = digamma(a + b)
+        psiABX = digamma(a + b + x)
+        grad = np.column_stack([
+            digamma(r + x) - digamma(r) + np.log(alpha) - w3 * np.log(alpha + T) - w4 * np.log(alpha + recency),
+            r / alpha - (r + x) * (w3 / (alpha + T) + w4 / (alpha + recency)),
+            psiAB - psiABX + w4 / a,
+            psiAB + digamma(b + x) - digamma(b) - psiABX - w4 / bx,
+        ])
+        return ll, grad
+
+    def conditional_expected_number_of_purchases_up_to_time(self, t, frequency, recency, T):
+        """
+            Equação (10) de Fader, Hardie e Lee (2005), a mesma do BetaGeoFitter
+        """
+        x = np.asarray(frequency, dtype=np.float64)
+        recency = np.asarray(recency, dtype=np.float64)
+        T = np.asarray(T, dtype=np.float64)
+        r, alpha, a, b = self._unload_params("r", "alpha", "a", "b")
+
+        _a, _b, _c = r + x, b + x, a + b + x - 1
+        _z = t / (alpha + T + t)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            lnHyp = np.log(hyp2f1(_a, _b, _c, _z))
+            lnHypAlt = np.log(hyp2f1(_c - _a, _c - _b, _c, _z)) + (_c - _a - _b) * np.log(1 - _z)
+        lnHyp = np.where(np.isinf(lnHyp), lnHypAlt, lnHyp)
+
+        numerator = (a + b + x - 1) / (a - 1) * (1 - np.exp(lnHyp + (r + x) * np.log((alpha + T) / (alpha + t + T))))
+        denominator = 1 + (x > 0) * (a / (b + x - 1)) * ((alpha + T) / (alpha + recency)) ** (r + x)
+        return numerator / denominator
+
+
+class ParetoNBDNativeFitter(NativeFitter):
+    PARAMS = ["r", "alpha", "s", "beta"]
+    TIME_PARAMS = ["alpha", "beta"]
+
+    # Nós de Gauss-Laguerre das integrais do termo de churn e número de linhas avaliadas por vez (memória limitada)
+    NODES = 32
+    CHUNK_SIZE = 1 << 15
+
+    def _objective(self, logParams: np.ndarray, frequency, recency, T, weights) -> tuple[float, np.ndarray]:
+        # No lifetimes a penalização do Pareto é somada à verossimilhança total (e não à média, como no BG/NBD)
+        params = np.exp(logParams)
+        ll, gradient = self._log_likelihood(params, frequency, recency, T, gradient=True)
+        total = weights.sum()
+        value = (-(weights @ ll) + self.penalizer_coef * (params ** 2).sum()) / total
+        grad = (-(weights @ gradient) * params + 2 * self.penalizer_coef * params ** 2) / total
+        return value, grad
+
+    def _log_likelihood(self, params, x, recency, T, gradient: bool = False):
+        """
+            Log-verossimilhança de cada cliente (equação 18 das derivações de Fader e Hardie, 2005):
+
+                L = Γ(r+x) α^r β^s / Γ(r) * [(α+T)^-(r+x) (β+T)^-s + s ∫[tx, T] (α+τ)^-(r+x) (β+τ)^-(s+1) dτ]
+
+            A integral (o termo A0 do lifetimes, que usa hyp2f1) é J(tx) - J(T), com J(t0) a mesma integral de t0 até
+            o infinito. Em J o fator com a menor base vira a variável u = k * log((m+τ)/(m+t0)), k = r+s+x, e sobra
+            e^-u vezes uma função suave e limitada, integrada por Gauss-Laguerre. As derivadas em relação a
+            (r, alpha, s, beta) são derivadas sob o sinal da integral, avaliadas nos mesmos nós
+        """
+        ll = np.empty(len(x))
+        grad = np.empty((len(x), 4)) if gradient else None
+        for start in range(0, len(x), self.CHUNK_SIZE):
+            rows = slice(start, start + self.CHUNK_SIZE)
+            result = self.__chunk_log_likelihood(params, x[rows], recency[rows], T[rows], gradient)
+            if gradient:
+                ll[rows], grad[rows] = result
+            else:
+                ll[rows] = result
+        return (ll, grad) if gradient else ll
+
+    def __tail_integral(self, params, x, t0):
+        """
+            log J(t0) e, para cada nó, o peso do nó na integral e os logs log(α+τ) e log(β+τ)
+        """
+        r, alpha, s, beta = params
+        k = (r + s + x)[:, None]
+        nodes, nodeWeights = np.polynomial.laguerre.laggauss(self.NODES)
+
+        # m é a menor base (α ou β) e e o expoente do fator ((M+τ)/(m+τ)) que sobra no integrando
+        m, M = min(alpha, beta), max(alpha, beta)
+        e = s + 1 if alpha <= beta else (r + x)[:, None]
+        logStart = np.log(m + t0)[:, None]
+        logMinor = logStart + nodes / k
+        logMajor = logMinor + np.log1p((M - m) * np.exp(-logMinor))
+
+        logTerms = np.log(nodeWeights) - e * (logMajor - logMinor)
+        logSum = _logsumexp_rows(logTerms)
+        logJ = -k[:, 0] * logStart[:, 0] - np.log(k[:, 0]) + logSum
+        share = np.exp(logTerms - logSum[:, None])
+        if alpha <= beta:
+            return logJ, share, logMinor, logMajor
+        return logJ, share, logMajor, logMinor
+
+    def __chunk_log_likelihood(self, params, x, recency, T, gradient: bool):
+        r, alpha, s, beta = params
+        rx = r + x
+
+        A1 = gammaln(rx) - gammaln(r) + r * np.log(alpha) + s * np.log(beta)
+        alive = -rx * np.log(alpha + T) - s * np.log(beta + T)
+
+        logJStart, shareStart, logAlphaStart, logBetaStart = self.__tail_integral(params, x, recency)
+        logJEnd, shareEnd, logAlphaEnd, logBetaEnd = self.__tail_integral(params, x, T)
+        # log(J(tx) - J(T)), -inf quando tx == T (sem período para o churn)
+        ratio = np.exp(np.minimum(logJEnd - logJStart, 0.0))
+        with np.errstate(divide="ignore"):
+            logIntegral = logJStart + np.log1p(-ratio)
+        churn = np.log(s) + logIntegral
+        tail = np.logaddexp(alive, churn)
+        ll = A1 + tail
+        if not gradient:
+            return ll
+
+        # Derivada do log da integral: (E_tx[d log f] - ratio * E_T[d log f]) / (1 - ratio)
+        def dlog_integral(termStart, termEnd):
+            with np.errstate(divide="ignore", invalid="ignore"):
+                value = ((shareStart * termStart).sum(axis=1) - ratio * (shareEnd * termEnd).sum(axis=1)) / (1 - ratio)
+            return np.where(ratio < 1, value, 0.0)
+
+        wAlive = np.exp(alive - tail)
+        wChurn = 1.0 - wAlive
+        rxCol = rx[:, None]
+        grad = np.column_stack([
+            digamma(rx) - digamma(r) + np.log(alpha)
+            - wAlive * np.log(alpha + T) - wChurn * dlog_integral(logAlphaStart, logAlphaEnd),
+            r / alpha - rx * wAlive / (alpha + T)
+            - wChurn * dlog_integral(rxCol * np.exp(-logAlphaStart), rxCol * np.exp(-logAlphaEnd)),
+            np.log(beta) - wAlive * np.log(beta + T) + wChurn * (1 / s - dlog_integral(logBetaStart, logBetaEnd)),
+            s / beta - s * wAlive / (beta + T)
+            - wChurn * (s + 1) * dlog_integral(np.exp(-logBetaStart), np.exp(-logBetaEnd)),
+        ])
+        return ll, grad
+
+    def _conditional_log_likelihood(self, params, frequency, recency, T) -> np.ndarray:
+        """
+            Log-verossimilhança de cada cliente, com a mesma assinatura do ParetoNBDFitter
+        """
+        return self._log_likelihood(np.asarray(params, dtype=np.float64), np.asarray(frequency, dtype=np.float64),
+                                    np.asarray(recency, dtype=np.float64), np.asarray(T, dtype=np.float64))
+
+    def conditional_expected_number_of_purchases_up_to_time(self, t, frequency, recency, T):
+        """
+            Equação (41) das derivações de Fader e Hardie (2005), a mesma do ParetoNBDFitter
+        """
+        x = np.asarray(frequency, dtype=np.float64)
+        recency = np.asarray(recency, dtype=np.float64)
+        T = np.asarray(T, dtype=np.float64)
+        r, alpha, s, beta = params = self._unload_params("r", "alpha", "s", "beta")
+
+        likelihood = self._log_likelihood(np.asarray(params), x, recency, T)
+        first = gammaln(r + x) - gammaln(r) + r * np.log(alpha) + s * np.log(beta) \
+            - (r + x) * np.log(alpha + T) - s * np.log(beta + T)
+        second = np.log(r + x) + np.log(beta + T) - np.log(alpha + T)
+        third = np.log((1 - ((beta + T) / (beta + T + t)) ** (s - 1)) / (s - 1))
+        return np.exp(first + second + third - likelihood)
+
+
+def _logsumexp_rows(values: np.ndarray) -> np.ndarray:
+    # Mesmo que scipy.special.logsumexp(values, axis=1), sem as verificações que pesam no laço do otimizador
+    top = values.max(axis=1)
+    return top + np.log(np.exp(values - top[:, None]).sum(axis=1))
@@ -1,9 +1,16 @@
+import numpy as np
 import pandas as pd
 from lifetimes import ParetoNBDFitter
+from scipy.special import gammaln
 from sklearn.metrics import mean_squared_error
+from src.DataBase.Buckets import FrameParts
+from src.TrasactionModels.NativeFitters import ParetoNBDNativeFitter
 from src.TrasactionModels.TransactionModel import TransactionModelTask
 
 class ParetoModelTask(TransactionModelTask):
+    PARAMS = ["r", "alpha", "s", "beta"]
+    TIME_PARAMS = ["alpha", "beta"]
+
     def __init__(
         self,
         name: str,
@@ -11,29 +18,47 @@ class ParetoModelTask(TransactionModelTask):
         penalizer: float = 0.1,
         numPeriods: int = 1,
         isRating: bool = False,
+        isCompressed: bool = True,
+        engine: str = "lifetimes",
+        paramsStore: str = None,
+        datasetKey: str = None,
+        horizons: list[int] = None,
     ) -> None:
         """
         Args:
             name, #Nome da tarefa
             isTraining = True #Caso seja para efetuar a predição em um dataset com ou sem o período de observação
             penalizer = 0.1# Coeficiente de penalização usado pelo modelo
+            isCompressed = True # Treina e prevê sobre os trios (frequency, recency, T) distintos, com pesos
+            engine = "lifetimes" # "native" usa o fitter vetorizado de NativeFitters
+            paramsStore = None # Arquivo JSON onde os parâmetros ajustados ficam salvos para o próximo ajuste (warm start)
+            datasetKey = None # Identificador da base no paramsStore
+            horizons = None # Horizontes previstos juntos em colunas ExpectedFrequency_<horizonte>, Ex: [4, 13, 26, 52]
         """
-        super().__init__(name,  isTraining, penalizer, numPeriods, isRating)
+        super().__init__(name,  isTraining, penalizer, numPeriods, isRating, isCompressed, engine, paramsStore, datasetKey,
+                         horizons)
         self.model = self.createModel()
 
     def on_run(self, dfRFM: pd.DataFrame) -> pd.DataFrame:
         super().on_run(dfRFM)
-        
-        self.fit(self.data_training)        
+        # O RFM de treino pode vir em partes (FrameParts): o fit comprime uma parte por vez
+        assert not (self.isRating and isinstance(self.data_training, FrameParts)), \
+            "isRating requires the whole training RFM in memory"
+        if not self.isFitted:
+            self.fit(self.data_training)
         
         self.data_predict['ExpectedFrequency'] = self.predict(self.data_predict)
+        if self.horizons:
+            self.add_horizons(self.data_predict)
         
-        if self.isRating:
+        if self.isRating and self.data_training is not None:
             self.rating()
 
         return self.data_predict
 
     def createModel(self) -> pd.DataFrame:
+        if self.engine == "native":
+            return ParetoNBDNativeFitter(penalizer_coef=self.penalizer)
         pareto = ParetoNBDFitter(penalizer_coef=self.penalizer)
         return pareto
 
@@ -45,20 +70,73 @@ class ParetoModelTask(TransactionModelTask):
         # cal --> X em momento de treino
         # holdout --> Y em momento de treino
         # sem nada é no momento de Teste, momento de previsão, final
-        if isTraining:
-            self.model.fit(frequency=df['frequency_cal'],
-                           recency=df['recency_cal'],
-                           T=df['T_cal'])
-        else:
-            self.model.fit(frequency=df['frequency'],
-                           recency=df['recency'],
-                           T=df['T'])
+        frequency, recency, T, weights = self.sufficient_statistics(df, isTraining)
+        self.model.penalizer_coef = self.penalizer_for(weights)
+        try:
+            self.warm_fit(lambda initial: self.model.fit(frequency=frequency, recency=recency, T=T, weights=weights,
+                                                         initial_params=initial), T)
+        finally:
+            self.model.penalizer_coef = self.penalizer
 
         return self.model
 
+    def penalizer_for(self, weights: np.ndarray | None) -> float:
+        # O lifetimes divide a verossimilhança do Pareto pela média dos pesos (e não pela soma, como no BG/NBD),
+        # então a penalização é ajustada para o ótimo ser o mesmo do fit sem compressão
+        if weights is not None and self.engine == "lifetimes":
+            return self.penalizer * len(weights) / weights.sum()
+        return self.penalizer
+
+    def initial_params(self, params: pd.Series, T: np.ndarray) -> np.ndarray:
+        initial = super().initial_params(params, T)
+        # O Pareto do lifetimes otimiza os próprios parâmetros (Nelder-Mead), e não o log deles
+        return np.exp(initial) if self.engine == "lifetimes" else initial
+
     def predict(self, df: pd.DataFrame, isTraining: bool = False) -> pd.DataFrame:
         return super().predict(df, isTraining=isTraining)
 
+    def expected_purchases(self, horizons: np.ndarray, frequency: np.ndarray, recency: np.ndarray, T: np.ndarray) -> np.ndarray:
+        """
+            Equação (41) das derivações de Fader e Hardie (2005), a mesma do ParetoNBDFitter, com uma coluna por
+            horizonte. Só o último termo depende do horizonte, a verossimilhança (a parte cara) é calculada uma vez
+        """
+        params = self.model.params_[self.PARAMS]
+        r, alpha, s, beta = params
+        x = frequency
+        likelihood = self.model._conditional_log_likelihood(params.to_numpy(), x, recency, T)
+        first = gammaln(r + x) - gammaln(r) + r * np.log(alpha) + s * np.log(beta) \
+            - (r + x) * np.log(alpha + T) - s * np.log(beta + T)
+        second = np.log(r + x) + np.log(beta + T) - np.log(alpha + T)
+
+        betaT = (beta + T)[:, None]
+        third = np.log((1 - (betaT / (betaT + horizons[None, :])) ** (s - 1)) / (s - 1))
+        return np.exp((first + second - likelihood)[:, None] + third)
+
+    def simulate_purchases(self, rng: np.random.Generator, nSimulations: int, numPeriods: int, frequency: np.ndarray,
+                           recency: np.ndarray, T: np.ndarray) -> np.ndarray:
+        """
+            Compras de cada cliente em cada período futuro (clientes x simulações x períodos), sorteadas da posteriori
+            dado o histórico: o cliente está vivo com P(alive), e vivo tem lambda ~ Gamma(r + x, alpha + T) e
+            mu ~ Gamma(s, beta + T). O tempo de vida restante é Exponencial(mu) e as compras de cada período são
+            Poisson(lambda x fração do período em que o cliente ainda está vivo)
+        """
+        params = self.model.params_[self.PARAMS]
+        r, alpha, s, beta = params
+        likelihood = self.model._conditional_log_likelihood(params.to_numpy(), frequency, recency, T)
+        logAlive = gammaln(r + frequency) - gammaln(r) + r * np.log(alpha) + s * np.log(beta) \
+            - (r + frequency) * np.log(alpha + T) - s * np.log(beta + T) - likelihood
+        x, T = frequency[:, None], T[:, None]
+        shape = (len(x), nSimulations)
+
+        alive = rng.random(shape) < np.exp(logAlive)[:, None]
+        rate = rng.gamma(r + x, 1 / (alpha + T), size=shape)
+        # Com s pequeno o sorteio de mu pode ser 0: o cliente nunca morre (tempo de vida infinito)
+        with np.errstate(divide="ignore"):
+            lifetime = np.where(alive, rng.exponential(1 / rng.gamma(s, 1 / (beta + T), size=shape)), 0.0)
+
+        exposure = np.clip(lifetime[..., None] - np.arange(numPeriods), 0, 1)
+        return rng.poisson(rate[..., None] * exposure)
+
     def rating(self) -> pd.DataFrame:
         """
             Retorna a classificação do cliente
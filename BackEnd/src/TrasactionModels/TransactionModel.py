@@ -1,10 +1,19 @@
 from src.workflows.task import Task
+from src.DataBase.Buckets import FrameParts
+from src.DataBase.ModelParams import ModelParamsStore, warm_fit
+import numpy as np
 import pandas as pd
 from abc import abstractmethod
 from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score, median_absolute_error
 
 
 class TransactionModelTask(Task):
+    # Parâmetros do modelo, na ordem do otimizador, e os que têm unidade de tempo (escalados por 1 / T.max() no ajuste)
+    PARAMS: list[str] = []
+    TIME_PARAMS: list[str] = []
+    # Tamanho máximo (em células) de cada bloco da matriz clientes x períodos em discounted_purchases
+    CURVE_CELLS = 1 << 22
+
     def __init__(
         self,
         name: str,
@@ -12,12 +21,22 @@ class TransactionModelTask(Task):
         penalizer: float = 0.1,
         numPeriods: int = 1,
         isRating: bool = False,
+        isCompressed: bool = True,
+        engine: str = "lifetimes",
+        paramsStore: str = None,
+        datasetKey: str = None,
+        horizons: list[int] = None,
     ) -> None:
         """
         Args:
             model #Modelo BG/NBD ou de Pareto esperado para realizar a predição
             rfm #Dataset já processado pelo RFM
             isTraining = True #Caso seja para efetuar a predição em um dataset com ou sem o período de observação
+            isCompressed = True # Agrupa os clientes com o mesmo (frequency, recency, T) antes do fit e da predição
+            engine = "lifetimes" # "lifetimes" usa os fitters do lifetimes, "native" os de NativeFitters (gradientes analíticos)
+            paramsStore = None # Arquivo JSON com os parâmetros do último ajuste, usados como ponto inicial do próximo
+            datasetKey = None # Identificador da base no paramsStore (Ex: caminho do CSV)
+            horizons = None # Horizontes (em períodos) previstos juntos, Ex: [4, 13, 26, 52] gera ExpectedFrequency_4, ...
         """
         super().__init__(name)
         self.model = None
@@ -25,6 +44,14 @@ class TransactionModelTask(Task):
         self.penalizer = penalizer
         self.numPeriods = numPeriods
         self.isRating = isRating
+        self.isCompressed = isCompressed
+        assert engine in ("lifetimes", "native"), f"Unknown fitter engine '{engine}'"
+        self.engine = engine
+        self.paramsStore = ModelParamsStore(paramsStore) if paramsStore else None
+        self.datasetKey = datasetKey
+        self.fitReport = None
+        self.isFitted = False
+        self.horizons = horizons
 
     @abstractmethod
     def on_run(self, dfRFM: pd.DataFrame) -> pd.DataFrame:
@@ -32,32 +59,137 @@ class TransactionModelTask(Task):
             Dado um dataset com os valores de RFM, retorna a predição do número de transações esperadas
         """
         self.data_predict = self.task_in["data_predict"].output
-        self.data_training = self.task_in["data_training"].output
+        # No modo só de predição (modelo carregado de um artefato) não há a tarefa de treino
+        self.data_training = self.task_in["data_training"].output if "data_training" in self.task_in else None
 
     @abstractmethod
     def createModel(self, df: pd.DataFrame):
         pass
 
+    def columns(self, isTraining: bool) -> list[str]:
+        suffix = "_cal" if isTraining else ""
+        return [f"frequency{suffix}", f"recency{suffix}", f"T{suffix}"]
+
+    def sufficient_statistics(self, df: pd.DataFrame | FrameParts, isTraining: bool = True) -> tuple[np.ndarray, ...]:
+        """
+            (frequency, recency, T, weights) usados no fit. A verossimilhança depende apenas do trio
+            (frequency, recency, T), então com isCompressed os clientes com o mesmo trio viram uma única linha
+            com peso igual ao número de clientes. Um FrameParts (RFM fora da memória) é comprimido parte por parte
+        """
+        if isinstance(df, FrameParts):
+            assert self.isCompressed, "A FrameParts input requires isCompressed=True"
+            (frequency, recency, T), weights = compress_parts(df, self.columns(isTraining))
+            return frequency, recency, T, weights
+        frequency, recency, T = (df[column].to_numpy(dtype=np.float64) for column in self.columns(isTraining))
+        if not self.isCompressed:
+            return frequency, recency, T, None
+        (frequency, recency, T), weights, _ = compress(frequency, recency, T)
+        return frequency, recency, T, weights
+
+    def penalizer_for(self, weights: np.ndarray | None) -> float:
+        """
+            Coeficiente de penalização do fitter para um ajuste com esses pesos (o mesmo ótimo do ajuste sem pesos)
+        """
+        return self.penalizer
+
+    def initial_params(self, params: pd.Series, T: np.ndarray) -> np.ndarray:
+        """
+            Parâmetros de um ajuste anterior no espaço do otimizador (log dos parâmetros, com o tempo na escala do
+            ajuste atual)
+        """
+        params = params[self.PARAMS].astype(float)
+        params[self.TIME_PARAMS] /= T.max()
+        return np.log(params.to_numpy())
+
+    def warm_fit(self, fit, T: np.ndarray) -> dict:
+        """
+            Chama fit(initial_params) partindo dos parâmetros do último ajuste desta base e deste modelo (quando há
+            um paramsStore) e guarda o relatório do ajuste em fitReport
+        """
+        key = ModelParamsStore.key(self.datasetKey, self.__class__.__name__)
+        self.fitReport = warm_fit(self.model, fit, self.paramsStore, key, lambda params: self.initial_params(params, T))
+        self.isFitted = True
+        if self.paramsStore is not None:
+            print(f"Ajuste de {self.__class__.__name__}:", self.fitReport)
+        return self.fitReport
+
+    def to_artifact(self) -> dict:
+        """
+            O que é preciso para prever sem ajustar de novo: os parâmetros do modelo
+        """
+        return {"params": self.model.params_.astype(float).to_dict()}
+
+    def load_artifact(self, artifact: dict) -> None:
+        """
+            Usa os parâmetros de um artefato (to_artifact) em vez de ajustar o modelo no on_run
+        """
+        self.model.params_ = pd.Series(artifact["params"])[self.PARAMS]
+        self.isFitted = True
+
     @abstractmethod
     def predict(self, df: pd.DataFrame, isTraining: bool = False) -> pd.DataFrame:
         """
             Dado um período, retorna o número de transações esperadas até ele
         """
-        if isTraining:
-            # No período de Treino e no periodo de Validação
-            return self.model.conditional_expected_number_of_purchases_up_to_time(
-                self.numPeriods,
-                df["frequency_cal"].values,
-                df["recency_cal"].values,
-                df["T_cal"].values,
-            )
-        # Prever dados futuros, com todo o dataset
-        return self.model.conditional_expected_number_of_purchases_up_to_time(
-            self.numPeriods,
-            df["frequency"].values,
-            df["recency"].values,
-            df["T"].values
-        )
+        frequency, recency, T = (df[column].to_numpy(dtype=np.float64) for column in self.columns(isTraining))
+        if not self.isCompressed:
+            return self.model.conditional_expected_number_of_purchases_up_to_time(self.numPeriods, frequency, recency, T)
+
+        # Calcula uma vez por trio distinto e expande de volta para os clientes
+        (frequency, recency, T), _, inverse = compress(frequency, recency, T)
+        expected = self.model.conditional_expected_number_of_purchases_up_to_time(self.numPeriods, frequency, recency, T)
+        return np.asarray(expected)[inverse]
+
+    def predict_horizons(self, df: pd.DataFrame, horizons: list[int], isTraining: bool = False) -> pd.DataFrame:
+        """
+            Número de transações esperadas de cada cliente (linhas) até cada horizonte (colunas), em uma única
+            avaliação vetorizada
+        """
+        t = np.asarray(horizons, dtype=np.float64)
+        columns = [df[column].to_numpy(dtype=np.float64) for column in self.columns(isTraining)]
+        if self.isCompressed:
+            columns, _, inverse = compress(*columns)
+            expected = self.expected_purchases(t, *columns)[inverse]
+        else:
+            expected = self.expected_purchases(t, *columns)
+        return pd.DataFrame(expected, index=df.index, columns=list(horizons))
+
+    def discounted_purchases(self, df: pd.DataFrame, discountFactors: np.ndarray, isTraining: bool = False) -> np.ndarray:
+        """
+            Soma das transações esperadas em cada período t = 1..len(discountFactors), E[N(t)] - E[N(t - 1)], vezes o
+            fator de desconto do período. Calculado por trio (frequency, recency, T) distinto e em blocos de linhas,
+            para a matriz trios x períodos caber na memória
+        """
+        discountFactors = np.asarray(discountFactors, dtype=np.float64)
+        horizons = np.arange(1, len(discountFactors) + 1, dtype=np.float64)
+        columns = [df[column].to_numpy(dtype=np.float64) for column in self.columns(isTraining)]
+        if self.isCompressed:
+            columns, _, inverse = compress(*columns)
+
+        total = np.empty(len(columns[0]))
+        chunkSize = max(1, self.CURVE_CELLS // len(horizons))
+        for start in range(0, len(total), chunkSize):
+            rows = slice(start, start + chunkSize)
+            curve = self.expected_purchases(horizons, *(column[rows] for column in columns))
+            # E[N(0)] = 0, então o primeiro período é a própria curva em t = 1
+            total[rows] = np.diff(curve, axis=1, prepend=0) @ discountFactors
+        return total[inverse] if self.isCompressed else total
+
+    @abstractmethod
+    def expected_purchases(self, horizons: np.ndarray, frequency: np.ndarray, recency: np.ndarray, T: np.ndarray) -> np.ndarray:
+        """
+            Matriz clientes x horizontes da esperança condicional do modelo. Os termos que dependem apenas do cliente
+            são calculados uma vez e reaproveitados em todos os horizontes
+        """
+        pass
+
+    def add_horizons(self, df: pd.DataFrame) -> None:
+        """
+            Colunas ExpectedFrequency_<horizonte> para cada um dos horizons
+        """
+        expected = self.predict_horizons(df, self.horizons)
+        for horizon in expected.columns:
+            df[f"ExpectedFrequency_{horizon}"] = expected[horizon].to_numpy()
 
     @abstractmethod
     def fit(self, df: pd.DataFrame) -> pd.DataFrame:
@@ -132,4 +264,35 @@ class TransactionModelTask(Task):
 
         print()
 
-        return mse
\ No newline at end of file
+        return mse
+
+
+def compress(*columns: np.ndarray) -> tuple[list[np.ndarray], np.ndarray, np.ndarray]:
+    """
+        Linhas distintas das colunas, quantas vezes cada uma aparece e o índice que reconstrói as colunas originais
+        (valores[inverse] == colunas)
+    """
+    unique, inverse, counts = np.unique(np.column_stack(columns), axis=0, return_inverse=True, return_counts=True)
+    return list(unique.T), counts, inverse.reshape(-1)
+
+
+def compress_parts(parts: FrameParts, columns: list[str], select=None) -> tuple[list[np.ndarray], np.ndarray]:
+    """
+        compress das colunas de todas as partes, lendo uma parte por vez: só as linhas distintas e as contagens
+        acumuladas ficam na memória
+
+        Args:
+            parts # RFM gravado em partes (FrameParts)
+            columns # Colunas comprimidas
+            select = None # Função parte -> máscara das linhas usadas (Ex: monetary_value > 0)
+    """
+    unique, counts = [np.empty(0) for _ in columns], np.empty(0, dtype=np.int64)
+    for part in parts:
+        if select is not None:
+            part = part[select(part)]
+        values, weights, _ = compress(*(part[column].to_numpy(dtype=np.float64) for column in columns))
+        # Junta as linhas distintas desta parte com as acumuladas e soma as contagens das que se repetem
+        unique, _, inverse = compress(*(np.concatenate(pair) for pair in zip(unique, values)))
+        counts = np.bincount(inverse, weights=np.concatenate([counts, weights]), minlength=len(unique[0]))
+        counts = counts.astype(np.int64)
+    return unique, counts
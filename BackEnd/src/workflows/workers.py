@@ -0,0 +1,52 @@
+"""
+    Processos das tarefas que dividem o trabalho em um ProcessPoolExecutor (busca do penalizer, réplicas do
+    bootstrap): a cópia da tarefa enviada aos processos e o estado compartilhado com eles.
+
+    Os processos são criados com spawn em vez de fork, que dentro do servidor Flask copiaria as threads e os locks
+    dele em um estado inconsistente.
+"""
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor
+import copy
+import multiprocessing
+from src.workflows.task import Task
+
+
+def detached(task: Task) -> Task:
+    """
+        Cópia da tarefa sem as ligações com o pipeline e sem os dados, para ser enviada aos processos
+    """
+    clone = copy.copy(task)
+    clone.task_in, clone.task_out, clone.output = {}, {}, None
+    clone.data_training = clone.data_predict = None
+    clone.paramsStore = None
+    clone.model = task.createModel()
+    return clone
+
+
+# Estado compartilhado com os processos do pool (uma cópia por processo, enviada uma única vez na criação)
+_workerState = None
+
+
+def _init_worker(state) -> None:
+    global _workerState
+    _workerState = state
+
+
+def worker_state():
+    """
+        Estado passado ao process_pool, dentro de um dos seus processos
+    """
+    return _workerState
+
+
+def process_pool(nJobs: int, state) -> ProcessPoolExecutor:
+    """
+        Pool de nJobs processos (spawn) em que worker_state() retorna state
+
+        Args:
+            nJobs # Número de processos
+            state # Objeto copiado para cada processo (Ex: modelo e dados), precisa ser serializável com pickle
+    """
+    return ProcessPoolExecutor(max_workers=nJobs, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=_init_worker, initargs=(state,))
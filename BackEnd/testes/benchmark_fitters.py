@@ -0,0 +1,52 @@
+"""
+    Compara o tempo de ajuste e os parâmetros dos fitters do lifetimes com os de NativeFitters, com e sem a compressão
+    dos clientes em trios (frequency, recency, T). Uso: python -m testes.benchmark_fitters [clientes]
+"""
+import sys
+import time
+import numpy as np
+import pandas as pd
+from lifetimes import BetaGeoFitter, ParetoNBDFitter
+from lifetimes.generate_data import pareto_nbd_model
+from src.TrasactionModels.NativeFitters import BetaGeoNativeFitter, ParetoNBDNativeFitter
+from src.TrasactionModels.TransactionModel import compress
+
+
+def generate_customers(size: int, seed: int = 0) -> tuple[np.ndarray, ...]:
+    # Clientes simulados por um Pareto/NBD em 52 semanas, arredondados para semanas inteiras como na saída do RFMTask
+    np.random.seed(seed)
+    customers = pareto_nbd_model(52, 0.6, 12.0, 0.7, 18.0, size=size)
+    frequency = np.floor(customers["frequency"].to_numpy(dtype=float))
+    recency = np.where(frequency > 0, np.floor(customers["recency"].to_numpy(dtype=float)), 0.0)
+    T = np.floor(customers["T"].to_numpy(dtype=float))
+    return frequency, recency, T
+
+
+def benchmark(size: int = 20000, penalizer: float = 0.1) -> pd.DataFrame:
+    frequency, recency, T = generate_customers(size)
+    (cFrequency, cRecency, cT), weights, _ = compress(frequency, recency, T)
+
+    rows = []
+    for name, fitter in [("BG/NBD lifetimes", BetaGeoFitter), ("BG/NBD native", BetaGeoNativeFitter),
+                         ("Pareto lifetimes", ParetoNBDFitter), ("Pareto native", ParetoNBDNativeFitter)]:
+        for compressed in [False, True]:
+            penalizerCoef = penalizer
+            if compressed and fitter is ParetoNBDFitter:
+                # Mesmo ajuste usado pelo ParetoModelTask (o lifetimes normaliza pela média dos pesos)
+                penalizerCoef = penalizer * len(weights) / weights.sum()
+            model = fitter(penalizer_coef=penalizerCoef)
+            start = time.perf_counter()
+            if compressed:
+                model.fit(cFrequency, cRecency, cT, weights=weights)
+            else:
+                model.fit(frequency, recency, T)
+            elapsed = time.perf_counter() - start
+            rows.append({"fitter": name, "compressed": compressed, "seconds": elapsed,
+                         **model.params_.round(4).to_dict()})
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    pd.set_option("display.width", 200)
+    print(benchmark(size))
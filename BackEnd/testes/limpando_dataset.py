@@ -1,5 +1,6 @@
 import pandas as pd
 from sklearn.preprocessing import StandardScaler
+from src.DataBase.TransactionIndex import TransactionIndex
 
 # Caminhos dos arquivos
 ltv_file_path = "../output/data/id.csv"
@@ -55,8 +56,9 @@ if transactions.isnull().sum().any():
     print("Valores ausentes encontrados no dataset de transações. Preenchendo com a média...")
     transactions.fillna(transactions.mean(), inplace=True)
 
-# Filtrar transações removendo os IDs dos outliers
-filtered_transactions = transactions[~transactions['customer_id'].isin(outlier_ids)]
+# Filtrar transações removendo os IDs dos outliers (as linhas de cada cliente saem direto do índice por cliente)
+index = TransactionIndex.from_frame(transactions, "customer_id", "date", "amount")
+filtered_transactions = transactions.iloc[index.rows_of(outlier_ids, exclude=True)]
 print(f"Número de transações antes do filtro: {len(transactions)}")
 print(f"Número de transações após o filtro: {len(filtered_transactions)}")
 
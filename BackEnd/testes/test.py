@@ -1,9 +1,8 @@
-import pandas as pd
-from lifetimes import GammaGammaFitter
 from src.DataBase.CsvRead import CsvReadTask
 from src.DataTransformation.RFM import RFMTask
+from src.MonetaryModels.GammaGammaModel import GammaGammaModelTask
+from src.GenericModels.PenalizerSweep import PenalizerSweepTask
 from src.workflows.pipeline import Pipeline
-from sklearn.metrics import mean_absolute_error
 
 def test_gamma_gamma_penalizer():
     with Pipeline() as pipeline:
@@ -13,41 +12,20 @@ def test_gamma_gamma_penalizer():
         columnMonetary = "amount"
 
         read_dt = CsvReadTask("read_dt", file_path, columnID, columnDate, columnMonetary)
-        rfm_predict = RFMTask("data_predict", isRating=True, predictInterval=1, isTraining=False)
+        rfm_training = RFMTask("data_training", predictInterval=1, isTraining=True)
 
-        # Associa as tarefas no pipeline
-        read_dt >> rfm_predict
-
-    df = pipeline.run()["data_predict"]
-
-    # Garantir que os dados necessários estão presentes
-    if "frequency" not in df.columns or "monetary_value" not in df.columns:
-        raise ValueError("O arquivo CSV deve conter as colunas 'frequency' e 'monetary_value'.")
-
-    # Filtrar valores inválidos
-    df = df[(df["frequency"] > 0) & (df["monetary_value"] > 0)]
+        # Testar diferentes valores de penalizer, pelo erro no holdout do RFM de treino (sem overridesFile o melhor
+        # valor não é gravado)
+        sweep = PenalizerSweepTask("penalizer_sweep", GammaGammaModelTask("monetary_model"), [0.01, 0.1, 1, 10],
+                                   nJobs=2)
 
-    # Testar diferentes valores de penalizer
-    penalizer_values = [0.01, 0.1, 1, 10]
-    best_penalizer = None
-    best_mae = float("inf")
-
-    print("Testando diferentes valores de penalizer para o modelo Gamma-Gamma...\n")
-    for penalizer in penalizer_values:
-        model = GammaGammaFitter(penalizer_coef=penalizer)
-        model.fit(df["frequency"], df["monetary_value"])
-        predictions = model.conditional_expected_average_profit(df["frequency"], df["monetary_value"])
-        mae = mean_absolute_error(df["monetary_value"], predictions)
-
-        print(f"Penalizer: {penalizer}, MAE: {mae}")
+        # Associa as tarefas no pipeline
+        read_dt >> rfm_training >> sweep
 
-        # Atualizar o melhor penalizer
-        if mae < best_mae:
-            best_mae = mae
-            best_penalizer = penalizer
+    pipeline.run()
 
     print("\nMelhor Penalizer:")
-    print(f"Penalizer: {best_penalizer}, MAE: {best_mae}")
+    print(f"Penalizer: {sweep.bestPenalizer}")
 
 if __name__ == "__main__":
-    test_gamma_gamma_penalizer()
\ No newline at end of file
+    test_gamma_gamma_penalizer()
@@ -0,0 +1,39 @@
+import numpy as np
+from src.LTV.Bootstrap import BootstrapLTVTask, P2Quantiles
+from src.LTV.LtvModel import LTVTask
+from src.MonetaryModels.GammaGammaModel import GammaGammaModelTask
+from src.TrasactionModels.BGFModel import BGFModelTask
+from testes.test_transaction_models import rfm_training
+
+
+def test_p2_quantiles_track_exact_quantiles():
+    rng = np.random.default_rng(0)
+    replicates = rng.gamma(2.0, 10.0, size=(400, 500))
+    accumulator = P2Quantiles([0.05, 0.5, 0.95], 500)
+    for values in replicates:
+        accumulator.update(values)
+
+    exact = np.quantile(replicates, [0.05, 0.5, 0.95], axis=0).T
+    assert np.abs(accumulator.result() - exact).mean() < 0.05 * replicates.std()
+
+
+def test_bootstrap_is_reproducible_across_processes():
+    training = rfm_training(2000)
+    df = training.rename(columns=lambda column: column.replace("_cal", ""))
+    df = df[df["frequency"] > 0].copy()
+    df["monetary_value"] = np.random.default_rng(1).gamma(4.0, 10.0, len(df))
+
+    transactionModel = BGFModelTask("transaction_model", engine="native")
+    transactionModel.data_training = training
+    transactionModel.fit(training)
+    monetaryModel = GammaGammaModelTask("monetary_model")
+    monetaryModel.fit(df, "monetary_value", "frequency")
+    ltv = LTVTask("ltv", isDiscountedCashFlow=True, transactionModel=transactionModel, numPeriods=13)
+
+    results = []
+    for nJobs in [1, 2]:
+        bootstrap = BootstrapLTVTask("bootstrap", transactionModel, monetaryModel, ltv, nReplicates=12, nJobs=nJobs)
+        results.append(bootstrap.on_run(df.copy())[["LTV_p5", "LTV_p50", "LTV_p95"]].to_numpy())
+
+    np.testing.assert_array_equal(results[0], results[1])
+    assert (results[0][:, 0] <= results[0][:, 1]).all() and (results[0][:, 1] <= results[0][:, 2]).all()
@@ -0,0 +1,141 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.api.types import is_integer_dtype
+from src.DataBase import CsvRead
+from src.DataBase.CsvRead import COLUMNS, MAX_SEGMENTS, CsvReadTask
+from testes.test_rfm_engine import generate_transactions
+
+
+def transactions(textIds=False):
+    df = generate_transactions(80000, 5000)
+    df["amount"] = df["amount"].round(2)
+    if textIds:
+        df["customer_id"] = "c" + df["customer_id"].astype(str)
+    return df
+
+
+def read_csv(fp):
+    # Leitura simples do pandas, a referência de todos os modos
+    df = pd.read_csv(fp).rename(columns={"customer_id": "id", "amount": "monetary"})
+    df["date"] = pd.to_datetime(df["date"])
+    return df
+
+
+def assert_same_transactions(expected, result, isChunked=False):
+    expected = expected[COLUMNS].reset_index(drop=True)
+    result = result[COLUMNS].reset_index(drop=True)
+    if isChunked:
+        # Tipos declarados do modo isChunked: id inteiro ou categórico e valor em float32 (a resolução da data
+        # depende do leitor, pyarrow ou pandas)
+        if is_integer_dtype(expected["id"]):
+            assert is_integer_dtype(result["id"])
+        else:
+            assert isinstance(result["id"].dtype, pd.CategoricalDtype)
+            assert set(result["id"].cat.categories) == set(expected["id"])
+            expected["id"] = pd.Categorical(expected["id"], categories=result["id"].cat.categories)
+        assert result["monetary"].dtype == np.float32
+        expected["date"] = expected["date"].astype(result["date"].dtype)
+        expected["monetary"] = expected["monetary"].astype(np.float32)
+    pd.testing.assert_frame_equal(expected, result, rtol=1e-6)
+
+
+@pytest.mark.parametrize("textIds", [False, True])
+@pytest.mark.parametrize("chunkSize", [1000, 1 << 40])
+@pytest.mark.parametrize("usePyarrow", [True, False])
+def test_chunked_matches_read_csv(tmp_path, monkeypatch, textIds, chunkSize, usePyarrow):
+    fp = tmp_path / "transactions.csv"
+    transactions(textIds).to_csv(fp, index=False)
+    if not usePyarrow:
+        monkeypatch.setattr(CsvRead, "pacsv", None)
+
+    # chunkSize = 1 << 40 passaria do limite do block_size do pyarrow (int32)
+    task = CsvReadTask("read", fp, "customer_id", "date", "amount", isChunked=True, chunkSize=chunkSize)
+    assert_same_transactions(read_csv(fp), task.run(), isChunked=True)
+    assert task.peakMemory > 0
+
+
+@pytest.mark.parametrize("cacheDir", [None, "cache"])
+@pytest.mark.parametrize("textIds", [False, True])
+@pytest.mark.parametrize("isChunked", [False, True])
+def test_multiple_files_match_read_csv(tmp_path, cacheDir, textIds, isChunked):
+    df = transactions(textIds)
+    (tmp_path / "shards").mkdir()
+    for i, shard in enumerate([df[:30000], df[30000:50000], df[50000:]]):
+        shard.to_csv(tmp_path / "shards" / f"part{i}.csv", index=False)
+    df.to_csv(tmp_path / "transactions.csv", index=False)
+
+    cacheDir = cacheDir and tmp_path / cacheDir
+    for fp in [tmp_path / "shards", tmp_path / "shards" / "part*.csv"]:
+        result = CsvReadTask("read", fp, "customer_id", "date", "amount", isChunked=isChunked, cacheDir=cacheDir,
+                             nJobs=2).run()
+        assert_same_transactions(read_csv(tmp_path / "transactions.csv"), result, isChunked)
+
+
+@pytest.mark.parametrize("textIds", [False, True])
+@pytest.mark.parametrize("isChunked", [False, True])
+def test_incremental_matches_read_csv(tmp_path, textIds, isChunked):
+    df = transactions(textIds)
+    fp = tmp_path / "transactions.csv"
+
+    df[:60000].to_csv(fp, index=False)
+    read = lambda: CsvReadTask("read", fp, "customer_id", "date", "amount", isChunked=isChunked,
+                               cacheDir=tmp_path / "cache", isIncremental=True).run()
+    assert_same_transactions(read_csv(fp), read(), isChunked)
+
+    # Só as linhas novas são lidas e juntadas ao histórico, inclusive com clientes que ainda não apareceram
+    for i, part in enumerate([df[60000:70000], df[70000:]]):
+        part = part.copy()
+        newIds = part["customer_id"][::50].astype(str) + f"_new{i}"
+        part.loc[newIds.index, "customer_id"] = newIds if textIds else 100000 * (i + 1) + part["customer_id"][::50]
+        part.to_csv(fp, mode="a", header=False, index=False)
+        assert_same_transactions(read_csv(fp), read(), isChunked)
+
+    # Arquivo reescrito: leitura completa de novo
+    df[1000:].to_csv(fp, index=False)
+    assert_same_transactions(read_csv(fp), read(), isChunked)
+
+
+@pytest.mark.parametrize("isChunked", [False, True])
+@pytest.mark.parametrize("textIds", [False, True])
+def test_cache_returns_the_uncached_frame(tmp_path, isChunked, textIds):
+    df = transactions(textIds)
+    df["channel"] = "web"
+    fp = tmp_path / "transactions.csv"
+    df.to_csv(fp, index=False)
+
+    read = lambda cacheDir: CsvReadTask("read", fp, "customer_id", "date", "amount", isChunked=isChunked,
+                                        cacheDir=cacheDir).run()
+    expected = read(None)
+    # A primeira leitura preenche o cache e a segunda vem dele
+    if isChunked and textIds:
+        assert isinstance(expected["id"].dtype, pd.CategoricalDtype)
+    for _ in range(2):
+        pd.testing.assert_frame_equal(expected, read(tmp_path / "cache"))
+
+
+def test_incremental_segments_are_compacted_and_deleted(tmp_path):
+    df = transactions()
+    fp = tmp_path / "transactions.csv"
+    cacheDir = tmp_path / "cache"
+    read = lambda: CsvReadTask("read", fp, "customer_id", "date", "amount", cacheDir=cacheDir, isIncremental=True).run()
+
+    df[:20000].to_csv(fp, index=False)
+    read()
+    for part in range(2 * MAX_SEGMENTS):
+        df[20000 + 1000 * part:21000 + 1000 * part].to_csv(fp, mode="a", header=False, index=False)
+        assert_same_transactions(read_csv(fp), read())
+        assert len(list(cacheDir.glob("*.feather"))) <= MAX_SEGMENTS
+
+    # Ao reescrever o arquivo só fica o segmento da nova leitura
+    df[:5000].to_csv(fp, index=False)
+    assert_same_transactions(read_csv(fp), read())
+    assert len(list(cacheDir.glob("*.feather"))) == 1
+
+
+def test_incremental_rejects_many_files(tmp_path):
+    (tmp_path / "shards").mkdir()
+    transactions()[:100].to_csv(tmp_path / "shards" / "part0.csv", index=False)
+    with pytest.raises(AssertionError):
+        CsvReadTask("read", tmp_path / "shards", "customer_id", "date", "amount", cacheDir=tmp_path / "cache",
+                    isIncremental=True).run()
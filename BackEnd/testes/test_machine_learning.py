@@ -0,0 +1,154 @@
+import os
+import time
+import numpy as np
+import pytest
+import xgboost as xgb
+from sklearn.metrics import mean_squared_error
+from src.DataBase.CandidateCache import CandidateCache
+from src.DataTransformation.RFM import RFMTask
+from src.GenericModels import MachineLearning
+from src.GenericModels.MachineLearning import TUNING_SHARE, MachineLearningModelTask
+from src.GenericModels.Tuning import SuccessiveHalvingSearch
+from testes.test_rfm_engine import generate_transactions
+
+X_COLUMNS = ["frequency_cal", "recency_cal", "T_cal", "monetary_value_cal"]
+
+
+def ml_training():
+    transactions = generate_transactions(8000, 800).rename(columns={"customer_id": "id", "amount": "monetary"})
+    return RFMTask("rfm", predictInterval=4, isTraining=True).on_run(transactions)
+
+
+def test_parallel_selection_matches_serial():
+    training = ml_training()
+    reports = []
+    for nJobs in [1, 2]:
+        task = MachineLearningModelTask("ml", "frequency_holdout", False, X_COLUMNS, nJobs=nJobs)
+        task.data_training = training
+        task.train()
+        reports.append(task.candidateReport)
+        assert all(entry["status"] == "finished" and entry["seconds"] >= 0 for entry in task.candidateReport)
+
+    assert [entry["model"] for entry in reports[0]] == [entry["model"] for entry in reports[1]]
+    assert [entry["mse"] for entry in reports[0]] == pytest.approx([entry["mse"] for entry in reports[1]])
+
+
+def test_time_budget_cancels_unfinished_candidates():
+    task = MachineLearningModelTask("ml", "frequency_holdout", False, X_COLUMNS, nJobs=2, timeBudget=1e-3)
+    task.data_training = ml_training()
+    with pytest.raises(TimeoutError):
+        task.train()
+    assert all(entry["status"] == "cancelled" for entry in task.candidateReport)
+
+
+def test_time_budget_caps_the_hyperparameter_searches():
+    task = MachineLearningModelTask("ml", "frequency_holdout", False, X_COLUMNS, isTunning=True, nJobs=1,
+                                    timeBudget=120, nCandidates=1)
+    task.data_training = ml_training()
+    task.train()
+
+    # Sem tuningBudget, cada busca fica com a sua fatia do timeBudget
+    budgets = [model.maxSeconds for model in task.models]
+    assert all(0 < budget <= 120 * TUNING_SHARE / len(task.models) for budget in budgets)
+    assert any(entry["status"] == "finished" for entry in task.candidateReport)
+
+
+def test_searches_cut_by_the_time_budget_are_not_cached(tmp_path, monkeypatch):
+    # Sem fatia de tempo, cada busca para depois do primeiro candidato
+    monkeypatch.setattr(MachineLearning, "TUNING_SHARE", 0)
+    task = MachineLearningModelTask("ml", "frequency_holdout", False, X_COLUMNS, isTunning=True, nJobs=1,
+                                    timeBudget=300, nCandidates=3, candidateCache=tmp_path / "candidates")
+    task.data_training = ml_training()
+    task.train()
+
+    assert all(entry["status"] == "finished" and entry["evaluations"] == 1 for entry in task.candidateReport)
+    assert not list((tmp_path / "candidates").glob("*.joblib"))
+
+
+def test_successive_halving_search_with_early_stopping():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(3000, 4))
+    y = X[:, 0] * 2 + np.sin(X[:, 1]) + rng.normal(scale=0.1, size=3000)
+
+    grid = {"max_depth": [2, 4, 6], "learning_rate": [0.05, 0.1, 0.3], "n_estimators": [2000]}
+    search = SuccessiveHalvingSearch(xgb.XGBRegressor(), grid, factor=3).fit(X, y)
+
+    # 9 candidatos -> 3 -> 1, cada rodada com factor vezes mais linhas
+    assert [entry["iteration"] for entry in search.trace_] == [0] * 9 + [1] * 3 + [2]
+    assert search.trace_[0]["samples"] < search.trace_[9]["samples"] < search.trace_[-1]["samples"]
+    assert search.best_params_ == search.trace_[-1]["params"]
+    # O early stopping para bem antes das 2000 árvores, e o treino final usa o mesmo número de árvores
+    assert search.trace_[-1]["iterations"] < 2000
+    assert search.best_estimator_.n_estimators == search.trace_[-1]["iterations"]
+    assert mean_squared_error(y, search.predict(X)) < 0.1
+
+    assert search.completed_
+    capped = SuccessiveHalvingSearch(xgb.XGBRegressor(), grid, maxSeconds=0).fit(X, y)
+    assert len(capped.trace_) == 1 and capped.best_estimator_ is not None and not capped.completed_
+
+
+def test_screening_trains_only_the_top_candidates_on_full_data():
+    task = MachineLearningModelTask("ml", "frequency_holdout", False, X_COLUMNS, nJobs=1, screenSize=0.2, screenTopK=2)
+    task.data_training = ml_training()
+    task.train()
+
+    statuses = [entry["status"] for entry in task.candidateReport]
+    assert statuses.count("finished") == 2 and statuses.count("screened out") == len(task.models) - 2
+    assert all("sampleMse" in entry for entry in task.candidateReport)
+    assert task.screenReport["sampleSize"] == int(0.2 * len(task.X_train))
+    assert task.screenReport["finalists"] == [entry["model"] for entry in task.candidateReport
+                                              if entry["status"] == "finished"]
+    assert task.screenReport["spearman"] is None or -1 <= task.screenReport["spearman"] <= 1
+
+
+def test_candidate_cache_reuses_trained_candidates(tmp_path):
+    training = ml_training()
+    reports = []
+    for _ in range(2):
+        task = MachineLearningModelTask("ml", "frequency_holdout", False, X_COLUMNS, nJobs=1,
+                                        candidateCache=tmp_path / "candidates")
+        task.data_training = training
+        task.train()
+        reports.append(task.candidateReport)
+
+    assert not any(entry["cached"] for entry in reports[0])
+    assert all(entry["cached"] for entry in reports[1])
+    assert [entry["mse"] for entry in reports[0]] == [entry["mse"] for entry in reports[1]]
+    assert len(list((tmp_path / "candidates").glob("*.joblib"))) == len(task.models)
+
+    # Outro target (outros dados) não reaproveita os candidatos
+    task = MachineLearningModelTask("ml", "monetary_value_holdout", True, X_COLUMNS, nJobs=1,
+                                    candidateCache=tmp_path / "candidates")
+    task.data_training = training
+    task.train()
+    assert not any(entry["cached"] for entry in task.candidateReport)
+
+
+def test_candidate_cache_evicts_least_recently_used(tmp_path):
+    cache = CandidateCache(tmp_path, maxBytes=1 << 20)
+    for key in ["a", "b", "c"]:
+        cache.save(key, {"values": np.zeros(1000)})
+    # "a" foi usado por último (a data de modificação é o relógio do LRU)
+    cache.load("a")
+    os.utime(cache.path("a"), ns=(time.time_ns() + 10 ** 9,) * 2)
+    cache.maxBytes = 2 * cache.path("a").stat().st_size
+    cache.evict()
+    assert cache.load("a") is not None and cache.load("b") is None and cache.load("c") is not None
+
+
+def test_inference_model_scales_prediction_columns_in_chunks():
+    training = ml_training()
+    task = MachineLearningModelTask("ml", "frequency_holdout", False, X_COLUMNS, nJobs=1, chunkSize=1000)
+    task.data_training = training
+    task.train()
+
+    df = training[X_COLUMNS].rename(columns=lambda column: column.removesuffix("_cal"))
+    expected = task.bestModel.predict(task.scaler.transform(training[X_COLUMNS]))
+    np.testing.assert_allclose(task.inferenceModel.predict(df), expected)
+    assert task.inferenceModel.throughput["chunks"] == -(-len(df) // 1000)
+    assert task.inferenceModel.throughput["rowsPerSecond"] > 0
+
+    loaded = MachineLearningModelTask("ml", "frequency_holdout", False, X_COLUMNS, chunkSize=len(df))
+    loaded.load_artifact(task.to_artifact())
+    np.testing.assert_allclose(loaded.inferenceModel.predict(df), expected)
+    assert loaded.inferenceModel.throughput["chunks"] == 1
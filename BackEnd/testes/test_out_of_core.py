@@ -0,0 +1,104 @@
+import pandas as pd
+from src.DataBase.Buckets import FrameParts, TransactionBuckets
+from src.DataBase.CsvRead import CsvReadTask
+from src.DataTransformation.RFM import RFMTask
+from src.MonetaryModels.GammaGammaModel import GammaGammaModelTask
+from src.TrasactionModels.BGFModel import BGFModelTask
+from src.workflows.pipeline import Pipeline
+from test_rfm_engine import generate_transactions
+
+
+def run_both(tmp_path, df, isTraining):
+    df.to_csv(tmp_path / "transactions.csv", index=False)
+    transactions = CsvReadTask("read", tmp_path / "transactions.csv", "customer_id", "date", "amount",
+                               isChunked=True).run()
+    # Limite de memória bem pequeno para forçar vários blocos e vários buckets
+    buckets = CsvReadTask("read", tmp_path / "transactions.csv", "customer_id", "date", "amount",
+                          bucketDir=tmp_path / "buckets", memoryLimit=0.5).run()
+    assert len(buckets) > 1 and buckets.parts > 1 and buckets.rows == len(df)
+
+    expected = RFMTask("rfm", predictInterval=4, isTraining=isTraining, engine="numpy").on_run(transactions)
+    result = RFMTask("rfm", predictInterval=4, isTraining=isTraining).on_run(buckets)
+    return expected, result
+
+
+def test_buckets_match_in_memory(tmp_path):
+    df = generate_transactions(80000, 5000)
+    df["amount"] = df["amount"].round(2)
+    for isTraining in [False, True]:
+        expected, result = run_both(tmp_path, df, isTraining)
+        pd.testing.assert_frame_equal(expected, result)
+
+
+def test_buckets_with_text_ids(tmp_path):
+    df = generate_transactions(80000, 5000)
+    df["customer_id"] = "c" + df["customer_id"].astype(str)
+    df["amount"] = df["amount"].round(2)
+    for isTraining in [False, True]:
+        # Com ids categóricos a ordem das linhas segue as categorias, que dependem da ordem de leitura
+        expected, result = run_both(tmp_path, df, isTraining)
+        columns = ["id", "T_cal"] if isTraining else ["id"]
+        expected = expected.astype({"id": str}).sort_values(columns, ignore_index=True)
+        result = result.astype({"id": str}).sort_values(columns, ignore_index=True)
+        pd.testing.assert_frame_equal(expected, result)
+
+
+def test_parts_match_in_memory(tmp_path):
+    df = generate_transactions(80000, 5000)
+    df["amount"] = df["amount"].round(2)
+    for isTraining in [False, True]:
+        expected, _ = run_both(tmp_path, df, isTraining)
+        buckets = TransactionBuckets.open(tmp_path / "buckets")
+        parts = RFMTask("rfm", predictInterval=4, isTraining=isTraining, outputDir=tmp_path / "rfm").on_run(buckets)
+        # Uma parte por bucket, lidas uma por vez
+        assert len(parts) == len(buckets) and parts.rows == len(expected)
+        assert all(len(part) < len(expected) for part in parts)
+
+        columns = ["id", "T_cal"] if isTraining else ["id"]
+        result = parts.to_frame().sort_values(columns, ignore_index=True)
+        pd.testing.assert_frame_equal(expected.sort_values(columns, ignore_index=True), result, check_dtype=False)
+
+
+def run_models(tmp_path, isParts):
+    """
+        BG/NBD com o RFM de treino e Gamma-Gamma com o RFM de predição lidos dos buckets, em partes (outputDir) ou
+        em um DataFrame
+    """
+    outputDir = lambda name: tmp_path / name if isParts else None
+    with Pipeline() as pipeline:
+        read = CsvReadTask("read", tmp_path / "transactions.csv", "customer_id", "date", "amount",
+                           bucketDir=tmp_path / "buckets", memoryLimit=0.5)
+        data_predict = RFMTask("data_predict", predictInterval=4, isTraining=False)
+        data_training = RFMTask("data_training", predictInterval=4, isTraining=True, outputDir=outputDir("training"))
+        bgf = BGFModelTask("bgf", numPeriods=4)
+        read >> data_predict >> bgf
+        read >> data_training >> bgf
+    pipeline.run()
+
+    with Pipeline() as pipeline:
+        read = CsvReadTask("read", tmp_path / "transactions.csv", "customer_id", "date", "amount",
+                           bucketDir=tmp_path / "buckets", memoryLimit=0.5)
+        gamma = GammaGammaModelTask("gamma")
+        read >> RFMTask("data_predict", predictInterval=4, isTraining=False, outputDir=outputDir("predict")) >> gamma
+    pipeline.run()
+    assert isinstance(bgf.data_training, FrameParts) == isParts
+    assert isinstance(gamma.task_in["data_predict"].output, FrameParts) == isParts
+    return bgf, gamma
+
+
+def test_models_fit_on_parts(tmp_path):
+    df = generate_transactions(80000, 5000)
+    df["amount"] = df["amount"].round(2)
+    df.to_csv(tmp_path / "transactions.csv", index=False)
+
+    expectedBGF, expectedGamma = run_models(tmp_path, isParts=False)
+    bgf, gamma = run_models(tmp_path, isParts=True)
+    # Os pesos das linhas comprimidas parte por parte dão o mesmo ajuste do RFM inteiro
+    pd.testing.assert_series_equal(expectedBGF.model.params_, bgf.model.params_, rtol=1e-4)
+    pd.testing.assert_series_equal(expectedBGF.output["ExpectedFrequency"], bgf.output["ExpectedFrequency"],
+                                   rtol=1e-4)
+    pd.testing.assert_series_equal(expectedGamma.model.params_, gamma.model.params_, rtol=1e-4)
+    columns = ["id", "ExpectedMonetary"]
+    expected = expectedGamma.output[columns].sort_values("id", ignore_index=True)
+    result = gamma.output[columns].sort_values("id", ignore_index=True)
+    pd.testing.assert_frame_equal(expected, result, check_dtype=False, rtol=1e-4)
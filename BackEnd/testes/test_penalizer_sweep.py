@@ -0,0 +1,46 @@
+import json
+import pytest
+import pipelines
+from src.GenericModels.PenalizerSweep import PenalizerSweepTask
+from src.MonetaryModels.GammaGammaModel import GammaGammaModelTask
+from src.TrasactionModels.BGFModel import BGFModelTask
+from testes.test_machine_learning import ml_training
+
+PENALIZERS = [0.001, 0.01, 0.1, 1.0]
+
+
+def test_parallel_sweep_matches_serial():
+    training = ml_training()
+    results = []
+    for nJobs in [1, 2]:
+        sweep = PenalizerSweepTask("sweep", BGFModelTask("transaction_model", engine="native"), PENALIZERS, nJobs=nJobs)
+        results.append(sweep.on_run(training))
+
+    serial, parallel = results
+    assert serial["penalizer"].tolist() == parallel["penalizer"].tolist() == PENALIZERS
+    assert serial["mse"].tolist() == pytest.approx(parallel["mse"].tolist(), rel=1e-4)
+    # Cada trecho contíguo começa a frio e os valores seguintes partem do ajuste do vizinho
+    assert serial["warmStart"].tolist() == [False, True, True, True]
+    assert parallel["warmStart"].tolist() == [False, True, False, True]
+    assert sweep.bestPenalizer == serial.loc[serial["mse"].idxmin(), "penalizer"]
+    assert sweep.model.penalizer == sweep.bestPenalizer
+
+
+def test_sweep_writes_best_penalizer(tmp_path, monkeypatch):
+    overridesFile = tmp_path / "params" / "model_overrides.json"
+    with open(pipelines.MODELS_FILE, "rb") as file:
+        models = file.read()
+
+    sweep = PenalizerSweepTask("sweep", GammaGammaModelTask("monetary_model"), [0.0, 0.01, 1.0], nJobs=1,
+                               overridesFile=overridesFile, modelType="monetaryModels", modelId="GammaGammaModel")
+    results = sweep.on_run(ml_training())
+
+    assert results["mse"].notna().all()
+    with open(overridesFile) as file:
+        assert json.load(file) == {"monetaryModels": {"GammaGammaModel": {"penalizer": sweep.bestPenalizer}}}
+    # O Models.json versionado não muda, e o load_model usa o valor gravado
+    with open(pipelines.MODELS_FILE, "rb") as file:
+        assert file.read() == models
+    monkeypatch.setattr(pipelines, "MODEL_OVERRIDES", str(overridesFile))
+    assert pipelines.load_model("monetaryModels", "GammaGammaModel").penalizer == sweep.bestPenalizer
+    assert pipelines.load_model("frequencyModels", "BGFModel").penalizer == 0.1
@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+import pytest
+import pipelines
+from pipelines import calculate_LTV_and_Plot
+from src.DataBase.ModelArtifacts import ArtifactError
+
+
+def churning_transactions(customers=1000, days=400, seed=0):
+    """
+        Compras de um processo de Poisson até o cliente abandonar (as compras uniformes do generate_transactions não
+        têm abandono, e o ajuste do BG/NBD fica degenerado, com predições NaN para frequency 0 quando a + b < 1)
+    """
+    rng = np.random.default_rng(seed)
+    first = rng.uniform(0, days / 2, customers)
+    last = np.minimum(first + rng.exponential(days / 10, customers), days)
+    repeat = rng.poisson(rng.gamma(2, 1 / 10, customers) * (last - first))
+    ids = np.repeat(np.arange(customers), repeat)
+    day = np.concatenate([first, first[ids] + rng.uniform(0, 1, len(ids)) * (last - first)[ids]])
+    return pd.DataFrame({
+        "customer_id": np.concatenate([np.arange(customers), ids]),
+        "date": pd.Timestamp("2024-01-01") + pd.to_timedelta(day, unit="D"),
+        "amount": rng.gamma(2, 10, customers + len(ids)).round(2),
+    }).sort_values("date", ignore_index=True)
+
+
+def run_pipeline(tmp_path, weeksAhead, frequencyModel="BGFModel", monetaryModel="GammaGammaModel", **kwargs):
+    data = {"frequencyModel": frequencyModel, "monetaryModel": monetaryModel, "weeksAhead": weeksAhead}
+    kwargs = {"cacheDir": None, "paramsStore": None, "artifactDir": tmp_path / "models", "candidateCache": None,
+              **kwargs}
+    return calculate_LTV_and_Plot(data, tmp_path / "transactions.csv", **kwargs)
+
+
+@pytest.fixture
+def transactions(tmp_path, monkeypatch):
+    # O PlotTask grava em ./output
+    monkeypatch.chdir(tmp_path)
+    churning_transactions().to_csv(tmp_path / "transactions.csv", index=False)
+
+
+def test_new_horizon_reuses_the_fitted_models(tmp_path, transactions):
+    run_pipeline(tmp_path, 4)
+    # Outro horizonte com os mesmos artefatos dá o mesmo resultado que ajustar de novo
+    scored = run_pipeline(tmp_path, 8, isScoreOnly=True)
+    fitted = run_pipeline(tmp_path, 8, artifactDir=None)
+    pd.testing.assert_frame_equal(fitted, scored)
+
+    # Outra janela de treino é outro ajuste
+    with pytest.raises(ArtifactError):
+        run_pipeline(tmp_path, 8, isScoreOnly=True, trainingPeriods=5)
+
+
+def test_machine_learning_frequency_is_fitted_for_each_horizon(tmp_path, transactions):
+    fitted = run_pipeline(tmp_path, 3, frequencyModel="MachineLearningModel")
+    pd.testing.assert_frame_equal(fitted, run_pipeline(tmp_path, 3, frequencyModel="MachineLearningModel",
+                                                       isScoreOnly=True))
+    # O target é o número de compras na janela do horizonte, então outro horizonte precisa de outro ajuste
+    with pytest.raises(ArtifactError):
+        run_pipeline(tmp_path, 6, frequencyModel="MachineLearningModel", isScoreOnly=True)
+
+
+def test_corrupt_artifact_raises_artifact_error(tmp_path, transactions):
+    run_pipeline(tmp_path, 4)
+    for artifact in (tmp_path / "models").glob("*/v0001.joblib"):
+        artifact.write_bytes(b"corrupt")
+    with pytest.raises(ArtifactError):
+        run_pipeline(tmp_path, 4, isScoreOnly=True)
+
+
+@pytest.mark.parametrize("isDiscountedCashFlow", [False, True])
+def test_ltv_uses_the_prediction_horizon(tmp_path, transactions, isDiscountedCashFlow):
+    weeksAhead = 6
+    df = calculate_LTV_and_Plot({"frequencyModel": "BGFModel", "monetaryModel": "GammaGammaModel",
+                                 "weeksAhead": weeksAhead, "isDiscountedCashFlow": isDiscountedCashFlow},
+                                tmp_path / "transactions.csv", cacheDir=None, paramsStore=None, artifactDir=None,
+                                candidateCache=None)
+    value = df["ExpectedMonetary"] * df["ExpectedFrequency"]
+    # Taxa padrão do LTVTask (1% ao mês) em semanas
+    discount = lambda periods: 1.01 ** (periods / 4.345)
+    if isDiscountedCashFlow:
+        # Os weeksAhead termos somam as compras até weeksAhead (o ExpectedFrequency), cada um descontado pelo seu prazo
+        assert (df["LTV"] >= value / discount(weeksAhead) - 1e-9).all()
+        assert (df["LTV"] <= value / discount(1) + 1e-9).all()
+        assert (df["LTV"] < value / discount(1) - 1e-9).any()
+    else:
+        np.testing.assert_allclose(df["LTV"], np.maximum(value, 0) / discount(weeksAhead))
+
+
+@pytest.mark.parametrize("frequencyModel", ["BGFModel", "MachineLearningModel"])
+def test_new_horizon_and_the_candidate_cache(tmp_path, transactions, monkeypatch, frequencyModel):
+    models = []
+    load_model = pipelines.load_model
+    monkeypatch.setattr(pipelines, "load_model", lambda *args, **kwargs: models.append(load_model(*args, **kwargs))
+                        or models[-1])
+
+    # Sem artefatos os candidatos do modelo monetário de Machine Learning são treinados de novo
+    for weeksAhead in [3, 6]:
+        run_pipeline(tmp_path, weeksAhead, frequencyModel=frequencyModel, monetaryModel="MachineLearningModel",
+                     artifactDir=None, candidateCache=tmp_path / "candidates")
+    first, second = (model.candidateReport for model in models[1::2])
+    assert not any(entry["cached"] for entry in first)
+    if frequencyModel == "BGFModel":
+        # Com BG/NBD a janela de treino não depende do horizonte e os candidatos vêm do cache
+        assert all(entry["cached"] for entry in second)
+        assert [entry["mse"] for entry in first] == [entry["mse"] for entry in second]
+    else:
+        # Com a frequência de Machine Learning a janela de treino é o horizonte, e os dados de treino mudam
+        assert not any(entry["cached"] for entry in second)
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+from lifetimes.utils import calibration_and_holdout_data, summary_data_from_transaction_data
+from src.DataTransformation.RFMEngine import (
+    EncodedTransactions,
+    calibration_and_holdout,
+    calibration_and_holdout_windows,
+    summary_data,
+)
+
+
+def generate_transactions(n=5000, customers=400, seed=42):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "customer_id": rng.integers(0, customers, n),
+        "date": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 400 * 24, n), unit="h"),
+        "amount": rng.gamma(2, 10, n),
+    })
+    # Algumas compras exatamente à meia-noite, caindo em cima dos cortes de calibração
+    df.loc[::7, "date"] = df.loc[::7, "date"].dt.normalize()
+    return df
+
+
+def test_summary_matches_lifetimes():
+    df = generate_transactions()
+    for frequency in ["W", "D"]:
+        transactions = EncodedTransactions(df, "customer_id", "date", "amount", frequency)
+        for observationEnd in [None, "2024-06-03", "2024-09-15 13:00"]:
+            expected = summary_data_from_transaction_data(
+                df, "customer_id", "date", "amount", freq=frequency, observation_period_end=observationEnd)
+            result = summary_data(transactions, observationEnd)
+            pd.testing.assert_frame_equal(expected, result, check_index_type=False)
+
+
+def test_calibration_and_holdout_matches_lifetimes():
+    df = generate_transactions()
+    for frequency in ["W", "D"]:
+        transactions = EncodedTransactions(df, "customer_id", "date", "amount", frequency)
+        for calibrationEnd, observationEnd in [("2024-03-04", "2024-04-01"), ("2024-05-08 12:00", None)]:
+            expected = calibration_and_holdout_data(
+                df, "customer_id", "date", calibrationEnd, observationEnd, freq=frequency, monetary_value_col="amount")
+            result = calibration_and_holdout(transactions, calibrationEnd, observationEnd)
+            pd.testing.assert_frame_equal(expected, result, check_index_type=False)
+
+
+def test_windows_match_concatenated_calibration_and_holdout():
+    df = generate_transactions()
+    transactions = EncodedTransactions(df, "customer_id", "date", "amount", "W")
+    periods = pd.period_range("2024-02-05", "2024-12-30", freq="W")
+    cutoffs = [(periods[i].to_timestamp(), periods[i + 4].to_timestamp()) for i in range(0, len(periods) - 4, 4)]
+
+    expected = pd.concat([
+        calibration_and_holdout_data(
+            df, "customer_id", "date", calibrationEnd, observationEnd, freq="W", monetary_value_col="amount")
+        for calibrationEnd, observationEnd in cutoffs
+    ])
+    result = calibration_and_holdout_windows(transactions, cutoffs)
+    pd.testing.assert_frame_equal(expected, result, check_index_type=False)
+
+
+if __name__ == "__main__":
+    test_summary_matches_lifetimes()
+    test_calibration_and_holdout_matches_lifetimes()
+    test_windows_match_concatenated_calibration_and_holdout()
+    print("RFMEngine e lifetimes produzem os mesmos resultados.")
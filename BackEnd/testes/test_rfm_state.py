@@ -0,0 +1,53 @@
+import pandas as pd
+from lifetimes.utils import summary_data_from_transaction_data
+from src.DataBase.CsvRead import CsvReadTask
+from src.DataBase.RFMStateStore import RFMStateStore
+from src.DataTransformation.RFM import RFMTask
+from src.workflows.pipeline import Pipeline
+from test_rfm_engine import generate_transactions
+
+
+def test_state_matches_lifetimes(tmp_path):
+    df = generate_transactions()
+    # Lotes fora de ordem: o último lote tem compras anteriores às já aplicadas
+    shuffled = df.sample(frac=1, random_state=0)
+    batches = [shuffled.iloc[i::3] for i in range(3)]
+
+    with RFMStateStore(tmp_path / "rfm.sqlite", "W") as store:
+        for batch in batches:
+            assert store.update(batch, "customer_id", "date", "amount")
+        # O mesmo lote não é aplicado duas vezes
+        assert not store.update(batches[0], "customer_id", "date", "amount")
+
+        for observationEnd in [None, "2024-06-03", "2024-09-15 13:00"]:
+            expected = summary_data_from_transaction_data(
+                df, "customer_id", "date", "amount", freq="W", observation_period_end=observationEnd)
+            result = store.summary(observationEnd, "customer_id")
+            pd.testing.assert_frame_equal(expected, result, check_index_type=False)
+
+
+def test_pipeline_over_growing_file(tmp_path):
+    df = generate_transactions()
+    fp = tmp_path / "transactions.csv"
+
+    def run():
+        with Pipeline() as pipeline:
+            read = CsvReadTask("read", fp, "customer_id", "date", "amount", cacheDir=tmp_path / "cache",
+                               isIncremental=True)
+            read >> RFMTask("rfm", stateStore=tmp_path / "rfm.sqlite")
+        return pipeline.run()["rfm"]
+
+    def expected():
+        transactions = pd.read_csv(fp, parse_dates=["date"])
+        return summary_data_from_transaction_data(transactions, "customer_id", "date", "amount", freq="W").rename_axis("id").reset_index()
+
+    # Cada execução recebe o histórico inteiro, e as compras já aplicadas não podem ser contadas de novo
+    df[:3000].to_csv(fp, index=False)
+    pd.testing.assert_frame_equal(expected(), run(), check_dtype=False)
+    for start, end in [(3000, 4000), (4000, 4000), (4000, 5000)]:
+        df[start:end].to_csv(fp, mode="a", header=False, index=False)
+        pd.testing.assert_frame_equal(expected(), run(), check_dtype=False)
+
+    # Arquivo reescrito: o estado é refeito
+    df[500:2000].to_csv(fp, index=False)
+    pd.testing.assert_frame_equal(expected(), run(), check_dtype=False)
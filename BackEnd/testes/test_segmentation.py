@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+from src.DataTransformation.RFM import dictClassificacao
+from src.DataTransformation.Segmentation import describe, quantile_scores, segment
+
+
+def generate_rfm(n=5000, seed=7):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "frequency": rng.poisson(1.5, n).astype(float),
+        "recency": rng.integers(0, 60, n).astype(float),
+        "monetary_value": np.round(rng.gamma(2.0, 30.0, n), 2) * (rng.random(n) > 0.3),
+    })
+
+
+def reference_rating(df):
+    # Implementação original (linha a linha) usada como referência
+    def split(column, percent=0.75):
+        limiar = df[column].sort_values().iloc[int(df.shape[0] * percent)]
+        return np.where(df[column] > limiar, 1, 0)
+
+    groups = pd.DataFrame({
+        "groupFrequency": split("frequency"),
+        "groupRecency": split("recency"),
+        "groupMonetary": split("monetary_value"),
+    })
+    ranking = groups.apply(lambda row: int("".join(row.values.astype(str)), 2), axis=1)
+    return groups, ranking
+
+
+def test_segment_matches_reference():
+    df = generate_rfm()
+    groups, ranking = reference_rating(df)
+
+    result = segment(df["frequency"].to_numpy(), df["recency"].to_numpy(), df["monetary_value"].to_numpy())
+    for column in groups.columns:
+        np.testing.assert_array_equal(result[column], groups[column].to_numpy())
+    np.testing.assert_array_equal(result["rankingClients"], ranking.to_numpy())
+
+    types, descriptions, howToManage = describe(result["rankingClients"], dictClassificacao)
+    assert list(types) == [dictClassificacao[rank][0] for rank in ranking]
+    assert list(descriptions) == [dictClassificacao[rank][1] for rank in ranking]
+    assert list(howToManage) == [dictClassificacao[rank][2] for rank in ranking]
+
+
+def test_quantile_scores():
+    values = np.arange(100, dtype=float)
+    scores = quantile_scores(values, 5)
+    assert scores.min() == 1 and scores.max() == 5
+    # O valor do limite fica na nota de baixo (mesma regra do `>` de split_by_percentage)
+    np.testing.assert_array_equal(np.bincount(scores)[1:], [21, 20, 20, 20, 19])
+
+    # Com 4 notas, a nota máxima é exatamente o grupo alto do corte em 75%
+    df = generate_rfm()
+    high = segment(df["frequency"], df["recency"], df["monetary_value"])["groupMonetary"]
+    np.testing.assert_array_equal(quantile_scores(df["monetary_value"], 4) == 4, high == 1)
+
+
+if __name__ == "__main__":
+    test_segment_matches_reference()
+    test_quantile_scores()
+    print("Segmentação vetorizada igual à implementação original")
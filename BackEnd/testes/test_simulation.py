@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from src.LTV.LtvModel import LTVTask
+from src.LTV.Simulation import SimulationLTVTask
+from src.MonetaryModels.GammaGammaModel import GammaGammaModelTask
+from src.TrasactionModels.BGFModel import BGFModelTask
+from src.TrasactionModels.ParetoModel import ParetoModelTask
+from testes.test_transaction_models import rfm_training
+
+
+@pytest.mark.parametrize("modelClass", [BGFModelTask, ParetoModelTask])
+def test_simulation_matches_closed_form(modelClass):
+    training = rfm_training(2000)
+    df = training.rename(columns=lambda column: column.replace("_cal", ""))
+    df = df[df["frequency"] > 0].copy()
+    df["monetary_value"] = np.random.default_rng(1).gamma(4.0, 10.0, len(df))
+
+    transactionModel = modelClass("transaction_model", engine="native", numPeriods=13)
+    transactionModel.fit(training)
+    monetaryModel = GammaGammaModelTask("monetary_model")
+    monetaryModel.fit(df, "monetary_value", "frequency")
+    df["ExpectedFrequency"] = transactionModel.predict(df)
+    df["ExpectedMonetary"] = monetaryModel.predict(df, "monetary_value", "frequency")
+    ltv = LTVTask("ltv", columnFrequency="ExpectedFrequency", columnMonetary="ExpectedMonetary",
+                  isDiscountedCashFlow=True, transactionModel=transactionModel, numPeriods=13)
+    df = ltv.on_run(df)
+
+    results = []
+    for nThreads in [1, 2]:
+        simulation = SimulationLTVTask("simulation", transactionModel, monetaryModel, ltv, nSimulations=400,
+                                       chunkSize=1 << 18, nThreads=nThreads)
+        results.append(simulation.on_run(df.copy()))
+    assert simulation.throughput["chunks"] > 1 and simulation.throughput["simulationsPerSecond"] > 0
+
+    # Mesmas sementes por bloco, mesmo resultado com qualquer número de threads
+    np.testing.assert_array_equal(results[0]["SimulatedLTV"], results[1]["SimulatedLTV"])
+    result = results[0]
+    assert result["SimulatedFrequency"].sum() == pytest.approx(result["ExpectedFrequency"].sum(), rel=0.02)
+    assert result["SimulatedLTV"].sum() == pytest.approx(result["LTV"].sum(), rel=0.02)
+    assert simulation.portfolio.mean() == pytest.approx(result["SimulatedLTV"].sum())
+    assert (result["SimulatedLTV_p5"] <= result["SimulatedLTV_p50"]).all()
+    assert (result["SimulatedLTV_p50"] <= result["SimulatedLTV_p95"]).all()
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+from src.DataBase.TransactionIndex import TransactionIndex
+
+
+def transactions(kind):
+    rng = np.random.default_rng(0)
+    n = 3000
+    ids = rng.integers(0, 200, n)
+    df = pd.DataFrame({
+        "id": ids,
+        "date": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 400, n), unit="D"),
+        "monetary": rng.gamma(2, 10, n),
+    })
+    if kind == "object":
+        # Inteiros guardados como objeto (ex: coluna lida junto com textos)
+        df["id"] = df["id"].astype(object)
+    elif kind == "text":
+        df["id"] = "c" + df["id"].astype(str)
+    elif kind == "nan":
+        df["id"] = df["id"].astype(float)
+        df.loc[::17, "id"] = np.nan
+    return df
+
+
+def expected_customer(df, customerID):
+    rows = df[df["id"] == customerID].sort_values("date", kind="stable")
+    return pd.DataFrame({"id": np.repeat(customerID, len(rows)), "date": rows["date"].to_numpy(),
+                         "monetary": rows["monetary"].to_numpy()})
+
+
+@pytest.mark.parametrize("kind", ["int", "object", "text", "nan"])
+@pytest.mark.parametrize("saved", [False, True])
+def test_index_matches_pandas_filters(tmp_path, kind, saved):
+    df = transactions(kind)
+    index = TransactionIndex.from_frame(df)
+    if saved:
+        index.save(tmp_path / "index")
+        index = TransactionIndex.load(tmp_path / "index")
+
+    customers = df["id"].dropna().unique()[:20].tolist()
+    for customerID in customers:
+        pd.testing.assert_frame_equal(expected_customer(df, customerID), index.customer(customerID), check_dtype=False)
+    assert index.customer("unknown").empty
+
+    for selection in [customers, customers + [np.nan], []]:
+        for exclude in [False, True]:
+            mask = df["id"].isin(selection)
+            expected = np.flatnonzero(~mask if exclude else mask)
+            np.testing.assert_array_equal(expected, index.rows_of(selection, exclude=exclude))
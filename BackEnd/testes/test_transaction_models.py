@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+import pytest
+from lifetimes.generate_data import beta_geometric_nbd_model
+from src.DataBase.ModelArtifacts import ModelArtifactStore
+from src.LTV.LtvModel import LTVTask
+from src.TrasactionModels.BGFModel import BGFModelTask
+from src.TrasactionModels.ParetoModel import ParetoModelTask
+
+
+def rfm_training(size=5000, seed=0):
+    # Clientes simulados por um BG/NBD, em semanas inteiras como na saída do RFMTask
+    np.random.seed(seed)
+    customers = beta_geometric_nbd_model(52, 0.25, 4.0, 0.8, 2.5, size=size)
+    df = pd.DataFrame({
+        "frequency_cal": np.floor(customers["frequency"]),
+        "recency_cal": np.floor(customers["recency"]),
+        "T_cal": np.floor(customers["T"]),
+    })
+    df.loc[df["frequency_cal"] == 0, "recency_cal"] = 0
+    return df
+
+
+def test_compressed_fit_matches_full_fit():
+    training = rfm_training()
+    for modelTask in [BGFModelTask, ParetoModelTask]:
+        full = modelTask("full", isCompressed=False)
+        compressed = modelTask("compressed", isCompressed=True)
+        full.fit(training)
+        compressed.fit(training)
+
+        frequency, _, _, weights = compressed.sufficient_statistics(training)
+        assert weights.sum() == len(training) and len(frequency) < len(training) / 5
+
+        np.testing.assert_allclose(compressed.model.params_.to_numpy(), full.model.params_.to_numpy(), rtol=1e-3)
+
+        # Com os mesmos parâmetros, a predição agrupada é exatamente a predição linha a linha
+        full.model.params_ = compressed.model.params_
+        np.testing.assert_allclose(compressed.predict(training, True), full.predict(training, True), rtol=1e-10)
+
+
+def test_native_engine_matches_lifetimes():
+    training = rfm_training()
+    for modelTask in [BGFModelTask, ParetoModelTask]:
+        lifetimes = modelTask("lifetimes", isCompressed=False)
+        native = modelTask("native", isCompressed=False, engine="native")
+        lifetimes.fit(training)
+        native.fit(training)
+
+        np.testing.assert_allclose(native.model.params_.to_numpy(), lifetimes.model.params_.to_numpy(), rtol=1e-3)
+
+        # Mesma fórmula de predição: com os mesmos parâmetros o resultado é o mesmo
+        native.model.params_ = lifetimes.model.params_
+        np.testing.assert_allclose(native.predict(training, True), lifetimes.predict(training, True), rtol=1e-8)
+
+
+@pytest.mark.parametrize("engine", ["lifetimes", "native"])
+@pytest.mark.parametrize("modelTask", [BGFModelTask, ParetoModelTask])
+def test_warm_start_reuses_previous_params(tmp_path, modelTask, engine):
+    training = rfm_training()
+    store = tmp_path / "params.json"
+    cold = modelTask("cold", engine=engine, paramsStore=store, datasetKey="dataset")
+    cold.fit(training)
+    warm = modelTask("warm", engine=engine, paramsStore=store, datasetKey="dataset")
+    warm.fit(training)
+
+    assert not cold.fitReport["warmStart"] and warm.fitReport["warmStart"]
+    assert warm.fitReport["evaluations"] < cold.fitReport["evaluations"]
+    assert warm.fitReport["maxRelativeChange"] < 1e-3
+    np.testing.assert_allclose(warm.model.params_.to_numpy(), cold.model.params_.to_numpy(), rtol=1e-3)
+
+
+def test_artifact_round_trip(tmp_path):
+    training = rfm_training()
+    store = ModelArtifactStore(tmp_path)
+    fitted = ParetoModelTask("fitted", engine="native")
+    fitted.fit(training)
+    key = store.key("fingerprint", "ParetoModel")
+    assert store.save(key, fitted.to_artifact()) == 1
+    assert store.save(key, fitted.to_artifact()) == 2
+
+    loaded = ParetoModelTask("loaded", engine="native")
+    loaded.load_artifact(store.load(key))
+    assert loaded.isFitted and [v["version"] for v in store.versions(key)] == [1, 2]
+    np.testing.assert_array_equal(loaded.predict(training, True), fitted.predict(training, True))
+
+
+def test_horizon_matrix_matches_single_horizon_predictions():
+    training = rfm_training()
+    horizons = [4, 13, 26, 52]
+    for modelTask, engine in [(BGFModelTask, "lifetimes"), (ParetoModelTask, "lifetimes"), (ParetoModelTask, "native")]:
+        model = modelTask("model", engine=engine)
+        model.fit(training)
+        matrix = model.predict_horizons(training, horizons, True)
+        assert list(matrix.columns) == horizons and (matrix.index == training.index).all()
+        for horizon in horizons:
+            model.numPeriods = horizon
+            np.testing.assert_allclose(matrix[horizon], model.predict(training, True), rtol=1e-9)
+
+
+def test_discounted_cash_flow_ltv():
+    df = rfm_training().rename(columns=lambda column: column.replace("_cal", ""))
+    df["ExpectedMonetary"] = np.random.default_rng(0).gamma(2.0, 20.0, len(df))
+    model = BGFModelTask("model")
+    model.fit(df, isTraining=False)
+
+    ltv = LTVTask("ltv", columnMonetary="ExpectedMonetary", numPeriods=26, isDiscountedCashFlow=True,
+                  transactionModel=model).on_run(df.copy())["LTV"]
+
+    # Laço período a período, como o customer_lifetime_value do lifetimes
+    expected = np.zeros(len(df))
+    previous = 0.0
+    for period in range(1, 27):
+        model.numPeriods = period
+        current = model.predict(df)
+        expected += df["ExpectedMonetary"].to_numpy() * (current - previous) / 1.01 ** (period / 4.345)
+        previous = current
+    np.testing.assert_allclose(ltv, expected, rtol=1e-9)
+    assert (ltv >= 0).all()